@@ -0,0 +1,81 @@
+from django.db import router
+from django.utils.translation import ugettext as _
+from rest_framework import exceptions
+from rest_framework_jwt.authentication import JSONWebTokenAuthentication
+
+from mappoints.core.models import User
+from mappoints.core.tokens import get_token_cache, get_token_version_key
+
+def get_token_version(pk):
+    """
+    Get the current token version of an active user.
+
+    The version is read from the token cache, and only looked up from the
+    database (and cached) when it is missing. The cached versions are removed
+    whenever a user is saved, deleted or has their tokens revoked. The token
+    cache must be shared by every process, or be a dummy cache.
+
+    Parameters:
+        - pk: id of the user
+
+    Returns:
+        - the token version, or None if the user does not exist or is not active
+    """
+
+    cache = get_token_cache()
+    key = get_token_version_key(pk)
+
+    version = cache.get(key)
+    if version is None:
+        version = User.objects.filter(pk=pk, is_active=True).values_list('token_version', flat=True).first()
+        cache.set(key, -1 if version is None else version)
+    return None if version == -1 else version
+
+def get_claims_user(claims):
+    """
+    Build a User instance from the claims of a token without querying the database.
+
+    The id, username, superuser status and token version are set from the claims.
+    The other fields are deferred, so they are loaded from the database only
+    if they are accessed.
+    """
+
+    values = {
+        'id': claims['user_id'],
+        'username': claims['username'],
+        'is_active': True,
+        'is_superuser': claims['is_superuser'],
+        'token_version': claims['token_version'],
+    }
+    field_names = [field.attname for field in User._meta.concrete_fields if field.attname in values]
+    return User.from_db(router.db_for_read(User), field_names, [values[name] for name in field_names])
+
+class ClaimsJSONWebTokenAuthentication(JSONWebTokenAuthentication):
+    """
+    JWT authentication that builds the user from the signed claims of the token
+    instead of looking the user up for every request.
+
+    A token is only accepted while its 'token_version' claim matches the user's
+    current token version, which changes when the user's tokens are revoked,
+    when the user is deactivated or deleted, and when their username, password
+    or superuser status changes. The current versions are cached, so a request
+    normally doesn't touch the user table at all.
+
+    Tokens issued without the 'token_version' claim are authenticated with the
+    regular user lookup.
+    """
+
+    def authenticate_credentials(self, payload):
+        if 'token_version' not in payload:
+            return super().authenticate_credentials(payload)
+
+        user_id = payload.get('user_id')
+        if (not isinstance(user_id, int) or
+                not isinstance(payload.get('username'), str) or
+                not isinstance(payload.get('is_superuser'), bool)):
+            raise exceptions.AuthenticationFailed(_('Invalid payload.'))
+
+        if get_token_version(user_id) != payload['token_version']:
+            raise exceptions.AuthenticationFailed(_('Token has been revoked.'))
+
+        return get_claims_user(payload)
@@ -0,0 +1,317 @@
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from rest_framework.exceptions import ValidationError
+from rest_framework.reverse import reverse
+
+from mappoints.core.models import Point, Star, Tag, Tombstone, Version
+from mappoints.core.serializers import PointSerializer, StarOperationSerializer, TagOperationSerializer
+
+MAX_BULK_POINTS = 5000
+MAX_BULK_OPERATIONS = 5000
+BULK_BATCH_SIZE = 500
+POINT_CONFLICT = 'A point with this name by this user already exists.'
+REPEATED_OPERATION = 'The request has an earlier operation on the same resource.'
+
+def create_points(items, creator, context):
+    """
+    Create points from the items of a bulk create request.
+
+    All the items are validated with a single serializer. For each batch of
+    BULK_BATCH_SIZE valid items, the names already taken by the creator are
+    looked up with a single query, and the remaining points are inserted with
+    a single bulk_create in a savepoint. Names repeated within the request
+    conflict with their first occurrence. A batch that conflicts with points
+    inserted concurrently is inserted again point by point.
+
+    Parameters:
+        - items: list of point representations
+        - creator: the user creating the points
+        - context: the serializer context of the request
+
+    Returns:
+        - list of results in the order of the items, each a dictionary with the
+          'status' of the item (201, 400 or 409) and either the '_url' and 'id'
+          of the created point, the validation 'errors' or the conflict 'detail'
+    """
+
+    serializer = PointSerializer(context=context)
+    results = [None] * len(items)
+
+    valid = []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, serializer.run_validation(item)))
+        except ValidationError as error:
+            results[index] = {'status': 400, 'errors': error.detail}
+
+    seen = set()
+    for start in range(0, len(valid), BULK_BATCH_SIZE):
+        batch = valid[start:start + BULK_BATCH_SIZE]
+        names = [data['name'] for index, data in batch]
+        taken = set(Point.objects.filter(creator=creator, name__in=names).values_list('name', flat=True))
+
+        points = []
+        for index, data in batch:
+            if data['name'] in taken or data['name'] in seen:
+                results[index] = {'status': 409, 'detail': POINT_CONFLICT}
+            else:
+                seen.add(data['name'])
+                points.append((index, Point(creator=creator, **data)))
+
+        insert_points(points, creator, results)
+
+    url = reverse('point-detail', kwargs={'pk': '~pk~'}, request=context['request']).replace('~pk~', '{}')
+    for index, result in enumerate(results):
+        if result['status'] == 201:
+            results[index] = {'_url': url.format(result['id']), 'id': result['id'], 'status': 201}
+    return results
+
+def insert_points(points, creator, results):
+    """
+    Insert a batch of points with bulk_create, falling back to inserting them
+    one by one if the batch violates a unique constraint.
+
+    Parameters:
+        - points: list of (item index, unsaved Point) tuples
+        - creator: the user creating the points
+        - results: the list of results, updated at the indexes of the points
+    """
+
+    if not points:
+        return
+
+    try:
+        with transaction.atomic():
+            Point.objects.bulk_create([point for index, point in points])
+    except IntegrityError:
+        for index, point in points:
+            try:
+                with transaction.atomic():
+                    point.save()
+            except IntegrityError:
+                if not Point.objects.filter(creator=creator, name=point.name).exists():
+                    raise
+                results[index] = {'status': 409, 'detail': POINT_CONFLICT}
+            else:
+                results[index] = {'status': 201, 'id': point.pk}
+        return
+
+    if any(point.pk is None for index, point in points):
+        # Not every database returns the ids of rows inserted in bulk.
+        names = [point.name for index, point in points]
+        ids = dict(Point.objects.filter(creator=creator, name__in=names).values_list('name', 'id'))
+        for index, point in points:
+            point.pk = ids[point.name]
+
+    for index, point in points:
+        results[index] = {'status': 201, 'id': point.pk}
+
+def change_stars(items, creator_id, context):
+    """
+    Star and unstar many points for a user in a single transaction.
+
+    Parameters:
+        - items: list of operations, each with an 'op' ('add' or 'remove') and a 'point' id
+        - creator_id: id of the user whose stars are changed
+        - context: the serializer context of the request
+
+    Returns:
+        - list of results in the order of the items (see apply_operations)
+    """
+
+    def build(point_ids):
+        existing = set(Point.objects.filter(id__in=point_ids).values_list('id', flat=True))
+        return {pk: Star(creator_id=creator_id, point_id=pk) for pk in point_ids if pk in existing}
+
+    queryset = Star.objects.filter(creator=creator_id)
+    return apply_operations(items, StarOperationSerializer(context=context), queryset, 'point', build, context)
+
+def change_tags(items, point, creator_id, context):
+    """
+    Add and remove many tags of a point in a single transaction.
+
+    Parameters:
+        - items: list of operations, each with an 'op' ('add' or 'remove') and a tag 'name'
+        - point: the point whose tags are changed
+        - creator_id: id of the user creating the tags
+        - context: the serializer context of the request
+
+    Returns:
+        - list of results in the order of the items (see apply_operations)
+    """
+
+    def build(names):
+        return {name: Tag(name=name, point=point, creator_id=creator_id) for name in names}
+
+    queryset = Tag.objects.filter(point=point)
+    return apply_operations(items, TagOperationSerializer(context=context), queryset, 'name', build, context)
+
+def apply_operations(items, serializer, queryset, key, build, context):
+    """
+    Apply the 'add' and 'remove' operations of a bulk request on the stars or tags of points.
+
+    All the items are validated with a single serializer, and an item naming
+    the same resource as an earlier item conflicts with it. The operations
+    are then applied in a single transaction in batches of BULK_BATCH_SIZE:
+    the existing resources of a batch are looked up (and locked) with a single
+    query, the new ones are inserted with a single bulk_create and the removed
+    ones are deleted with a single delete. The counts of the changed points
+    are corrected with one update per distinct change.
+
+    Parameters:
+        - items: list of operations
+        - serializer: the serializer validating an operation
+        - queryset: the resources the operations apply to, in which the key is unique
+        - key: the field of a resource named by an operation ('point' or 'name')
+        - build: function taking a list of key values and returning a dictionary
+          of the new (unsaved) resources by key value, without the values of
+          resources that cannot be created
+        - context: the serializer context of the request
+
+    Returns:
+        - list of results in the order of the items, each a dictionary with the
+          'status' of the item (201, 204, 400, 404 or 409) and either the '_url'
+          and 'id' of the created resource, the validation 'errors' or the 'detail'
+          of the failure
+    """
+
+    model = queryset.model
+    results = [None] * len(items)
+
+    operations = []
+    seen = set()
+    for index, item in enumerate(items):
+        try:
+            data = serializer.run_validation(item)
+        except ValidationError as error:
+            results[index] = {'status': 400, 'errors': error.detail}
+            continue
+        if data[key] in seen:
+            results[index] = {'status': 409, 'detail': REPEATED_OPERATION}
+        else:
+            seen.add(data[key])
+            operations.append((index, data['op'], data[key]))
+
+    with transaction.atomic():
+        for start in range(0, len(operations), BULK_BATCH_SIZE):
+            apply_batch(operations[start:start + BULK_BATCH_SIZE], queryset, key, build, results)
+
+    name = model._meta.model_name
+    url = reverse('point-{}-detail'.format(name), kwargs={'point_pk': '~point~', 'pk': '~pk~'},
+                  request=context['request']).replace('~point~', '{point}').replace('~pk~', '{pk}')
+    for index, result in enumerate(results):
+        if result['status'] == 201:
+            results[index] = {'_url': url.format(**result), 'id': result['pk'], 'status': 201}
+    return results
+
+def apply_batch(operations, queryset, key, build, results):
+    """
+    Apply a batch of validated operations (see apply_operations).
+
+    Parameters:
+        - operations: list of (item index, op, key value) tuples
+        - queryset: the resources the operations apply to
+        - key: the field of a resource named by an operation
+        - build: function building the new resources
+        - results: the list of results, updated at the indexes of the operations
+    """
+
+    model = queryset.model
+    name = model._meta.model_name
+    values = [value for index, op, value in operations]
+    existing = {
+        value: (pk, point_id) for value, pk, point_id in
+        queryset.select_for_update().filter(**{key + '__in': values}).values_list(key, 'id', 'point')
+    }
+
+    added = []
+    removed = []
+    for index, op, value in operations:
+        if op == 'add' and value in existing:
+            results[index] = {'status': 409, 'detail': 'The {} already exists.'.format(name)}
+        elif op == 'add':
+            added.append((index, value))
+        elif value in existing:
+            removed.append(existing[value])
+            results[index] = {'status': 204}
+        else:
+            results[index] = {'status': 404, 'detail': 'The {} does not exist.'.format(name)}
+
+    built = build([value for index, value in added])
+    new = []
+    for index, value in added:
+        if value in built:
+            new.append((index, built[value]))
+        else:
+            results[index] = {'status': 404, 'detail': 'The point does not exist.'}
+
+    changes = defaultdict(int)
+    for index, obj in insert_children(new, queryset, key, results):
+        changes[obj.point_id] += 1
+    if removed:
+        # The point counts are corrected below with set-based updates, so the
+        # rows are deleted without sending a post_delete signal for each one.
+        removed_ids = [pk for pk, point_id in removed]
+        model.objects.filter(id__in=removed_ids)._raw_delete(model.objects.db)
+        Tombstone.objects.record(name, removed_ids)
+        for pk, point_id in removed:
+            changes[point_id] -= 1
+
+    if changes:
+        Point.objects.change_counts('{}_count'.format(name), changes)
+        Version.objects.bump(name)
+
+def insert_children(children, queryset, key, results):
+    """
+    Insert a batch of stars or tags with bulk_create, falling back to saving them
+    one by one if the batch violates a constraint. A resource saved one by one
+    that already exists gives a 409, and one whose point has been deleted meanwhile a 404.
+
+    The resources saved one by one update the counts of their points through
+    the model signals, the ones inserted in bulk must be counted by the caller.
+
+    Parameters:
+        - children: list of (item index, unsaved resource) tuples
+        - queryset: the resources the children are added to
+        - key: the field of a resource named by an operation
+        - results: the list of results, updated at the indexes of the children
+
+    Returns:
+        - list of the (item index, resource) tuples inserted in bulk
+    """
+
+    if not children:
+        return []
+
+    model = queryset.model
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create([obj for index, obj in children])
+    except IntegrityError:
+        for index, obj in children:
+            try:
+                with transaction.atomic():
+                    obj.save()
+            except IntegrityError:
+                if queryset.filter(**{key: obj.serializable_value(key)}).exists():
+                    results[index] = {'status': 409, 'detail': 'The {} already exists.'.format(model._meta.model_name)}
+                elif not Point.objects.filter(pk=obj.point_id).exists():
+                    # The point was deleted by a concurrent request after the batch was built.
+                    results[index] = {'status': 404, 'detail': 'The point does not exist.'}
+                else:
+                    raise
+            else:
+                results[index] = {'status': 201, 'pk': obj.pk, 'point': obj.point_id}
+        return []
+
+    if any(obj.pk is None for index, obj in children):
+        # Not every database returns the ids of rows inserted in bulk.
+        values = [obj.serializable_value(key) for index, obj in children]
+        ids = dict(queryset.filter(**{key + '__in': values}).values_list(key, 'id'))
+        for index, obj in children:
+            obj.pk = ids[obj.serializable_value(key)]
+
+    for index, obj in children:
+        results[index] = {'status': 201, 'pk': obj.pk, 'point': obj.point_id}
+    return children
@@ -0,0 +1,611 @@
+from collections import OrderedDict, defaultdict
+from decimal import Decimal, Context
+from operator import itemgetter
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.reverse import reverse
+from rest_framework.settings import api_settings
+from rest_framework import ISO_8601
+from rest_flex_fields import split_levels
+
+from mappoints.core.models import Point, Tag, Comment, Star
+from mappoints.core.serializers import (UserSerializer,
+                                        PointSerializer,
+                                        CommentSerializer,
+                                        TagSerializer,
+                                        StarSerializer)
+from mappoints.core.utils import get_link_builder, get_parent_path
+from mappoints.core.representations import get_representation_cache, get_point_key
+
+class CompiledSerializer:
+    """
+    A read-only serializer that produces the same representation as its
+    HyperlinkedModelSerializer counterpart from .values() rows.
+
+    Url templates and field formatters are prepared once per request,
+    so serializing a row only consists of dictionary lookups, string
+    formatting and grouping of the related ids fetched with one query
+    per related link list. Model instances are never created.
+
+    Sparse fieldsets ('fields' parameter) are compiled too: only the columns
+    of the requested fields are selected and only the requested link lists
+    are fetched. Requests with an 'expand' parameter use the regular serializers.
+    """
+
+    serializer_class = None
+    columns = ()
+    field_names = ()
+    field_columns = {}
+    decimal_exponent = Decimal('0.000001')
+    decimal_context = Context(prec=9)
+
+    def __init__(self, context, fields=None):
+        self.context = context
+        self.request = context['request']
+        self.timezone = timezone.get_current_timezone() if settings.USE_TZ else None
+        self.fields = fields
+
+    def get_columns(self, extra=()):
+        """
+        Get the columns needed for the representation: all the compiled columns
+        for the default representation, or the columns of the requested fields
+        (a field reads the column of the same name unless field_columns says otherwise)
+        and the 'id' for a sparse fieldset.
+
+        Parameters:
+            - extra: columns needed besides the representation, e.g. the ordering of a page
+
+        Returns:
+            - tuple of column names in the order of the compiled columns, followed by the extra columns
+        """
+
+        if self.fields is None:
+            columns = self.columns
+        else:
+            needed = {'id'}.union(extra)
+            for name in self.fields:
+                needed.update(self.field_columns.get(name, (name,)))
+            columns = tuple(column for column in self.columns if column in needed)
+        return columns + tuple(column for column in extra if column not in columns)
+
+    def get_queryset(self, queryset, extra=()):
+        """
+        Get the rows to serialize as dictionaries of the needed columns.
+
+        Parameters:
+            - queryset: the queryset of the serialized resources
+            - extra: columns needed besides the representation, e.g. the ordering of a page
+        """
+
+        return queryset.values(*self.get_columns(extra))
+
+    def get_url_template(self, view_name, *lookups):
+        """
+        Reverse an absolute url once with placeholders in place of the lookups,
+        giving a template that is filled in with str.format for each row.
+
+        Parameters:
+            - view_name: the name of the url pattern
+            - lookups: names of the url keyword arguments
+
+        Returns:
+            - url template string with a '{lookup}' replacement field for each lookup
+        """
+
+        markers = {lookup: '~{}~'.format(lookup) for lookup in lookups}
+        url = reverse(view_name, kwargs=markers, request=self.request)
+        template = url.replace('{', '{{').replace('}', '}}')
+        for lookup, marker in markers.items():
+            template = template.replace(marker, '{' + lookup + '}')
+        return template
+
+    def get_related_ids(self, model, key, rows, *columns):
+        """
+        Get the related rows of a link list grouped by the row they belong to.
+
+        Parameters:
+            - model: the related model
+            - key: the foreign key column pointing to the serialized rows
+            - rows: the serialized rows
+            - columns: the related columns to fetch
+
+        Returns:
+            - dictionary mapping row ids to lists of related column tuples
+        """
+
+        related = defaultdict(list)
+        ids = [row['id'] for row in rows]
+        if not ids:
+            return related
+
+        for values in model.objects.filter(**{key + '__in': ids}).values_list(key, *columns):
+            related[values[0]].append(values[1:])
+        return related
+
+    def format_decimal(self, value):
+        """
+        Format a decimal like a DecimalField with 6 decimal places.
+        """
+
+        if not isinstance(value, Decimal):
+            value = Decimal(str(value).strip())
+        return '{0:f}'.format(value.quantize(self.decimal_exponent, context=self.decimal_context))
+
+    def format_datetime(self, value):
+        """
+        Format a datetime like a DateTimeField with the ISO 8601 format.
+        """
+
+        if value is None:
+            return None
+        if self.timezone is not None:
+            if timezone.is_aware(value):
+                value = value.astimezone(self.timezone)
+            else:
+                value = timezone.make_aware(value, self.timezone)
+        elif timezone.is_aware(value):
+            value = timezone.make_naive(value, timezone.utc)
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+
+    def get_collection_links(self, pk):
+        """
+        Get the url of a serialized instance and the '_parent' url of its nested
+        collections in the same way as PointSerializer and UserSerializer.
+        """
+
+        links = get_link_builder(self.request)
+        path = self.context.get('path', links.path)
+
+        if self.context.get('action') in ['list', 'create', 'delete']:
+            path = '{}{}/'.format(path, pk)
+
+        parent_url = '{}{}{}/'.format(links.prefix, get_parent_path(path), pk)
+        return links.get_url(path), parent_url
+
+    def get_link_list_formatter(self, name, related, template, lookups, row_lookup=None):
+        """
+        Get a formatter of a link list ('_items', '_url' and '_parent') of a sparse fieldset.
+
+        Parameters:
+            - name: the name of the link list, which is also the last segment of its '_url'
+            - related: the related column tuples grouped by row id (see get_related_ids)
+            - template: the url template of the related resources
+            - lookups: the url template lookups filled in with the related column tuples
+            - row_lookup: the url template lookup filled in with the id of the row, if any
+
+        Returns:
+            - function formatting the link list of a row
+        """
+
+        def format(row):
+            pk = row['id']
+            url, parent_url = self.get_collection_links(pk)
+            items = []
+            for values in related[pk]:
+                kwargs = dict(zip(lookups, values))
+                if row_lookup is not None:
+                    kwargs[row_lookup] = pk
+                items.append({'_url': template.format(**kwargs)})
+            return {'_items': items, '_url': url + name + '/', '_parent': parent_url}
+        return format
+
+    def get_formatters(self, rows):
+        """
+        Get the formatters of the requested fields of a sparse fieldset,
+        fetching the related ids of the requested link lists of the rows.
+
+        Parameters:
+            - rows: list of dictionaries with the needed columns
+
+        Returns:
+            - dictionary mapping field names to functions formatting the field of a row
+        """
+
+        raise NotImplementedError
+
+    def serialize(self, rows):
+        """
+        Serialize a list of rows.
+
+        Parameters:
+            - rows: list of dictionaries with the needed columns (see get_queryset)
+
+        Returns:
+            - list of serialized representations
+        """
+
+        if self.fields is None:
+            return self.serialize_default(rows)
+
+        formatters = self.get_formatters(rows)
+        fields = [(name, formatters[name]) for name in self.fields]
+        return [OrderedDict((name, format(row)) for name, format in fields) for row in rows]
+
+    def serialize_default(self, rows):
+        """
+        Serialize a list of rows into the default representation.
+        """
+
+        raise NotImplementedError
+
+    def serialize_iterator(self, rows, chunk_size=100):
+        """
+        Serialize an iterator of rows lazily, one chunk of rows at a time.
+
+        Parameters:
+            - rows: iterator of dictionaries with the compiled columns
+            - chunk_size: number of rows serialized (and related ids fetched) at a time
+
+        Returns:
+            - generator of serialized representations
+        """
+
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield from self.serialize(chunk)
+                chunk = []
+        if chunk:
+            yield from self.serialize(chunk)
+
+class CompiledPointChildSerializer(CompiledSerializer):
+    """
+    Compiled serializer for the resources nested under a Point (comments, tags and stars).
+    """
+
+    view_name = None
+    field_columns = {'_url': ('point_id',), 'point': ('point_id',), 'creator': ('creator_id',)}
+
+    def get_formatters(self, rows):
+        url = self.get_url_template(self.view_name, 'point_pk', 'pk')
+        point_url = self.get_url_template('point-detail', 'pk')
+        user_url = self.get_url_template('user-detail', 'pk')
+
+        formatters = {
+            '_url': lambda row: url.format(point_pk=row['point_id'], pk=row['id']),
+            'created': lambda row: self.format_datetime(row['created']),
+            'point': lambda row: {'_url': point_url.format(pk=row['point_id'])},
+            'creator': lambda row: {'_url': user_url.format(pk=row['creator_id'])},
+        }
+        for name in self.field_names:
+            formatters.setdefault(name, itemgetter(name))
+        return formatters
+
+    def serialize_default(self, rows):
+        url = self.get_url_template(self.view_name, 'point_pk', 'pk')
+        point_url = self.get_url_template('point-detail', 'pk')
+        user_url = self.get_url_template('user-detail', 'pk')
+        fields = [column for column in self.columns if column not in ('id', 'created', 'point_id', 'creator_id')]
+        format_datetime = self.format_datetime
+
+        data = []
+        for row in rows:
+            item = OrderedDict()
+            item['_url'] = url.format(point_pk=row['point_id'], pk=row['id'])
+            item['id'] = row['id']
+            for field in fields:
+                item[field] = row[field]
+            item['created'] = format_datetime(row['created'])
+            item['point'] = {'_url': point_url.format(pk=row['point_id'])}
+            item['creator'] = {'_url': user_url.format(pk=row['creator_id'])}
+            data.append(item)
+        return data
+
+class CompiledCommentSerializer(CompiledPointChildSerializer):
+    """
+    Compiled counterpart of CommentSerializer.
+    """
+
+    serializer_class = CommentSerializer
+    field_names = ('_url', 'id', 'content', 'created', 'point', 'creator')
+    columns = ('id', 'content', 'created', 'point_id', 'creator_id')
+    view_name = 'point-comment-detail'
+
+class CompiledTagSerializer(CompiledPointChildSerializer):
+    """
+    Compiled counterpart of TagSerializer.
+    """
+
+    serializer_class = TagSerializer
+    field_names = ('_url', 'id', 'name', 'created', 'point', 'creator')
+    columns = ('id', 'name', 'created', 'point_id', 'creator_id')
+    view_name = 'point-tag-detail'
+
+class CompiledStarSerializer(CompiledPointChildSerializer):
+    """
+    Compiled counterpart of StarSerializer.
+    """
+
+    serializer_class = StarSerializer
+    field_names = ('_url', 'id', 'created', 'point', 'creator')
+    columns = ('id', 'created', 'point_id', 'creator_id')
+    view_name = 'point-star-detail'
+
+class CompiledPointSerializer(CompiledSerializer):
+    """
+    Compiled counterpart of PointSerializer.
+
+    The request independent part of each point's representation (its formatted
+    fields and the ids of its comments, tags and stars) is cached as a fragment
+    in the 'representations' cache, so the related ids are only fetched for the
+    points that are not cached. The urls are formatted from the fragments for
+    each request, so a fragment is shared by every host and collection path.
+
+    A fragment is only used if it was built from the point's current 'updated'
+    time, which changes whenever the point or one of its comments, tags or
+    stars changes, so fragments left in the caches of other processes are never used.
+    """
+
+    serializer_class = PointSerializer
+    columns = ('id', 'name', 'latitude', 'longitude', 'description', 'created', 'updated', 'creator_id',
+               'comment_count', 'tag_count', 'star_count')
+    field_names = ('_url', 'id', 'name', 'latitude', 'longitude', 'description', 'created', 'creator',
+                   'comments', 'tags', 'stars', 'comment_count', 'tag_count', 'star_count')
+    field_columns = {'creator': ('creator_id',)}
+
+    def get_fragments(self, rows):
+        """
+        Get the representation fragments of the rows from the cache, building and
+        caching the fragments that are missing or out of date.
+
+        Parameters:
+            - rows: list of dictionaries with the compiled columns
+
+        Returns:
+            - list of fragments in the order of the rows
+        """
+
+        cache = get_representation_cache()
+        cached = cache.get_many([get_point_key(row['id']) for row in rows])
+
+        fragments = {}
+        missing = []
+        for row in rows:
+            fragment = cached.get(get_point_key(row['id']))
+            if fragment is not None and fragment['updated'] == row['updated']:
+                fragments[row['id']] = fragment
+            else:
+                missing.append(row)
+
+        if missing:
+            comments = self.get_related_ids(Comment, 'point_id', missing, 'id')
+            tags = self.get_related_ids(Tag, 'point_id', missing, 'id')
+            stars = self.get_related_ids(Star, 'point_id', missing, 'id')
+
+            built = {}
+            for row in missing:
+                pk = row['id']
+                fragments[pk] = built[get_point_key(pk)] = {
+                    'id': pk,
+                    'name': row['name'],
+                    'latitude': self.format_decimal(row['latitude']),
+                    'longitude': self.format_decimal(row['longitude']),
+                    'description': row['description'],
+                    'created': self.format_datetime(row['created']),
+                    'updated': row['updated'],
+                    'creator_id': row['creator_id'],
+                    'comments': [c for c, in comments[pk]],
+                    'tags': [t for t, in tags[pk]],
+                    'stars': [s for s, in stars[pk]],
+                    'comment_count': row['comment_count'],
+                    'tag_count': row['tag_count'],
+                    'star_count': row['star_count'],
+                }
+            cache.set_many(built)
+
+        return [fragments[row['id']] for row in rows]
+
+    def get_fragment(self, queryset, pk):
+        """
+        Get the representation fragment of a single point. A cached fragment is
+        validated with a lookup of the point's 'updated' time only.
+
+        Parameters:
+            - queryset: the queryset the point is looked up from
+            - pk: the id of the point
+
+        Returns:
+            - the fragment, or None if the point does not exist in the queryset
+        """
+
+        fragment = get_representation_cache().get(get_point_key(pk))
+        if fragment is not None:
+            updated = queryset.filter(pk=pk).values_list('updated', flat=True).first()
+            if updated is None:
+                return None
+            if fragment['updated'] == updated:
+                return fragment
+
+        rows = list(self.get_queryset(queryset.filter(pk=pk)))
+        return self.get_fragments(rows)[0] if rows else None
+
+    def get_formatters(self, rows):
+        url = self.get_url_template('point-detail', 'pk')
+        user_url = self.get_url_template('user-detail', 'pk')
+
+        formatters = {
+            '_url': lambda row: url.format(pk=row['id']),
+            'latitude': lambda row: self.format_decimal(row['latitude']),
+            'longitude': lambda row: self.format_decimal(row['longitude']),
+            'created': lambda row: self.format_datetime(row['created']),
+            'creator': lambda row: {'_url': user_url.format(pk=row['creator_id'])},
+        }
+        for name, model, view_name in [('comments', Comment, 'point-comment-detail'),
+                                       ('tags', Tag, 'point-tag-detail'),
+                                       ('stars', Star, 'point-star-detail')]:
+            if name in self.fields:
+                related = self.get_related_ids(model, 'point_id', rows, 'id')
+                template = self.get_url_template(view_name, 'point_pk', 'pk')
+                formatters[name] = self.get_link_list_formatter(name, related, template, ('pk',), 'point_pk')
+        for name in self.field_names:
+            formatters.setdefault(name, itemgetter(name))
+        return formatters
+
+    def serialize_default(self, rows):
+        return self.render(self.get_fragments(rows))
+
+    def render(self, fragments):
+        """
+        Render representation fragments into the representations of the request.
+        """
+
+        url = self.get_url_template('point-detail', 'pk')
+        user_url = self.get_url_template('user-detail', 'pk')
+        comment_url = self.get_url_template('point-comment-detail', 'point_pk', 'pk')
+        tag_url = self.get_url_template('point-tag-detail', 'point_pk', 'pk')
+        star_url = self.get_url_template('point-star-detail', 'point_pk', 'pk')
+
+        data = []
+        for fragment in fragments:
+            pk = fragment['id']
+            point_url, parent_url = self.get_collection_links(pk)
+
+            item = OrderedDict()
+            item['_url'] = url.format(pk=pk)
+            item['id'] = pk
+            item['name'] = fragment['name']
+            item['latitude'] = fragment['latitude']
+            item['longitude'] = fragment['longitude']
+            item['description'] = fragment['description']
+            item['created'] = fragment['created']
+            item['creator'] = {'_url': user_url.format(pk=fragment['creator_id'])}
+            item['comments'] = {
+                '_items': [{'_url': comment_url.format(point_pk=pk, pk=c)} for c in fragment['comments']],
+                '_url': point_url + 'comments/',
+                '_parent': parent_url
+            }
+            item['tags'] = {
+                '_items': [{'_url': tag_url.format(point_pk=pk, pk=t)} for t in fragment['tags']],
+                '_url': point_url + 'tags/',
+                '_parent': parent_url
+            }
+            item['stars'] = {
+                '_items': [{'_url': star_url.format(point_pk=pk, pk=s)} for s in fragment['stars']],
+                '_url': point_url + 'stars/',
+                '_parent': parent_url
+            }
+            item['comment_count'] = fragment['comment_count']
+            item['tag_count'] = fragment['tag_count']
+            item['star_count'] = fragment['star_count']
+            data.append(item)
+        return data
+
+class CompiledUserSerializer(CompiledSerializer):
+    """
+    Compiled counterpart of UserSerializer.
+    """
+
+    serializer_class = UserSerializer
+    columns = ('id', 'username', 'location', 'created')
+    field_names = ('_url', 'id', 'username', 'location', 'points', 'comments', 'stars', 'created')
+
+    def get_formatters(self, rows):
+        url = self.get_url_template('user-detail', 'pk')
+
+        formatters = {
+            '_url': lambda row: url.format(pk=row['id']),
+            'created': lambda row: self.format_datetime(row['created']),
+        }
+        for name, model, view_name, lookups in [('points', Point, 'point-detail', ('pk',)),
+                                                ('comments', Comment, 'point-comment-detail', ('point_pk', 'pk')),
+                                                ('stars', Star, 'point-star-detail', ('point_pk', 'pk'))]:
+            if name in self.fields:
+                columns = ('point_id', 'id') if len(lookups) == 2 else ('id',)
+                related = self.get_related_ids(model, 'creator_id', rows, *columns)
+                template = self.get_url_template(view_name, *lookups)
+                formatters[name] = self.get_link_list_formatter(name, related, template, lookups)
+        for name in self.field_names:
+            formatters.setdefault(name, itemgetter(name))
+        return formatters
+
+    def serialize_default(self, rows):
+        url = self.get_url_template('user-detail', 'pk')
+        point_url = self.get_url_template('point-detail', 'pk')
+        comment_url = self.get_url_template('point-comment-detail', 'point_pk', 'pk')
+        star_url = self.get_url_template('point-star-detail', 'point_pk', 'pk')
+
+        points = self.get_related_ids(Point, 'creator_id', rows, 'id')
+        comments = self.get_related_ids(Comment, 'creator_id', rows, 'point_id', 'id')
+        stars = self.get_related_ids(Star, 'creator_id', rows, 'point_id', 'id')
+
+        format_datetime = self.format_datetime
+
+        data = []
+        for row in rows:
+            pk = row['id']
+            user_url, parent_url = self.get_collection_links(pk)
+
+            item = OrderedDict()
+            item['_url'] = url.format(pk=pk)
+            item['id'] = pk
+            item['username'] = row['username']
+            item['location'] = row['location']
+            item['points'] = {
+                '_items': [{'_url': point_url.format(pk=p)} for p, in points[pk]],
+                '_url': user_url + 'points/',
+                '_parent': parent_url
+            }
+            item['comments'] = {
+                '_items': [{'_url': comment_url.format(point_pk=p, pk=c)} for p, c in comments[pk]],
+                '_url': user_url + 'comments/',
+                '_parent': parent_url
+            }
+            item['stars'] = {
+                '_items': [{'_url': star_url.format(point_pk=p, pk=s)} for p, s in stars[pk]],
+                '_url': user_url + 'stars/',
+                '_parent': parent_url
+            }
+            item['created'] = format_datetime(row['created'])
+            data.append(item)
+        return data
+
+compiled_serializers = {
+    compiled.serializer_class: compiled for compiled in (
+        CompiledUserSerializer,
+        CompiledPointSerializer,
+        CompiledCommentSerializer,
+        CompiledTagSerializer,
+        CompiledStarSerializer,
+    )
+}
+
+def get_compiled_serializer(serializer_class, context):
+    """
+    Get the compiled serializer for a serializer class if the request can use it.
+
+    The compiled serializers are used for the default representation and for
+    sparse fieldsets, i.e. when no 'expand' query parameter is given, and only
+    if the datetime and decimal output settings are the defaults. The requested
+    fields are read like FlexFieldsModelSerializer does and kept in the order of
+    the representation.
+
+    Parameters:
+        - serializer_class: the serializer class to get a compiled serializer for
+        - context: the serializer context containing the request
+
+    Returns:
+        - the compiled serializer instance, or None if the regular serializer must be used
+    """
+
+    compiled = compiled_serializers.get(serializer_class)
+    if compiled is None:
+        return None
+
+    query_params = context['request'].query_params
+    if query_params.get('expand'):
+        return None
+
+    if api_settings.DATETIME_FORMAT != ISO_8601 or not api_settings.COERCE_DECIMAL_TO_STRING:
+        return None
+
+    fields = query_params.get('fields')
+    if not fields:
+        return compiled(context)
+
+    requested = set(split_levels(fields.split(','))[0])
+    return compiled(context, [name for name in compiled.field_names if name in requested])
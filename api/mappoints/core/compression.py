@@ -0,0 +1,227 @@
+import hashlib
+import zlib
+
+import brotli
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import patch_vary_headers
+
+# Responses shorter than this are sent uncompressed, the framing costs more than it saves.
+COMPRESSION_MIN_SIZE = 512
+
+# Brotli and gzip levels that compress a typical page of points several times
+# smaller at a fraction of the cost of rendering it (see the benchmark_compression command).
+COMPRESSION_LEVELS = {'br': 4, 'gzip': 6}
+
+# The encodings in the order they are preferred when the client accepts them equally.
+COMPRESSION_ENCODINGS = ('br', 'gzip')
+
+# The API media types. The browsable API pages (text/html) are not compressed, they hold
+# the user's session data (e.g. the CSRF token) and are never served to other users anyway.
+COMPRESSIBLE_TYPES = ('application/json', 'application/geo+json', 'application/msgpack', 'application/cbor')
+
+# Compressed bodies larger than this are not cached.
+MAX_CACHED_SIZE = 512 * 1024
+
+class GzipCompressor:
+    """
+    Incremental gzip compressor.
+    """
+
+    def __init__(self, level):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def finish(self):
+        return self.compressor.flush()
+
+class BrotliCompressor:
+    """
+    Incremental brotli compressor.
+    """
+
+    def __init__(self, level):
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def finish(self):
+        return self.compressor.finish()
+
+compressors = {
+    'br': BrotliCompressor,
+    'gzip': GzipCompressor,
+}
+
+def get_compressor(encoding, level=None):
+    """
+    Get an incremental compressor of a content encoding, at the configured level by default.
+    """
+
+    return compressors[encoding](COMPRESSION_LEVELS[encoding] if level is None else level)
+
+def compress(data, encoding, level=None):
+    """
+    Compress a byte string with a content encoding ('br' or 'gzip').
+    """
+
+    compressor = get_compressor(encoding, level)
+    return compressor.compress(data) + compressor.finish()
+
+def compress_sequence(sequence, encoding):
+    """
+    Compress a sequence of byte strings incrementally, yielding the compressed
+    data as soon as the compressor outputs it.
+    """
+
+    compressor = get_compressor(encoding)
+    for data in sequence:
+        output = compressor.compress(data)
+        if output:
+            yield output
+    yield compressor.finish()
+
+def get_accepted_encoding(request):
+    """
+    Negotiate the content encoding of a response from the Accept-Encoding header.
+
+    Parameters:
+        - request: the request
+
+    Returns:
+        - 'br' or 'gzip' (the one with the highest quality value, brotli on a tie),
+          or None if the client accepts neither
+    """
+
+    qualities = {}
+    for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, *params = coding.split(';')
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+
+    default = qualities.get('*', 0.0)
+    candidates = [(qualities.get(encoding, default), -index, encoding)
+                  for index, encoding in enumerate(COMPRESSION_ENCODINGS)]
+    quality, _, encoding = max(candidates)
+    return encoding if quality > 0 else None
+
+def get_compressed_cache():
+    """
+    Get the cache of the compressed response bodies.
+    """
+
+    return caches['compressed']
+
+def get_compressed_key(request, response, encoding):
+    """
+    Get the cache key of the compressed body of a response, or None if it must not be cached.
+
+    Only successful GET responses with an ETag to anonymous requests are cached:
+    the ETag does not depend on the user, so a response to a request authenticated
+    in any way (Authorization header, session or CSRF cookie) is never shared. The
+    ETag changes with the versions of the models the response depends on and with
+    the path and media type of the request, and the host (which the links depend on),
+    content type and length of the body are added to the key as well.
+    """
+
+    etag = response.get('ETag')
+    if not etag or request.method != 'GET' or response.status_code != 200:
+        return None
+    if not is_anonymous(request):
+        return None
+
+    key = '{}|{}|{}|{}'.format(etag, request.get_host(), response.get('Content-Type', ''), len(response.content))
+    return 'compressed:{}:{}'.format(encoding, hashlib.sha1(key.encode()).hexdigest())
+
+def is_anonymous(request):
+    """
+    Check whether a request is anonymous: not authenticated, without credentials
+    and without a session or CSRF cookie.
+    """
+
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_anonymous:
+        return False
+    if 'HTTP_AUTHORIZATION' in request.META:
+        return False
+    return settings.SESSION_COOKIE_NAME not in request.COOKIES and settings.CSRF_COOKIE_NAME not in request.COOKIES
+
+def get_compressed_content(request, response, encoding):
+    """
+    Get the compressed body of a response, from the 'compressed' cache for
+    hot anonymous responses, so that each of them is compressed only once.
+    """
+
+    key = get_compressed_key(request, response, encoding)
+    if key is None:
+        return compress(response.content, encoding)
+
+    cache = get_compressed_cache()
+    content = cache.get(key)
+    if content is None:
+        content = compress(response.content, encoding)
+        if len(content) <= MAX_CACHED_SIZE:
+            cache.set(key, content)
+    return content
+
+def is_compressible(response):
+    """
+    Check whether a response is of a compressible type and not already encoded.
+    """
+
+    if response.has_header('Content-Encoding') or response.status_code == 206:
+        return False
+    return response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES)
+
+class CompressionMiddleware:
+    """
+    Compress responses with brotli or gzip, negotiated from the Accept-Encoding header.
+
+    Streaming responses (large pages and exports) are compressed incrementally
+    as they are sent. The compressed bodies of hot anonymous responses are kept
+    in the 'compressed' cache by ETag, so they are compressed only once per
+    version of the data. The responses vary by cookie as well, since the cached
+    bodies are only shared by the requests without a session.
+
+    Like django.middleware.gzip.GZipMiddleware, it is placed before any
+    middleware that reads or changes the response body.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if not response.streaming and len(response.content) < COMPRESSION_MIN_SIZE:
+            return response
+        if not is_compressible(response):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding', 'Cookie'))
+        encoding = get_accepted_encoding(request)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_sequence(response.streaming_content, encoding)
+            del response['Content-Length']
+        else:
+            response.content = get_compressed_content(request, response, encoding)
+            response['Content-Length'] = str(len(response.content))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
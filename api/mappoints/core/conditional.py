@@ -0,0 +1,90 @@
+import hashlib
+import time
+from calendar import timegm
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import exceptions
+
+from mappoints.core.models import Version
+
+class NotModified(exceptions.APIException):
+    """
+    Raised when a conditional GET request can be answered without a body.
+    """
+
+    status_code = 304
+
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+class ConditionalGetMixin:
+    """
+    Answer conditional GET requests (If-None-Match and If-Modified-Since) of a view
+    from the versions of the models its representations depend on.
+
+    The versions are read with a single primary key lookup once the request has
+    passed the authentication and permission checks. If the client's copy is
+    still current, a 304 response is returned without running the action,
+    so neither the main query nor the serializer is run. Otherwise the ETag
+    and Last-Modified headers are added to the response.
+
+    The ETag is derived from the versions, the full path of the request and
+    the accepted media type, so every page, expansion and format of a collection
+    has its own ETag. The Last-Modified time is the end of the second of the latest
+    change of the versions, since HTTP dates have a resolution of one second. It is
+    only given (and If-Modified-Since only evaluated) once that second is over, so
+    that a change made later in the same second is always newer than the client's
+    copy. If-None-Match takes precedence over If-Modified-Since.
+
+    Attributes:
+        - version_names: the names of the models the representations depend on
+    """
+
+    version_names = ('user', 'point', 'comment', 'tag', 'star')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+
+        self.etag = None
+        self.last_modified = None
+        if request.method not in ('GET', 'HEAD'):
+            return
+
+        versions = Version.objects.get_versions(self.version_names)
+        self.etag = self.get_etag(request, versions)
+        times = [updated for value, updated in versions.values() if updated is not None]
+        if times:
+            last_modified = timegm(max(times).utctimetuple()) + 1
+            if last_modified <= time.time():
+                self.last_modified = last_modified
+
+        response = get_conditional_response(request._request, etag=self.etag, last_modified=self.last_modified)
+        if response is not None:
+            raise NotModified(response)
+
+    def get_etag(self, request, versions):
+        """
+        Get the ETag of the response to a request from the versions of the models.
+        """
+
+        key = '{}|{}|{}'.format(
+            request.get_full_path(),
+            getattr(request, 'accepted_media_type', ''),
+            ','.join('{}={}'.format(name, versions[name][0]) for name in sorted(versions))
+        )
+        return 'W/' + quote_etag(hashlib.sha1(key.encode()).hexdigest())
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'etag', None) and response.status_code in (200, 304):
+            response['ETag'] = self.etag
+            if self.last_modified is not None:
+                response['Last-Modified'] = http_date(self.last_modified)
+        return response
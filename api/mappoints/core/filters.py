@@ -0,0 +1,129 @@
+from django.db.models import Q
+from rest_framework.exceptions import ParseError
+
+POINT_ORDERINGS = {
+    'created': ('created', 'id'),
+    '-created': ('-created', '-id'),
+    'star_count': ('star_count', 'id'),
+    '-star_count': ('-star_count', '-id'),
+}
+
+def parse_bbox(value):
+    """
+    Parse a bounding box query parameter of the form 'minLon,minLat,maxLon,maxLat'.
+
+    A bounding box whose minimum longitude is greater than its maximum longitude
+    crosses the antimeridian (e.g. '170,-10,-170,10').
+
+    Parameters:
+        - value: the bounding box string
+
+    Errors:
+        - the bounding box is malformed or out of range (400)
+
+    Returns:
+        - tuple of (min_lon, min_lat, max_lon, max_lat) floats
+    """
+
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(part) for part in value.split(','))
+    except ValueError:
+        raise ParseError('The bbox must be given as minLon,minLat,maxLon,maxLat.')
+
+    if not all(-180 <= lon <= 180 for lon in (min_lon, max_lon)):
+        raise ParseError('The bbox longitudes must be between -180 and 180.')
+    if not all(-90 <= lat <= 90 for lat in (min_lat, max_lat)):
+        raise ParseError('The bbox latitudes must be between -90 and 90.')
+    if min_lat > max_lat:
+        raise ParseError('The bbox minimum latitude must not be greater than its maximum latitude.')
+
+    return min_lon, min_lat, max_lon, max_lat
+
+def get_bbox_filter(min_lon, min_lat, max_lon, max_lat):
+    """
+    Build a filter selecting the points inside a bounding box.
+
+    The latitude range is matched first so that the (latitude, longitude)
+    index on Point can be range scanned. A box crossing the antimeridian
+    matches the longitudes on both sides of it.
+    """
+
+    condition = Q(latitude__gte=min_lat, latitude__lte=max_lat)
+    if min_lon <= max_lon:
+        return condition & Q(longitude__gte=min_lon, longitude__lte=max_lon)
+    return condition & (Q(longitude__gte=min_lon) | Q(longitude__lte=max_lon))
+
+def get_float_param(request, name, minimum, maximum, default=None):
+    """
+    Get a float query parameter of the request and check that it is within range.
+
+    Parameters:
+        - request: the request containing the query parameters
+        - name: the name of the query parameter
+        - minimum, maximum: the allowed range of the value
+        - default: the value used when the parameter is missing (None if it is required)
+
+    Errors:
+        - a required parameter is missing, or the value is malformed or out of range (400)
+
+    Returns:
+        - the float value of the parameter
+    """
+
+    value = request.query_params.get(name)
+    if not value:
+        if default is None:
+            raise ParseError('The {} parameter is required.'.format(name))
+        return default
+
+    try:
+        value = float(value)
+    except ValueError:
+        raise ParseError('The {} parameter must be a number.'.format(name))
+
+    if not minimum <= value <= maximum:
+        raise ParseError('The {} parameter must be between {} and {}.'.format(name, minimum, maximum))
+    return value
+
+def get_point_ordering(request):
+    """
+    Get the keyset ordering of a point collection from the ordering query parameter.
+
+    Every ordering is backed by an index: ('created', 'id') on all the models
+    and ('star_count', 'id') on Point. The id breaks ties in the direction of
+    the ordering, so that the indexes can be scanned in either direction.
+
+    Parameters:
+        - request: the request containing the query parameters
+
+    Errors:
+        - the ordering is not one of POINT_ORDERINGS (400)
+
+    Returns:
+        - tuple of the ordering fields
+    """
+
+    ordering = request.query_params.get('ordering') or 'created'
+    if ordering not in POINT_ORDERINGS:
+        raise ParseError('The ordering must be one of {}.'.format(', '.join(POINT_ORDERINGS)))
+    return POINT_ORDERINGS[ordering]
+
+def filter_points(queryset, request):
+    """
+    Filter a Point queryset with the query parameters of the request.
+
+    Query parameters:
+        - bbox: only include points inside the bounding box 'minLon,minLat,maxLon,maxLat'
+
+    Parameters:
+        - queryset: the Point queryset to filter
+        - request: the request containing the query parameters
+
+    Returns:
+        - the filtered queryset
+    """
+
+    bbox = request.query_params.get('bbox')
+    if bbox:
+        queryset = queryset.filter(get_bbox_filter(*parse_bbox(bbox)))
+    return queryset
@@ -0,0 +1,84 @@
+from collections import defaultdict
+from itertools import islice
+
+from rest_framework.renderers import JSONRenderer
+
+from mappoints.core.models import Tag
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FIELDS = ('id', 'name', 'description', 'latitude', 'longitude', 'created', 'updated',
+                 'creator__username', 'comment_count', 'tag_count', 'star_count')
+
+class GeoJSONRenderer(JSONRenderer):
+    """
+    Render data as GeoJSON (RFC 7946).
+    """
+
+    media_type = 'application/geo+json'
+    format = 'geojson'
+
+def get_feature(row, tags, url):
+    """
+    Build the GeoJSON feature of a point.
+
+    Parameters:
+        - row: the values of EXPORT_FIELDS of the point
+        - tags: list of the names of the point's tags
+        - url: the url template of the points, formatted with the point's id
+
+    Returns:
+        - the feature dictionary
+    """
+
+    pk, name, description, latitude, longitude, created, updated, creator, comments, tag_count, stars = row
+    return {
+        'type': 'Feature',
+        'id': pk,
+        'geometry': {'type': 'Point', 'coordinates': [float(longitude), float(latitude)]},
+        'properties': {
+            '_url': url.format(pk),
+            'name': name,
+            'description': description,
+            'created': created,
+            'updated': updated,
+            'creator': creator,
+            'tags': tags,
+            'comment_count': comments,
+            'tag_count': tag_count,
+            'star_count': stars,
+        },
+    }
+
+def iterate_feature_chunks(queryset, url, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Iterate over the points of a queryset as chunks of GeoJSON features.
+
+    The points are read with a single query joined with their creators' usernames,
+    chunk_size rows at a time through queryset.iterator(), which keeps a server-side
+    cursor open on the databases that support them. The tag names of a chunk are
+    read with a single query, skipped when none of its points are tagged, so only
+    one chunk of rows is ever held in memory however many points are exported.
+
+    Parameters:
+        - queryset: the ordered Point queryset to export
+        - url: the url template of the points, formatted with a point's id
+        - chunk_size: the number of points read and rendered at a time
+
+    Returns:
+        - iterator of lists of feature dictionaries
+    """
+
+    rows = queryset.values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+
+        tags = defaultdict(list)
+        tagged = [row[0] for row in chunk if row[EXPORT_FIELDS.index('tag_count')]]
+        if tagged:
+            names = Tag.objects.filter(point__in=tagged).order_by('point', 'name').values_list('point', 'name')
+            for point_id, name in names:
+                tags[point_id].append(name)
+
+        yield [get_feature(row, tags[row[0]], url) for row in chunk]
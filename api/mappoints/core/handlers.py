@@ -1,5 +1,27 @@
+from rest_framework_jwt.utils import jwt_payload_handler as default_jwt_payload_handler
+
 from mappoints.core.serializers import UserSerializer
 
+def jwt_payload_handler(user):
+    """
+    Return the claims of a new JWT token for a User.
+
+    Adds the 'is_superuser' and 'token_version' claims to the default claims,
+    so that requests can be authenticated from the token alone
+    (see ClaimsJSONWebTokenAuthentication).
+
+    Parameters:
+        - user: the user the token is issued to
+
+    Returns:
+        - a dictionary of the token's claims
+    """
+
+    payload = default_jwt_payload_handler(user)
+    payload['is_superuser'] = user.is_superuser
+    payload['token_version'] = user.token_version
+    return payload
+
 def jwt_response_payload_handler(token, user=None, request=None):
     """
     Return the User's details along with the JWT token on JWT login.
@@ -0,0 +1,378 @@
+import csv
+import io
+import json
+import multiprocessing
+import re
+from collections import deque
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from mappoints.core.models import User, Point, Tag, Comment, Version
+from mappoints.core.spatial import encode_geohash
+from mappoints.core.tiles import invalidate_tiles
+
+IMPORT_FORMATS = {
+    '.geojson': 'geojson',
+    '.json': 'geojson',
+    '.geojsonl': 'geojsonseq',
+    '.geojsons': 'geojsonseq',
+    '.ndjson': 'geojsonseq',
+    '.csv': 'csv',
+}
+IMPORT_BATCH_SIZE = 5000
+LOOKUP_BATCH_SIZE = 500
+READ_BLOCK_SIZE = 1 << 16
+CSV_TAG_SEPARATOR = '|'
+FEATURES_START = re.compile(r'"features"\s*:\s*\[')
+
+POINT_FIELDS = ('name', 'latitude', 'longitude', 'description')
+POINT_COLUMNS = ('created', 'updated', 'name', 'latitude', 'longitude', 'description', 'geohash',
+                 'comment_count', 'tag_count', 'star_count', 'creator_id')
+
+def get_import_format(path):
+    """
+    Get the format of an input file from its extension.
+
+    Returns:
+        - one of 'geojson' (a FeatureCollection), 'geojsonseq' (one feature per line)
+          or 'csv', or None if the extension is unknown
+    """
+
+    for extension, format in IMPORT_FORMATS.items():
+        if path.lower().endswith(extension):
+            return format
+    return None
+
+def read_records(file, format):
+    """
+    Read the records of an input file one at a time.
+
+    Parameters:
+        - file: the text file to read
+        - format: 'geojson', 'geojsonseq' or 'csv'
+
+    Returns:
+        - iterator of the records: feature dictionaries for a FeatureCollection,
+          lines for a GeoJSON sequence and column dictionaries for CSV
+    """
+
+    if format == 'csv':
+        return csv.DictReader(file)
+    if format == 'geojsonseq':
+        # The lines are decoded with the validation, in the worker processes.
+        return (line for line in file if line.strip())
+    return read_feature_collection(file)
+
+def read_feature_collection(file):
+    """
+    Read the features of a GeoJSON FeatureCollection one at a time without
+    loading the whole document, by decoding the items of its 'features' array
+    from a buffer refilled block by block.
+
+    Errors:
+        - the document has no 'features' array or is malformed (ValueError)
+    """
+
+    decoder = json.JSONDecoder()
+    buffer = ''
+
+    def fill():
+        nonlocal buffer
+        block = file.read(READ_BLOCK_SIZE)
+        buffer += block
+        return bool(block)
+
+    match = FEATURES_START.search(buffer)
+    while match is None:
+        if not fill():
+            raise ValueError('The GeoJSON document has no "features" array.')
+        match = FEATURES_START.search(buffer)
+    position = match.end()
+
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position < len(buffer) and buffer[position] == ']':
+            return
+
+        try:
+            if position == len(buffer):
+                raise json.JSONDecodeError('Expecting value', buffer, position)
+            feature, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # The next feature is incomplete: keep it and read the next block.
+            buffer = buffer[position:]
+            position = 0
+            if not fill():
+                raise ValueError('The GeoJSON "features" array is malformed or not closed.')
+            continue
+        yield feature
+
+def get_record_values(record, format):
+    """
+    Get the raw values of a point from a record.
+
+    GeoJSON features are Point geometries with the 'name', 'description', 'creator'
+    (a username), 'tags' (list of names) and 'comments' (list of contents) properties.
+    CSV rows have the 'name', 'latitude', 'longitude', 'description', 'creator'
+    and 'tags' (names separated by CSV_TAG_SEPARATOR) columns.
+
+    Errors:
+        - the record is not a point feature or a CSV row (ValidationError)
+    """
+
+    if format == 'csv':
+        tags = record.get('tags') or ''
+        return {
+            'name': record.get('name'),
+            'latitude': record.get('latitude'),
+            'longitude': record.get('longitude'),
+            'description': record.get('description') or '',
+            'creator': record.get('creator') or None,
+            'tags': [tag.strip() for tag in tags.split(CSV_TAG_SEPARATOR) if tag.strip()],
+            'comments': [],
+        }
+
+    if format == 'geojsonseq':
+        # Lines may start with the record separator of GeoJSON text sequences (RFC 8142).
+        try:
+            record = json.loads(record.strip('\x1e \t\r\n'))
+        except ValueError as error:
+            raise ValidationError('The line is not valid JSON: {}.'.format(error))
+
+    if not isinstance(record, dict) or record.get('type') != 'Feature':
+        raise ValidationError('The record is not a GeoJSON feature.')
+    geometry = record.get('geometry') or {}
+    coordinates = geometry.get('coordinates')
+    if geometry.get('type') != 'Point' or not isinstance(coordinates, list) or len(coordinates) < 2:
+        raise ValidationError('The feature geometry is not a point.')
+    properties = record.get('properties') or {}
+    return {
+        'name': properties.get('name'),
+        'latitude': coordinates[1],
+        'longitude': coordinates[0],
+        'description': properties.get('description') or '',
+        'creator': properties.get('creator'),
+        'tags': properties.get('tags') or [],
+        'comments': properties.get('comments') or [],
+    }
+
+def clean_record(record, format):
+    """
+    Validate a record with the validation of the Point, Tag and Comment model fields.
+
+    The validation doesn't query the database, so it can run in worker processes.
+
+    Returns:
+        - tuple of the cleaned values (None if invalid) and the list of error messages
+    """
+
+    try:
+        values = get_record_values(record, format)
+    except ValidationError as error:
+        return None, error.messages
+
+    errors = []
+    cleaned = {}
+    for name in POINT_FIELDS:
+        try:
+            cleaned[name] = Point._meta.get_field(name).clean(values[name], None)
+        except ValidationError as error:
+            errors.extend('{}: {}'.format(name, message) for message in error.messages)
+
+    creator = values['creator']
+    if creator is not None and not isinstance(creator, str):
+        errors.append('creator: The creator must be a username.')
+    cleaned['creator'] = creator
+
+    for name, model, field in (('tags', Tag, 'name'), ('comments', Comment, 'content')):
+        items = values[name]
+        if not isinstance(items, list):
+            errors.append('{}: The {} must be a list.'.format(name, name))
+            continue
+        try:
+            cleaned[name] = [model._meta.get_field(field).clean(item, None) for item in items]
+        except ValidationError as error:
+            errors.extend('{}: {}'.format(name, message) for message in error.messages)
+    # The tags of a point are unique by name.
+    cleaned['tags'] = list(dict.fromkeys(cleaned.get('tags', [])))
+
+    return (None if errors else cleaned), errors
+
+def clean_batch(batch, format):
+    """
+    Validate a batch of (row number, record) tuples.
+
+    Returns:
+        - list of (row number, cleaned values, errors) tuples
+    """
+
+    return [(number, *clean_record(record, format)) for number, record in batch]
+
+def clean_batches(batches, format, workers=1):
+    """
+    Validate batches of records, in worker processes when more than one worker is given.
+
+    At most two batches per worker are in flight, so the input is read only as
+    fast as it is validated. The workers never touch the database, so they can
+    be forked from a process holding a database connection.
+
+    Returns:
+        - iterator of the validated batches, in the order of the input
+    """
+
+    if workers <= 1:
+        for batch in batches:
+            yield clean_batch(batch, format)
+        return
+
+    with multiprocessing.Pool(workers) as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.apply_async(clean_batch, (batch, format)))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+def iterate_batches(records, batch_size, start=0):
+    """
+    Group the records of an input into batches of (row number, record) tuples,
+    skipping the first start records.
+    """
+
+    numbered = islice(enumerate(records, start=1), start, None)
+    while True:
+        batch = list(islice(numbered, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def insert_rows(model, columns, rows):
+    """
+    Insert rows of column values into the table of a model.
+
+    The rows are copied with a single COPY on PostgreSQL and inserted with
+    bulk_create on the other databases. No model signals are sent and the
+    bulk operations of the model's manager are bypassed.
+
+    Parameters:
+        - model: the model of the table
+        - columns: the column names of the values
+        - rows: list of tuples of column values
+    """
+
+    if not rows:
+        return
+
+    if connection.vendor == 'postgresql':
+        buffer = io.StringIO()
+        # Quoting every string keeps empty strings apart from NULLs.
+        csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(rows)
+        buffer.seek(0)
+        sql = 'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+            connection.ops.quote_name(model._meta.db_table),
+            ', '.join(connection.ops.quote_name(column) for column in columns)
+        )
+        with connection.cursor() as cursor:
+            cursor.copy_expert(sql, buffer)
+        return
+
+    model._base_manager.bulk_create([model(**dict(zip(columns, row))) for row in rows])
+
+def lookup_points(creator_ids, names, *fields):
+    """
+    Look up the given fields of the points of the creators with the given names,
+    in queries of LOOKUP_BATCH_SIZE names, which stay below the parameter limits of every database.
+
+    Returns:
+        - list of tuples of the field values
+    """
+
+    names = list(names)
+    rows = []
+    for start in range(0, len(names), LOOKUP_BATCH_SIZE):
+        queryset = Point.objects.filter(creator__in=creator_ids, name__in=names[start:start + LOOKUP_BATCH_SIZE])
+        rows.extend(queryset.values_list(*fields))
+    return rows
+
+def import_batch(batch, default_creator=None, dry_run=False):
+    """
+    Import a batch of validated records in a single transaction.
+
+    The creators of the batch are resolved with a single query, and the points
+    that already exist (by name and creator, or earlier in the batch) are
+    skipped, so importing the same input twice doesn't duplicate points.
+    The points, then their tags and comments, are inserted with one
+    insert_rows each, with their tag and comment counts already set.
+
+    Parameters:
+        - batch: list of (row number, cleaned values, errors) tuples
+        - default_creator: username of the creator of the records without one
+        - dry_run: check the batch without inserting anything
+
+    Returns:
+        - dictionary with the numbers of 'created', 'skipped' and 'invalid' points,
+          and the list of (row number, message) 'errors'
+    """
+
+    stats = {'created': 0, 'skipped': 0, 'invalid': 0, 'errors': []}
+    valid = []
+    for number, values, errors in batch:
+        if values is None:
+            stats['invalid'] += 1
+            stats['errors'].extend((number, message) for message in errors)
+        else:
+            values['creator'] = values['creator'] or default_creator
+            valid.append((number, values))
+
+    usernames = {values['creator'] for number, values in valid}
+    creators = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+    names = {values['name'] for number, values in valid}
+    existing = set(lookup_points(set(creators.values()), names, 'creator', 'name'))
+
+    points = []
+    for number, values in valid:
+        creator_id = creators.get(values['creator'])
+        if creator_id is None:
+            stats['invalid'] += 1
+            stats['errors'].append((number, 'creator: Unknown user {!r}.'.format(values['creator'])))
+        elif (creator_id, values['name']) in existing:
+            stats['skipped'] += 1
+        else:
+            existing.add((creator_id, values['name']))
+            points.append((creator_id, values))
+    stats['created'] = len(points)
+
+    if dry_run or not points:
+        return stats
+
+    now = timezone.now()
+    with transaction.atomic():
+        insert_rows(Point, POINT_COLUMNS, [
+            (now, now, values['name'], values['latitude'], values['longitude'], values['description'],
+             encode_geohash(values['latitude'], values['longitude']),
+             len(values['comments']), len(values['tags']), 0, creator_id)
+            for creator_id, values in points
+        ])
+
+        creator_ids = {creator_id for creator_id, values in points}
+        names = {values['name'] for creator_id, values in points}
+        ids = {(creator_id, name): pk for creator_id, name, pk in lookup_points(creator_ids, names, 'creator', 'name', 'id')}
+        insert_rows(Tag, ('created', 'updated', 'name', 'point_id', 'creator_id'), [
+            (now, now, name, ids[creator_id, values['name']], creator_id)
+            for creator_id, values in points for name in values['tags']
+        ])
+        insert_rows(Comment, ('created', 'updated', 'content', 'point_id', 'creator_id'), [
+            (now, now, content, ids[creator_id, values['name']], creator_id)
+            for creator_id, values in points for content in values['comments']
+        ])
+
+        for name in ('point', 'tag', 'comment'):
+            Version.objects.bump(name)
+    invalidate_tiles((values['latitude'], values['longitude']) for creator_id, values in points)
+
+    return stats
@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+from mappoints.core.compression import COMPRESSION_LEVELS, compress
+
+BENCHMARK_PATHS = ('/points/', '/points/?limit=1000', '/users/', '/points/export.geojson')
+BENCHMARK_LEVELS = {'gzip': (1, 6, 9), 'br': (1, 4, 6, 11)}
+
+class Command(BaseCommand):
+    """
+    Measure the CPU/bandwidth trade-off of compressing API responses.
+
+    Each response is requested uncompressed once, and its body is then compressed
+    with every content encoding at several levels. The size, ratio, time and
+    throughput of each are written next to the time it took to render the response,
+    with the configured levels (see compression.COMPRESSION_LEVELS) marked with '*'.
+    """
+
+    help = 'Measure the size and compression time of API responses for each content encoding and level.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*',
+                            help='The paths of the responses (default: {}).'.format(', '.join(BENCHMARK_PATHS)))
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='The number of times each body is compressed.')
+        parser.add_argument('--host', default='localhost',
+                            help='The host the responses are requested from.')
+
+    def handle(self, *args, **options):
+        client = Client(HTTP_HOST=options['host'])
+        repeat = max(options['repeat'], 1)
+
+        for path in options['paths'] or BENCHMARK_PATHS:
+            started = time.perf_counter()
+            response = client.get(path)
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+            rendered = time.perf_counter() - started
+
+            if response.status_code != 200:
+                self.stderr.write('{}: status {}, skipped.'.format(path, response.status_code))
+                continue
+
+            self.stdout.write('{} ({}): {} bytes rendered in {:.2f} ms'.format(
+                path, response['Content-Type'], len(content), rendered * 1000
+            ))
+            for encoding, levels in BENCHMARK_LEVELS.items():
+                for level in levels:
+                    started = time.perf_counter()
+                    for _ in range(repeat):
+                        compressed = compress(content, encoding, level)
+                    elapsed = (time.perf_counter() - started) / repeat
+
+                    self.stdout.write('  {:<4} {:>2}{} {:>10} bytes {:>6.1%} {:>9.2f} ms {:>8.1f} MB/s'.format(
+                        encoding, level, '*' if level == COMPRESSION_LEVELS[encoding] else ' ',
+                        len(compressed), len(compressed) / max(len(content), 1),
+                        elapsed * 1000, len(content) / max(elapsed, 1e-9) / 1e6
+                    ))
@@ -0,0 +1,118 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.urls import reverse
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from mappoints.core.compiled import get_compiled_serializer
+from mappoints.core.models import User, Point, Comment, Tag, Star
+from mappoints.core.queries import plan_queryset
+from mappoints.core.serializers import UserSerializer, PointSerializer, CommentSerializer, TagSerializer, StarSerializer
+
+BENCHMARK_MODELS = (
+    ('users', User, UserSerializer),
+    ('points', Point, PointSerializer),
+    ('comments', Comment, CommentSerializer),
+    ('tags', Tag, TagSerializer),
+    ('stars', Star, StarSerializer),
+)
+
+class Command(BaseCommand):
+    """
+    Measure the throughput of the compiled serializers against the regular ones.
+
+    The first rows of each collection (in the order of the collection) are read
+    and serialized with the regular serializer, from the instances of the planned
+    queryset, and with the compiled serializer, from the rows of its values query,
+    both for the default representation of a list action. The time of each
+    (including its queries), the rows per second and the speedup are written.
+
+    With --generate, the rows are generated in a transaction that is rolled back
+    at the end, so the benchmark can run against an empty database.
+    """
+
+    help = 'Measure the list serialization throughput of the compiled and the regular serializers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000,
+                            help='The number of rows serialized of each collection.')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='The number of times the rows are serialized, the fastest time is kept.')
+        parser.add_argument('--generate', action='store_true',
+                            help='Generate the rows of every collection and roll them back afterwards.')
+        parser.add_argument('--host', default='localhost',
+                            help='The host the links are built for.')
+
+    def handle(self, *args, **options):
+        rows = max(options['rows'], 1)
+        repeat = max(options['repeat'], 1)
+
+        with transaction.atomic():
+            if options['generate']:
+                self.generate(rows)
+
+            request = Request(APIRequestFactory().get(reverse('sync'), HTTP_HOST=options['host']))
+            for name, model, serializer_class in BENCHMARK_MODELS:
+                context = {'request': request, 'action': 'list'}
+                if serializer_class is PointSerializer:
+                    context['path'] = reverse('point-list')
+                queryset = model.objects.order_by('created', 'id')
+
+                def serialize_regular():
+                    instances = plan_queryset(queryset, serializer_class, context)[:rows]
+                    return serializer_class(instances, many=True, context=context).data
+
+                def serialize_compiled():
+                    compiled = get_compiled_serializer(serializer_class, context)
+                    return compiled.serialize(list(compiled.get_queryset(queryset)[:rows]))
+
+                regular, count = self.measure(serialize_regular, repeat)
+                compiled, compiled_count = self.measure(serialize_compiled, repeat)
+                if count != compiled_count:
+                    self.stderr.write('{}: {} regular and {} compiled rows.'.format(name, count, compiled_count))
+
+                self.stdout.write('{:<8} {:>6} rows  regular {:>9.2f} ms {:>9.0f} rows/s  '
+                                  'compiled {:>9.2f} ms {:>9.0f} rows/s  {:>5.1f}x'.format(
+                                      name, count, regular * 1000, count / regular,
+                                      compiled * 1000, count / compiled, regular / compiled))
+
+            transaction.set_rollback(True)
+
+    def measure(self, serialize, repeat):
+        """
+        Serialize the rows a number of times.
+
+        Returns:
+            - tuple of (the fastest time in seconds, the number of serialized rows)
+        """
+
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            data = serialize()
+            times.append(time.perf_counter() - started)
+        return max(min(times), 1e-9), len(data)
+
+    def generate(self, count):
+        """
+        Generate a user for every 100 points, and a comment, tag and star for every point.
+        """
+
+        users = User.objects.bulk_create([
+            User(username='benchmark{}'.format(i), location='Benchmark {}'.format(i))
+            for i in range(max(count // 100, 1))
+        ])
+        users = list(User.objects.filter(username__in=[user.username for user in users]))
+        points = Point.objects.bulk_create([
+            Point(name='benchmark {}'.format(i), description='Generated point {}.'.format(i),
+                  latitude=(i % 17000) / 100 - 85, longitude=(i * 7 % 36000) / 100 - 180,
+                  creator=users[i % len(users)])
+            for i in range(count)
+        ])
+        points = list(Point.objects.filter(name__startswith='benchmark ').order_by('id'))
+        Comment.objects.bulk_create([Comment(content='Generated comment.', point=point, creator=point.creator)
+                                     for point in points])
+        Tag.objects.bulk_create([Tag(name='benchmark', point=point, creator=point.creator) for point in points])
+        Star.objects.bulk_create([Star(point=point, creator=point.creator) for point in points])
@@ -0,0 +1,109 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mappoints.core.importer import (IMPORT_BATCH_SIZE,
+                                     IMPORT_FORMATS,
+                                     clean_batches,
+                                     get_import_format,
+                                     import_batch,
+                                     iterate_batches,
+                                     read_records)
+
+class Command(BaseCommand):
+    """
+    Import points, with their tags and comments, from a GeoJSON or CSV file.
+
+    The file is read one record at a time and validated in batches, in worker
+    processes if requested. Each batch is imported in a transaction of its own
+    with a few set-based queries (see importer.import_batch). Points that already
+    exist are skipped, and the number of records read is written to the checkpoint
+    file after each batch, so an interrupted import can be resumed by running the
+    same command again.
+    """
+
+    help = 'Import points with their tags and comments from a GeoJSON or CSV file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path',
+                            help='The GeoJSON file (a FeatureCollection or one feature per line) or CSV file.')
+        parser.add_argument('--format', choices=sorted(set(IMPORT_FORMATS.values())),
+                            help='The format of the file (default: from its extension).')
+        parser.add_argument('--creator',
+                            help='The username of the creator of the records without one.')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+                            help='The number of records imported in each transaction.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='The number of processes validating the records.')
+        parser.add_argument('--checkpoint',
+                            help='The file recording the progress of the import, to resume it from.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Validate the records without importing them.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or get_import_format(path)
+        if format is None:
+            raise CommandError('The format of {} is unknown, give it with --format.'.format(path))
+
+        checkpoint = None if options['dry_run'] else options['checkpoint']
+        start = self.read_checkpoint(checkpoint, path)
+        if start:
+            self.stdout.write('Resuming after {} record(s).'.format(start))
+
+        totals = {'created': 0, 'skipped': 0, 'invalid': 0}
+        position = start
+        started = time.monotonic()
+
+        try:
+            with open(path, newline='', encoding='utf-8') as file:
+                batches = iterate_batches(read_records(file, format), options['batch_size'], start)
+                for batch in clean_batches(batches, format, options['workers']):
+                    stats = import_batch(batch, options['creator'], options['dry_run'])
+                    for number, message in stats['errors']:
+                        self.stderr.write('Record {}: {}'.format(number, message))
+                    for name in totals:
+                        totals[name] += stats[name]
+
+                    position = batch[-1][0]
+                    self.write_checkpoint(checkpoint, path, position)
+                    self.stdout.write('{} record(s) read: {} created, {} skipped, {} invalid ({:.0f} records/s).'.format(
+                        position, totals['created'], totals['skipped'], totals['invalid'],
+                        (position - start) / max(time.monotonic() - started, 1e-6)
+                    ))
+        except (OSError, ValueError) as error:
+            raise CommandError('Could not read {} after record {}: {}'.format(path, position, error))
+
+        verb = 'Would create' if options['dry_run'] else 'Created'
+        self.stdout.write('{} {} point(s), skipped {} existing point(s) and {} invalid record(s).'.format(
+            verb, totals['created'], totals['skipped'], totals['invalid']
+        ))
+
+    def read_checkpoint(self, checkpoint, path):
+        """
+        Get the number of records of the file already imported according to the checkpoint.
+        """
+
+        if not checkpoint or not os.path.exists(checkpoint):
+            return 0
+
+        with open(checkpoint) as file:
+            state = json.load(file)
+        if state.get('path') != os.path.abspath(path):
+            raise CommandError('The checkpoint {} is for another file ({}).'.format(checkpoint, state.get('path')))
+        return state['records']
+
+    def write_checkpoint(self, checkpoint, path, records):
+        """
+        Record the number of records of the file imported so far, replacing the checkpoint atomically.
+        """
+
+        if not checkpoint:
+            return
+
+        temporary = checkpoint + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump({'path': os.path.abspath(path), 'records': records}, file)
+        os.replace(temporary, checkpoint)
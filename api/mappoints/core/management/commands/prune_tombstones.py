@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from mappoints.core.models import Tombstone
+from mappoints.core.sync import TOMBSTONE_RETENTION
+
+class Command(BaseCommand):
+    """
+    Delete the tombstones of the deletions older than the sync token retention.
+    The clients whose sync tokens are older than that get a 410 from /sync/
+    and sync again from scratch, so they never miss a pruned deletion.
+    """
+
+    help = 'Delete the tombstones older than the sync token retention.'
+
+    def handle(self, *args, **options):
+        count = Tombstone.objects.prune(timezone.now() - TOMBSTONE_RETENTION)
+        self.stdout.write('Deleted {} tombstone(s).'.format(count))
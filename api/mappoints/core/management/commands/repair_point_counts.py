@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from mappoints.core.models import Point
+
+class Command(BaseCommand):
+    """
+    Recompute the comment, tag and star counts of the points, correcting the counts
+    that have drifted from the actual number of comments, tags and stars
+    (e.g. after rows were changed outside the application).
+    """
+
+    help = 'Recompute the comment, tag and star counts of the points in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='The number of points counted in each transaction.')
+        parser.add_argument('ids', nargs='*', type=int,
+                            help='The ids of the points to repair (default: all points).')
+
+    def handle(self, *args, **options):
+        queryset = Point.objects.all()
+        if options['ids']:
+            queryset = queryset.filter(id__in=options['ids'])
+
+        count = queryset.update_counts(batch_size=options['batch_size'])
+        self.stdout.write('Corrected the counts of {} point(s).'.format(count))
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.10 on 2026-10-16 22:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_auto_20190323_1943'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['created', 'id'], name='core_commen_created_32b7cb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='point',
+            index=models.Index(fields=['created', 'id'], name='core_point_created_54c180_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='star',
+            index=models.Index(fields=['created', 'id'], name='core_star_created_5f8611_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['created', 'id'], name='core_tag_created_ab9854_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['created', 'id'], name='core_user_created_49fd20_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.10 on 2026-10-16 22:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_created_id_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='point',
+            index=models.Index(fields=['latitude', 'longitude'], name='core_point_latitud_57e6ff_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.2.10 on 2026-10-16 22:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_point_coordinates_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='point',
+            name='geohash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=12),
+        ),
+        migrations.AddIndex(
+            model_name='point',
+            index=models.Index(fields=['geohash'], name='core_point_geohash_458af9_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations, transaction
+
+from mappoints.core.spatial import encode_geohash
+
+BATCH_SIZE = 1000
+
+def backfill_geohashes(apps, schema_editor):
+    """
+    Compute the geohashes of the existing points in batches of BATCH_SIZE.
+
+    Each batch is committed on its own and only points without a geohash
+    are selected, so an interrupted backfill continues where it stopped
+    when the migration is run again.
+    """
+
+    Point = apps.get_model('core', 'Point')
+
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                Point.objects.filter(geohash='', id__gt=last_id)
+                .order_by('id')
+                .only('id', 'latitude', 'longitude')[:BATCH_SIZE]
+            )
+            if not batch:
+                return
+            for point in batch:
+                point.geohash = encode_geohash(point.latitude, point.longitude)
+            Point.objects.bulk_update(batch, ['geohash'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('core', '0006_point_geohash'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_geohashes, migrations.RunPython.noop),
+    ]
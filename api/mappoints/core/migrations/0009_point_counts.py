@@ -0,0 +1,32 @@
+# Generated by Django 2.2.10 on 2026-10-16 22:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_updated_and_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='point',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='point',
+            name='star_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='point',
+            name='tag_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='point',
+            index=models.Index(fields=['star_count', 'id'], name='core_point_star_co_b53b45_idx'),
+        ),
+    ]
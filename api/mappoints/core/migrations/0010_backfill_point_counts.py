@@ -0,0 +1,52 @@
+from django.db import migrations, transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 1000
+
+def count_subquery(model):
+    """
+    Build a subquery counting the rows of a model that belong to the outer point.
+    """
+
+    counts = model.objects.filter(point=OuterRef('pk')).order_by().values('point').annotate(count=Count('id'))
+    return Coalesce(Subquery(counts.values('count'), output_field=IntegerField()), 0)
+
+def backfill_counts(apps, schema_editor):
+    """
+    Count the comments, tags and stars of the existing points in batches of BATCH_SIZE.
+
+    Each batch is counted with a single update and committed on its own.
+    Counting is idempotent, so an interrupted backfill can simply be run again.
+    """
+
+    Point = apps.get_model('core', 'Point')
+    Comment = apps.get_model('core', 'Comment')
+    Tag = apps.get_model('core', 'Tag')
+    Star = apps.get_model('core', 'Star')
+
+    last_id = 0
+    while True:
+        ids = list(Point.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:BATCH_SIZE])
+        if not ids:
+            return
+        with transaction.atomic():
+            Point.objects.filter(id__in=ids).update(
+                comment_count=count_subquery(Comment),
+                tag_count=count_subquery(Tag),
+                star_count=count_subquery(Star),
+            )
+        last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('core', '0009_point_counts'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_counts, migrations.RunPython.noop),
+    ]
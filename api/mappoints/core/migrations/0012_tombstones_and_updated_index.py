@@ -0,0 +1,47 @@
+# Generated by Django 2.2.10 on 2026-10-16 23:24
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_user_token_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=20)),
+                ('instance_id', models.PositiveIntegerField()),
+                ('deleted', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['updated', 'id'], name='core_commen_updated_dd98be_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='point',
+            index=models.Index(fields=['updated', 'id'], name='core_point_updated_9dfb66_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='star',
+            index=models.Index(fields=['updated', 'id'], name='core_star_updated_7df0ab_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['updated', 'id'], name='core_tag_updated_132096_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['updated', 'id'], name='core_user_updated_7198ca_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['deleted', 'id'], name='core_tombst_deleted_54adc6_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.2.10 on 2026-10-16 23:36
+
+from django.db import migrations
+import mappoints.core.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_tombstones_and_updated_index'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', mappoints.core.models.UserManager()),
+            ],
+        ),
+    ]
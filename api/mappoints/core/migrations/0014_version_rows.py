@@ -0,0 +1,24 @@
+from django.db import migrations
+
+VERSION_NAMES = ('user', 'point', 'comment', 'tag', 'star')
+
+def insert_versions(apps, schema_editor):
+    """
+    Insert the versions of the models that have not changed yet, so that
+    every change of a version is a single update.
+    """
+
+    Version = apps.get_model('core', 'Version')
+    existing = set(Version.objects.filter(name__in=VERSION_NAMES).values_list('name', flat=True))
+    Version.objects.bulk_create([Version(name=name, value=0) for name in VERSION_NAMES if name not in existing])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_user_manager'),
+    ]
+
+    operations = [
+        migrations.RunPython(insert_versions, migrations.RunPython.noop),
+    ]
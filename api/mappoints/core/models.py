@@ -1,32 +1,351 @@
-from django.db import models
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.db import IntegrityError, models, router, transaction
 from django.conf import settings
+from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager as AuthUserManager
+from django.db.models import F, Count
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from mappoints.core.spatial import encode_geohash
+from mappoints.core.tiles import invalidate_tiles, invalidate_all_tiles
+from mappoints.core.representations import invalidate_point_representations
+from mappoints.core.tokens import invalidate_token_versions
+
+deletions = threading.local()
+
+class DeletionBatch:
+    """
+    The changes made by the post_delete receivers for the instances deleted in a
+    batched deletion (see batched_deletion), applied at once when the deletion ends.
+    """
+
+    def __init__(self):
+        self.deleted_points = set()
+        self.point_counts = defaultdict(Counter)
+        self.tombstones = defaultdict(list)
+        self.versions = set()
+
+    def apply(self):
+        """
+        Change the counts of the points with one update per count and distinct change,
+        except for the points deleted themselves, record the tombstones of each model
+        with a single insert and change the version of each model once.
+        """
+
+        for field, changes in self.point_counts.items():
+            changes = {pk: change for pk, change in changes.items() if pk not in self.deleted_points}
+            if changes:
+                Point.objects.change_counts(field, changes)
+        for name, ids in self.tombstones.items():
+            Tombstone.objects.record(name, ids)
+        for name in sorted(self.versions):
+            Version.objects.bump(name)
+
+def get_deletion_batch():
+    """
+    Get the batch of the deletion in progress, or None outside of a batched deletion.
+    """
+
+    return getattr(deletions, 'batch', None)
+
+@contextmanager
+def batched_deletion(using):
+    """
+    Batch the changes made by the post_delete receivers for the instances deleted
+    inside the block, so that deleting an instance together with its cascades takes
+    a number of queries that does not grow with the number of deleted children
+    (apart from the deletion itself).
+    The batch is applied at the end of the block, in the same transaction as the
+    deletion. A nested block is part of the outermost one.
+
+    Parameters:
+        - using: the alias of the database of the deletion
+    """
+
+    if get_deletion_batch() is not None:
+        yield
+        return
 
+    with transaction.atomic(using=using, savepoint=False):
+        batch = deletions.batch = DeletionBatch()
+        try:
+            yield
+        finally:
+            deletions.batch = None
+        batch.apply()
+
+class BaseQuerySet(models.QuerySet):
+    """
+    The base queryset of the implemented models. Deletes the instances in a batched deletion.
+    """
+
+    def delete(self):
+        with batched_deletion(self.db):
+            return super().delete()
+
+    delete.alters_data = True
+    delete.queryset_only = True
 
 class BaseModel(models.Model):
     """
     The base model that is derived by all the implemented models.
-    Adds an automatic created field which denotes when an instance of the model was created.
+    Adds an automatic created field which denotes when an instance of the model was created
+    and an automatic updated field which denotes when it was last saved.
+    The (created, id) index backs the keyset pagination of the collections
+    and the (updated, id) index backs the delta sync of the changed instances.
     """
 
     created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    objects = BaseQuerySet.as_manager()
 
     class Meta:
         abstract = True
+        indexes = [
+            models.Index(fields=['created', 'id']),
+            models.Index(fields=['updated', 'id']),
+        ]
+
+    def delete(self, using=None, keep_parents=False):
+        with batched_deletion(using or router.db_for_write(self.__class__, instance=self)):
+            return super().delete(using, keep_parents)
+
+class UserManager(AuthUserManager.from_queryset(BaseQuerySet)):
+    """
+    The User manager. The manager of Django's users with the base queryset.
+    """
 
 class User(BaseModel, AbstractUser):
     """
     The User model. Represents a user that can create and manipulate
     Points, Comments, Tags and Stars.
     Derived from AbstractUser to allow working with Django's built-in authentication.
+    The token version is a claim of the user's JWT tokens. It changes when the
+    tokens are revoked or when a field the tokens depend on (token_fields) is saved
+    with a new value, which invalidates every token issued before.
     """
 
     location = models.CharField(max_length=100, blank=True, default='')
+    token_version = models.PositiveIntegerField(default=0, editable=False)
+
+    token_fields = ('username', 'password', 'is_active', 'is_superuser')
+
+    objects = UserManager()
+
+    class Meta(BaseModel.Meta):
+        pass
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_token_fields = {
+            name: instance.__dict__[name] for name in cls.token_fields if name in instance.__dict__
+        }
+        return instance
+
+    def save(self, *args, **kwargs):
+        loaded = getattr(self, 'loaded_token_fields', {})
+        if any(self.__dict__.get(name, value) != value for name, value in loaded.items()):
+            self.token_version += 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = list(update_fields) + ['token_version']
+        super().save(*args, **kwargs)
+        self.loaded_token_fields = {
+            name: self.__dict__[name] for name in self.token_fields if name in self.__dict__
+        }
+
+    def revoke_tokens(self):
+        """
+        Invalidate every JWT token issued to the user so far.
+        """
+
+        User.objects.filter(pk=self.pk).update(token_version=models.F('token_version') + 1)
+        self.refresh_from_db(fields=['token_version'])
+        invalidate_token_versions([self.pk])
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    """
+    Invalidate the cached token version of a user when the user is saved or deleted.
+    """
+
+    invalidate_token_versions([instance.pk])
+
+class PointQuerySet(BaseQuerySet):
+    """
+    The Point queryset. Keeps the geohash and the updated time of the points up to date,
+    changes the point version and invalidates the cached tiles in the bulk operations
+    that bypass Point.save() and the model signals.
+    """
+
+    tile_fields = {'name', 'latitude', 'longitude'}
+    counter_fields = {'comment_count': 'comments', 'tag_count': 'tags', 'star_count': 'stars'}
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.geohash = encode_geohash(obj.latitude, obj.longitude)
+        objs = super().bulk_create(objs, *args, **kwargs)
+        Version.objects.bump('point')
+        invalidate_tiles((obj.latitude, obj.longitude) for obj in objs)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        fields = list(fields)
+        now = timezone.now()
+        for obj in objs:
+            obj.updated = now
+            if 'latitude' in fields or 'longitude' in fields:
+                obj.geohash = encode_geohash(obj.latitude, obj.longitude)
+        if 'latitude' in fields or 'longitude' in fields:
+            fields.append('geohash')
+        count = super().bulk_update(objs, fields + ['updated'], *args, **kwargs)
+        Version.objects.bump('point')
+        if self.tile_fields.intersection(fields):
+            invalidate_all_tiles()
+        return count
+
+    def update(self, **kwargs):
+        kwargs.setdefault('updated', timezone.now())
+
+        if 'latitude' in kwargs or 'longitude' in kwargs:
+            latitude = kwargs.get('latitude')
+            longitude = kwargs.get('longitude')
+            if any(value is None or hasattr(value, 'resolve_expression') for value in (latitude, longitude)):
+                # The new coordinates depend on each row, so the geohashes are computed after the update.
+                ids = list(self.values_list('id', flat=True))
+                count = super().update(**kwargs)
+                self.model.objects.filter(id__in=ids).update_geohashes()
+                invalidate_all_tiles()
+                return count
+            kwargs['geohash'] = encode_geohash(latitude, longitude)
+
+        count = super().update(**kwargs)
+        Version.objects.bump('point')
+        if self.tile_fields.intersection(kwargs):
+            invalidate_all_tiles()
+        return count
+
+    update.alters_data = True
+
+    def change_counts(self, field, changes):
+        """
+        Change a count of many points with one update per distinct change, and
+        invalidate the cached representations of the points.
+
+        Parameters:
+            - field: the count field of the points (e.g. 'star_count')
+            - changes: dictionary mapping point ids to the change of their count
+        """
+
+        ids_by_change = defaultdict(list)
+        for pk, change in changes.items():
+            ids_by_change[change].append(pk)
+
+        now = timezone.now()
+        for change, ids in ids_by_change.items():
+            # The counts do not change the point version (see point_child_changed).
+            models.QuerySet.update(self.filter(id__in=ids), **{field: Greatest(F(field) + change, 0), 'updated': now})
+        invalidate_point_representations(changes)
+
+    change_counts.alters_data = True
+
+    def update_geohashes(self, batch_size=1000):
+        """
+        Compute the geohashes of the points in the queryset in batches.
+
+        Parameters:
+            - batch_size: the number of points read and updated at a time
+
+        Returns:
+            - the number of updated points
+        """
+
+        count = 0
+        last_id = 0
+        while True:
+            batch = list(self.filter(id__gt=last_id).order_by('id').only('id', 'latitude', 'longitude')[:batch_size])
+            if not batch:
+                return count
+            for point in batch:
+                point.geohash = encode_geohash(point.latitude, point.longitude)
+            self.bulk_update(batch, ['geohash'])
+            count += len(batch)
+            last_id = batch[-1].id
+
+    update_geohashes.alters_data = True
+
+    def update_counts(self, batch_size=1000):
+        """
+        Recompute the comment, tag and star counts of the points in the queryset in batches.
+
+        Each batch is locked, counted and corrected in a transaction of its own,
+        and only the points whose counts are wrong are written.
+
+        Parameters:
+            - batch_size: the number of points read and counted at a time
+
+        Returns:
+            - the number of corrected points
+        """
+
+        count = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    self.filter(id__gt=last_id)
+                    .order_by('id')
+                    .select_for_update()
+                    .only('id', *self.counter_fields)[:batch_size]
+                )
+                if not batch:
+                    return count
+
+                ids = [point.id for point in batch]
+                counts = {}
+                for field, related_name in self.counter_fields.items():
+                    model = self.model._meta.get_field(related_name).related_model
+                    counts[field] = dict(model.objects.filter(point__in=ids).values_list('point').annotate(Count('id')))
+
+                changed = []
+                for point in batch:
+                    values = {field: counts[field].get(point.id, 0) for field in self.counter_fields}
+                    if any(getattr(point, field) != value for field, value in values.items()):
+                        for field, value in values.items():
+                            setattr(point, field, value)
+                        changed.append(point)
+                if changed:
+                    self.model.objects.bulk_update(changed, list(self.counter_fields))
+
+            count += len(changed)
+            last_id = batch[-1].id
+
+    update_counts.alters_data = True
 
 class Point(BaseModel):
     """
     The Point model. Represents a geographic location.
+    The (latitude, longitude) index backs the bounding box queries.
+    The geohash is the spatial cell of the location, kept up to date on save
+    and in the bulk operations of PointQuerySet. Its index turns the points
+    of a cell into a plain B-tree range scan on any database.
+    The location loaded from the database is remembered, so that the cached
+    tiles of both the previous and the new location can be invalidated on save.
+    The comment, tag and star counts are maintained by the signals of those models
+    with atomic updates, and are left out of the update of Point.save() (unless
+    given in update_fields), so a stale instance cannot overwrite them. The (star_count, id) index backs
+    the ordering of the points by their star count.
     """
 
     name = models.CharField(max_length=100)
@@ -35,10 +354,68 @@ class Point(BaseModel):
     longitude = models.DecimalField(max_digits=9, decimal_places=6,
                                     validators=[MinValueValidator(-180), MaxValueValidator(180)])
     description = models.TextField(blank=True, default='')
+    geohash = models.CharField(max_length=12, blank=True, default='', editable=False)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    tag_count = models.PositiveIntegerField(default=0, editable=False)
+    star_count = models.PositiveIntegerField(default=0, editable=False)
     creator = models.ForeignKey(User, related_name='points', on_delete=models.CASCADE)
 
-    class Meta:
+    objects = PointQuerySet.as_manager()
+
+    class Meta(BaseModel.Meta):
         unique_together = ('name', 'creator')
+        indexes = BaseModel.Meta.indexes + [
+            models.Index(fields=['latitude', 'longitude']),
+            models.Index(fields=['geohash']),
+            models.Index(fields=['star_count', 'id']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_location = (instance.__dict__.get('latitude'), instance.__dict__.get('longitude'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        self.geohash = encode_geohash(self.latitude, self.longitude)
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and ('latitude' in update_fields or 'longitude' in update_fields):
+            kwargs['update_fields'] = list(update_fields) + ['geohash']
+        super().save(*args, **kwargs)
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        """
+        Leave the counts out of the update of a save without update_fields.
+
+        The counts are left out of the update only, so a point whose row was
+        deleted meanwhile is still inserted again with all of its fields, as
+        for any model saved without update_fields.
+        """
+
+        if update_fields is None:
+            values = [value for value in values if value[0].name not in PointQuerySet.counter_fields]
+        return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+
+@receiver(post_save, sender=Point)
+@receiver(post_delete, sender=Point)
+def point_changed(sender, instance, **kwargs):
+    """
+    Invalidate the cached representation of the point and the cached tiles containing
+    the point (before and after the change) when a point is saved or deleted.
+    """
+
+    invalidate_point_representations([instance.pk])
+    batch = get_deletion_batch()
+    if kwargs['signal'] is post_delete and batch is not None:
+        batch.deleted_points.add(instance.pk)
+
+    locations = [(instance.latitude, instance.longitude)]
+    loaded_location = getattr(instance, 'loaded_location', None)
+    if loaded_location is not None and None not in loaded_location:
+        locations.append(loaded_location)
+    invalidate_tiles(locations)
+    instance.loaded_location = (instance.latitude, instance.longitude)
 
 class Tag(BaseModel):
     """
@@ -49,7 +426,7 @@ class Tag(BaseModel):
     creator = models.ForeignKey(User, related_name='tags', on_delete=models.CASCADE)
     point = models.ForeignKey(Point, related_name='tags', on_delete=models.CASCADE)
 
-    class Meta:
+    class Meta(BaseModel.Meta):
         unique_together = ('name', 'point')
 
 class Comment(BaseModel):
@@ -61,6 +438,9 @@ class Comment(BaseModel):
     point = models.ForeignKey(Point, related_name='comments', on_delete=models.CASCADE)
     creator = models.ForeignKey(User, related_name='comments', on_delete=models.CASCADE)
 
+    class Meta(BaseModel.Meta):
+        pass
+
 class Star(BaseModel):
     """
     The Star model. Represents a 'like'-esque relation between a User and a Point that is
@@ -70,5 +450,201 @@ class Star(BaseModel):
     point = models.ForeignKey(Point, related_name='stars', on_delete=models.CASCADE)
     creator = models.ForeignKey(User, related_name='stars', on_delete=models.CASCADE)
 
-    class Meta:
+    class Meta(BaseModel.Meta):
         unique_together = ('creator', 'point')
+
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Star)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Star)
+def point_child_changed(sender, instance, created=False, **kwargs):
+    """
+    Update the updated time of a point and invalidate its cached representation
+    when one of its comments, tags or stars is saved or deleted, since the point's
+    representation lists them. The matching count of the point is incremented
+    or decremented in the same update.
+
+    In a batched deletion the decrements are added up per point and applied by
+    the batch, which skips the points deleted in the same deletion.
+    """
+
+    changes = {'updated': timezone.now()}
+    field = '{}_count'.format(sender._meta.model_name)
+    batch = get_deletion_batch()
+    if kwargs['signal'] is post_delete and batch is not None:
+        batch.point_counts[field][instance.point_id] -= 1
+        return
+    if kwargs['signal'] is post_delete:
+        changes[field] = Greatest(F(field) - 1, 0)
+    elif created:
+        changes[field] = F(field) + 1
+
+    # The base update, which does not change the point version: the responses listing
+    # the counts depend on the comment, tag and star versions already.
+    models.QuerySet.update(Point.objects.filter(pk=instance.point_id), **changes)
+    invalidate_point_representations([instance.point_id])
+
+class TombstoneManager(models.Manager):
+    """
+    The Tombstone manager. Records and prunes the deletions.
+    """
+
+    def record(self, name, ids):
+        """
+        Record the deletion of instances of a model with a single insert.
+
+        Parameters:
+            - name: the model name of the deleted instances (e.g. 'point')
+            - ids: the ids of the deleted instances
+        """
+
+        now = timezone.now()
+        self.bulk_create([Tombstone(model=name, instance_id=pk, deleted=now) for pk in ids])
+
+    def prune(self, before):
+        """
+        Delete the tombstones of the deletions made before the given time.
+
+        Returns:
+            - the number of deleted tombstones
+        """
+
+        # Every model has post_delete receivers, so a regular delete would load the rows first.
+        return self.filter(deleted__lt=before)._raw_delete(self.db)
+
+class Tombstone(models.Model):
+    """
+    The Tombstone model. Records the deletion of a Point, Comment, Tag or Star,
+    so that the clients syncing their copies of the instances (see sync.py) learn
+    which instances are gone. A tombstone only holds the model name and id of the
+    deleted instance, and the tombstones older than the sync token retention are pruned.
+    The (deleted, id) index backs the delta sync of the deletions.
+    """
+
+    model = models.CharField(max_length=20)
+    instance_id = models.PositiveIntegerField()
+    deleted = models.DateTimeField(default=timezone.now)
+
+    objects = TombstoneManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deleted', 'id']),
+        ]
+
+@receiver(post_delete, sender=Point)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Star)
+def synced_instance_deleted(sender, instance, **kwargs):
+    """
+    Record the deletion of a point, comment, tag or star for the delta sync.
+    In a batched deletion the tombstones are recorded by the batch.
+    """
+
+    batch = get_deletion_batch()
+    if batch is not None:
+        batch.tombstones[sender._meta.model_name].append(instance.pk)
+    else:
+        Tombstone.objects.record(sender._meta.model_name, [instance.pk])
+
+pending_versions = threading.local()
+
+class VersionManager(models.Manager):
+    """
+    The Version manager. Reads and changes the versions of the models.
+    """
+
+    def get_versions(self, names):
+        """
+        Get the versions of the given models with a single primary key lookup.
+
+        Parameters:
+            - names: the model names of the versions
+
+        Returns:
+            - dictionary mapping the model names to (value, updated) tuples,
+              (0, None) for models that have not changed yet
+        """
+
+        versions = {name: (0, None) for name in names}
+        for name, value, updated in self.filter(name__in=names).values_list('name', 'value', 'updated'):
+            versions[name] = (value, updated)
+        return versions
+
+    def get_pending(self):
+        """
+        Get the set of the names of the versions to change when the current transaction commits.
+        """
+
+        return pending_versions.__dict__.setdefault(self.db, set())
+
+    def bump(self, name):
+        """
+        Change the version of a model after its instances have been created, updated or deleted.
+
+        The versions are changed when the current transaction commits (right away
+        outside of a transaction), once for all the changes of a model in the
+        transaction, so that the writers do not hold the lock of a version row
+        until their transactions end.
+        """
+
+        self.get_pending().add(name)
+        transaction.on_commit(self.apply_pending, using=self.db)
+
+    def apply_pending(self):
+        """
+        Change the versions of the committed changes with an update for each.
+
+        The versions of the models are inserted by a migration. A version missing
+        anyway is inserted in a savepoint, and when a concurrent change inserted it
+        meanwhile, the version is updated instead.
+        """
+
+        pending = self.get_pending()
+        names = sorted(pending)
+        pending.clear()
+
+        now = timezone.now()
+        for name in names:
+            if self.filter(name=name).update(value=F('value') + 1, updated=now):
+                continue
+            try:
+                with transaction.atomic(using=self.db):
+                    self.create(name=name, value=1)
+            except IntegrityError:
+                self.filter(name=name).update(value=F('value') + 1, updated=now)
+
+class Version(models.Model):
+    """
+    The Version model. Represents the version of the instances of a model, which
+    changes whenever an instance is created, updated or deleted.
+
+    The versions are stored in the database, so that every process sees the same
+    versions. They are part of the ETags of the responses and of the cache keys
+    of the results computed from the instances.
+    """
+
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    objects = VersionManager()
+
+@receiver(post_save)
+@receiver(post_delete)
+def instance_changed(sender, instance, **kwargs):
+    """
+    Change the version of a model when one of its instances is saved or deleted.
+    In a batched deletion the version is changed once by the batch.
+    """
+
+    if not isinstance(instance, BaseModel):
+        return
+    batch = get_deletion_batch()
+    if kwargs['signal'] is post_delete and batch is not None:
+        batch.versions.add(sender._meta.model_name)
+    else:
+        Version.objects.bump(sender._meta.model_name)
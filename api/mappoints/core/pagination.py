@@ -0,0 +1,319 @@
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from furl import furl
+from rest_framework.exceptions import NotFound
+
+from mappoints.core.spatial import find_nearest
+
+class KeysetPagination:
+    """
+    Paginate a queryset with opaque cursors on a deterministic ordering.
+
+    Pages larger than chunk_size can also be iterated over in chunks of rows.
+
+    Instead of counting rows with OFFSET, each page is fetched by filtering
+    on the ordering values of the last (or first) item of the previous page,
+    which keeps the cost of a page constant however deep a client pages.
+    The default ordering ('created', 'id') is covered by the composite index
+    declared on BaseModel.
+
+    Query parameters:
+        - cursor: opaque cursor taken from a '_next' or '_prev' link
+        - limit: number of items per page (default: page_size, max: max_page_size)
+    """
+
+    page_size = 100
+    max_page_size = 1000
+    chunk_size = 100
+    ordering = ('created', 'id')
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = tuple(ordering)
+
+    def paginate_queryset(self, queryset, request):
+        """
+        Get a single page of the queryset as specified by the request's cursor.
+
+        Parameters:
+            - queryset: the queryset to paginate
+            - request: the request containing the cursor and limit parameters
+
+        Errors:
+            - the cursor is malformed or does not match the ordering (404)
+
+        Returns:
+            - list of model instances (or .values() rows) on the requested page
+        """
+
+        return self.get_page(self.get_page_queryset(queryset, request))
+
+    def iterate_queryset(self, queryset, request):
+        """
+        Iterate over a single page of the queryset while reading it from the
+        database in chunks, so that the whole page is never held in memory.
+
+        Pages fetched backwards from a '_prev' cursor are read in reverse order
+        and are therefore buffered.
+
+        Parameters:
+            - queryset: the queryset to paginate
+            - request: the request containing the cursor and limit parameters
+
+        Errors:
+            - the cursor is malformed or does not match the ordering (404)
+
+        Returns:
+            - iterator of model instances (or .values() rows) on the requested page
+        """
+
+        queryset = self.get_page_queryset(queryset, request)
+        if self.reverse:
+            return iter(self.get_page(queryset))
+        return self.iterate_page(queryset)
+
+    def iterate_page(self, queryset):
+        """
+        Yield the rows of a forward page queryset, storing the page bounds once exhausted.
+        """
+
+        first = last = None
+        has_more = False
+        for count, row in enumerate(queryset.iterator(chunk_size=self.chunk_size)):
+            if count == self.limit:
+                has_more = True
+                break
+            if first is None:
+                first = row
+            last = row
+            yield row
+
+        self.set_page_bounds(first, last, has_more)
+
+    def get_page_queryset(self, queryset, request):
+        """
+        Filter, order and slice the queryset for the page requested with the cursor.
+        One extra row is included to find out whether there are more rows after the page.
+        """
+
+        self.request = request
+        self.model = queryset.model
+        self.limit = self.get_page_size(request)
+        self.position, self.reverse = self.decode_cursor(request)
+
+        if self.position is not None:
+            queryset = queryset.filter(self.get_position_filter(self.position, self.reverse))
+        return queryset.order_by(*self.get_ordering(self.reverse))[:self.limit + 1]
+
+    def get_page(self, queryset):
+        """
+        Evaluate the page queryset into a list in the ordering of the collection.
+        """
+
+        results = list(queryset)
+        has_more = len(results) > self.limit
+        page = results[:self.limit]
+
+        if self.reverse:
+            page.reverse()
+        self.set_page_bounds(page[0] if page else None, page[-1] if page else None, has_more)
+        return page
+
+    def set_page_bounds(self, first, last, has_more):
+        """
+        Store the first and last rows of the page and whether the adjacent pages exist.
+        """
+
+        self.first = first
+        self.last = last
+
+        if self.reverse:
+            self.has_next = self.position is not None
+            self.has_prev = has_more
+        else:
+            self.has_next = has_more
+            self.has_prev = self.position is not None
+
+    def get_links(self):
+        """
+        Get the '_next' and '_prev' links of the current page.
+
+        Returns:
+            - dictionary with '_next' and '_prev' urls (None if no such page exists)
+        """
+
+        next_url = None
+        prev_url = None
+
+        if self.has_next and self.last is not None:
+            next_url = self.encode_cursor(self.last, reverse=False)
+        if self.has_prev and self.first is not None:
+            prev_url = self.encode_cursor(self.first, reverse=True)
+
+        return {'_next': next_url, '_prev': prev_url}
+
+    def get_page_size(self, request):
+        """
+        Get the page size from the limit query parameter, falling back to the default
+        page size if the parameter is missing or invalid.
+        """
+
+        try:
+            limit = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+
+        if limit <= 0:
+            return self.page_size
+        return min(limit, self.max_page_size)
+
+    def get_ordering(self, reverse=False):
+        """
+        Get the order_by arguments for the page query, flipped for reverse paging.
+        """
+
+        if not reverse:
+            return self.ordering
+        return tuple(field[1:] if field.startswith('-') else '-' + field for field in self.ordering)
+
+    def get_position_filter(self, position, reverse=False):
+        """
+        Build the keyset filter selecting the rows after (or before) the cursor position.
+
+        For ordering (a, b) and position (x, y) going forward this is
+        a > x OR (a = x AND b > y), with the comparisons flipped
+        for descending fields and for reverse paging.
+        """
+
+        condition = Q()
+        for index, field in enumerate(self.ordering):
+            descending = field.startswith('-') != reverse
+            name = field.lstrip('-')
+            lookup = '{}__{}'.format(name, 'lt' if descending else 'gt')
+
+            term = Q(**{lookup: position[index]})
+            for previous, value in zip(self.ordering[:index], position):
+                term &= Q(**{previous.lstrip('-'): value})
+            condition |= term
+
+        return condition
+
+    def encode_cursor(self, instance, reverse=False):
+        """
+        Build the url of the page after (or before) the given instance.
+
+        Parameters:
+            - instance: the model instance (or .values() row) marking the cursor position
+            - reverse: whether the cursor points to the previous page
+
+        Returns:
+            - the current url with the cursor query parameter replaced
+        """
+
+        position = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            value = instance[name] if isinstance(instance, dict) else getattr(instance, name)
+            position.append(value.isoformat() if isinstance(value, datetime) else str(value))
+
+        payload = json.dumps({'p': position, 'r': reverse}, separators=(',', ':'))
+        cursor = urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+        url = furl(self.request.build_absolute_uri())
+        url.args[self.cursor_query_param] = cursor
+        return url.url
+
+    def decode_cursor(self, request):
+        """
+        Decode the cursor query parameter into a position and a direction.
+
+        Returns:
+            - tuple of (position values or None, reverse)
+        """
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+
+        try:
+            padding = '=' * (-len(cursor) % 4)
+            payload = json.loads(urlsafe_b64decode(cursor + padding).decode())
+            position = payload['p']
+            reverse = bool(payload['r'])
+            if len(position) != len(self.ordering):
+                raise ValueError
+            position = [self.to_python(field.lstrip('-'), value) for field, value in zip(self.ordering, position)]
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound('Invalid cursor.')
+
+        return position, reverse
+
+    def to_python(self, field, value):
+        """
+        Convert a position value of the cursor to the type of the ordering field.
+        """
+
+        return self.model._meta.get_field(field).to_python(value)
+
+class DistancePagination(KeysetPagination):
+    """
+    Paginate points ranked by their great-circle distance from a location.
+
+    The cursor holds the (distance, id) position of the last (or first) point
+    of the previous page, so the next page only ranks the points beyond it.
+
+    Query parameters:
+        - cursor: opaque cursor taken from a '_next' or '_prev' link
+        - k: number of points per page (default: page_size, max: max_page_size)
+    """
+
+    page_size = 10
+    ordering = ('distance', 'id')
+    page_size_query_param = 'k'
+
+    def paginate_nearby(self, queryset, request, latitude, longitude, radius=None):
+        """
+        Get a single page of the points nearest to a location.
+
+        Parameters:
+            - queryset: the Point queryset to search
+            - request: the request containing the cursor and k parameters
+            - latitude, longitude: the location to measure the distances from
+            - radius: the maximum distance in meters (default: unlimited)
+
+        Errors:
+            - the cursor is malformed (404)
+
+        Returns:
+            - list of dictionaries with the 'distance' and 'id' of the points on the page
+        """
+
+        self.request = request
+        self.model = queryset.model
+        self.limit = self.get_page_size(request)
+        self.position, self.reverse = self.decode_cursor(request)
+        position = tuple(self.position) if self.position is not None else None
+
+        if self.reverse:
+            ranked = find_nearest(queryset, latitude, longitude, self.limit + 1, radius, before=position)
+            has_more = len(ranked) > self.limit
+            ranked = ranked[-self.limit:]
+        else:
+            ranked = find_nearest(queryset, latitude, longitude, self.limit + 1, radius, after=position)
+            has_more = len(ranked) > self.limit
+            ranked = ranked[:self.limit]
+
+        page = [{'distance': distance, 'id': pk} for distance, pk in ranked]
+        self.set_page_bounds(page[0] if page else None, page[-1] if page else None, has_more)
+        return page
+
+    def to_python(self, field, value):
+        if field == 'distance':
+            return float(value)
+        return super().to_python(field, value)
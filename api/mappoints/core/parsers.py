@@ -0,0 +1,30 @@
+import cbor2
+import msgpack
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+class MessagePackParser(BaseParser):
+    """
+    Parse MessagePack request bodies, e.g. the lists of bulk requests.
+    """
+
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, msgpack.UnpackException) as error:
+            raise ParseError('MessagePack parse error - {}'.format(error))
+
+class CBORParser(BaseParser):
+    """
+    Parse CBOR request bodies, e.g. the lists of bulk requests.
+    """
+
+    media_type = 'application/cbor'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return cbor2.loads(stream.read())
+        except (ValueError, cbor2.CBORDecodeError) as error:
+            raise ParseError('CBOR parse error - {}'.format(error))
@@ -18,6 +18,7 @@ class IsCreator(permissions.BasePermission):
             - authenticated AND
                 - a superuser (admin) or the request method is safe (GET, HEAD or OPTIONS) OR
                 - the user who made the request is the creator of the object.
+        The creator is compared by its foreign key, so the creator is never loaded.
         """
 
         if not request.user.is_authenticated:
@@ -29,7 +30,7 @@ class IsCreator(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
 
-        return obj.creator.id == request.user.id
+        return obj.creator_id == request.user.id
 
 class IsSelf(permissions.BasePermission):
     """
@@ -78,24 +79,45 @@ class ActionPermission(permissions.BasePermission):
        AllowAny: ['list', 'retrieve'],
        IsCreator: ['update', 'destroy']
     }
+
+    The action_permissions of each view class are compiled on first use into
+    a table mapping each action to a single instance of its permission class,
+    so a check is a dictionary lookup. When an action is listed under several
+    permissions, the first one applies. Actions that are not listed are denied.
     """
 
+    action_tables = {}
+
+    def get_action_permission(self, view):
+        """
+        Get the permission instance of the view's action from the compiled table of the view class.
+
+        Returns:
+            - the permission instance, or None if the action is not listed
+        """
+
+        table = self.action_tables.get(type(view))
+        if table is None:
+            table = {}
+            for cls, actions in getattr(view, 'action_permissions', {}).items():
+                permission = cls()
+                for action in actions:
+                    table.setdefault(action, permission)
+            self.action_tables[type(view)] = table
+        return table.get(view.action)
+
     def has_permission(self, request, view):
         """
         Check view-level permissions against actions specified in 'action_permissions'.
         """
 
-        for cls, actions in getattr(view, 'action_permissions', {}).items():
-            if view.action is not None and view.action in actions:
-                return cls().has_permission(request, view)
-        return False
+        permission = self.get_action_permission(view)
+        return permission is not None and permission.has_permission(request, view)
 
     def has_object_permission(self, request, view, obj):
         """
         Check object-level permissions against actions specified in 'action_permissions'.
         """
 
-        for cls, actions in getattr(view, 'action_permissions', {}).items():
-            if view.action is not None and view.action in actions:
-                return cls().has_object_permission(request, view, obj)
-        return False
+        permission = self.get_action_permission(view)
+        return permission is not None and permission.has_object_permission(request, view, obj)
@@ -0,0 +1,128 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, RelatedField
+
+def get_relation_path(model, lookup):
+    """
+    Get the chain of relations traversed by a lookup such as 'point__pk'.
+
+    Parameters:
+        - model: the model class the lookup starts from
+        - lookup: the double underscore separated lookup
+
+    Returns:
+        - list of relation names (e.g. ['point'])
+    """
+
+    path = []
+    for name in lookup.split('__'):
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            break
+        if not field.is_relation:
+            break
+        path.append(name)
+        model = field.related_model
+    return path
+
+def get_related_lookups(model, serializer, known=None):
+    """
+    Collect the select_related and prefetch_related lookups needed to
+    serialize instances of a model with the given serializer.
+
+    Expanded FlexFields serializers and hyperlinked relation fields are
+    walked recursively: forward relations are joined with select_related
+    and reverse relations are fetched with a planned Prefetch.
+
+    Parameters:
+        - model: the model class of the serialized instances
+        - serializer: the (possibly expanded) serializer instance
+        - known: name of the relation that is already cached on the instances
+                 by a surrounding prefetch (e.g. 'point' for a point's comments)
+
+    Returns:
+        - tuple of (select_related lookups, Prefetch objects)
+    """
+
+    select = []
+    prefetch = []
+
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+
+        if isinstance(field, serializers.ListSerializer):
+            child_model = field.child.Meta.model
+            prefetch.append(plan_prefetch(model, field.source, child_model, field.child))
+        elif isinstance(field, serializers.BaseSerializer):
+            child_select, child_prefetch = get_related_lookups(field.Meta.model, field)
+            select.append(field.source)
+            select.extend('{}__{}'.format(field.source, lookup) for lookup in child_select)
+            prefetch.extend(
+                Prefetch('{}__{}'.format(field.source, p.prefetch_through), queryset=p.queryset)
+                for p in child_prefetch
+            )
+        elif isinstance(field, ManyRelatedField):
+            child_model = model._meta.get_field(field.source).related_model
+            prefetch.append(plan_prefetch(model, field.source, child_model, field))
+        elif isinstance(field, RelatedField):
+            for lookup in getattr(field, 'parent_lookup_kwargs', {}).values():
+                path = get_relation_path(model, lookup)
+                if path and path[0] != known:
+                    select.append('__'.join(path))
+
+    return select, prefetch
+
+def plan_prefetch(model, source, child_model, field):
+    """
+    Build a Prefetch for a reverse relation whose queryset is itself planned
+    for the serializer (or relation field) that represents the related objects.
+    """
+
+    remote_field = model._meta.get_field(source).remote_field
+    known = remote_field.name if remote_field is not None else None
+
+    if isinstance(field, ManyRelatedField):
+        select = []
+        for lookup in getattr(field.child_relation, 'parent_lookup_kwargs', {}).values():
+            path = get_relation_path(child_model, lookup)
+            if path and path[0] != known:
+                select.append('__'.join(path))
+        prefetch = []
+    else:
+        select, prefetch = get_related_lookups(child_model, field, known=known)
+
+    queryset = child_model.objects.all()
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return Prefetch(source, queryset=queryset)
+
+def plan_queryset(queryset, serializer_class, context):
+    """
+    Apply the select_related/prefetch_related chain needed by a serializer
+    to a queryset, taking the FlexFields 'expand' query parameter into account.
+
+    This keeps the number of queries needed to serialize a list of instances
+    constant regardless of the number of instances.
+
+    Parameters:
+        - queryset: the queryset of the instances to serialize
+        - serializer_class: the serializer class used for the instances
+        - context: the serializer context containing the request
+
+    Returns:
+        - the queryset with the related lookups applied
+    """
+
+    serializer = serializer_class(context=context)
+    select, prefetch = get_related_lookups(queryset.model, serializer)
+
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
@@ -0,0 +1,58 @@
+import cbor2
+import msgpack
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+json_default = JSONEncoder().default
+
+def to_json_types(data):
+    """
+    Convert the values of data that have no JSON counterpart (e.g. Decimal or
+    datetime) the way JSONRenderer does, so that a binary representation decodes
+    to the same data as the JSON representation.
+    """
+
+    if isinstance(data, (str, int, float, bool)) or data is None:
+        return data
+    if isinstance(data, dict):
+        return {key: to_json_types(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [to_json_types(value) for value in data]
+    return to_json_types(json_default(data))
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Render data as MessagePack, a compact binary counterpart of JSON.
+
+    The values that JSON has no type for are converted the same way as by
+    JSONRenderer, so a response decodes to the same data in both formats.
+    """
+
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=json_default, use_bin_type=True)
+
+class CBORRenderer(BaseRenderer):
+    """
+    Render data as CBOR (RFC 7049), a compact binary counterpart of JSON.
+
+    CBOR has tags of its own for decimals and datetimes, but they are rendered
+    the same way as by JSONRenderer instead, so a response decodes to the same
+    data in both formats.
+    """
+
+    media_type = 'application/cbor'
+    format = 'cbor'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return cbor2.dumps(to_json_types(data))
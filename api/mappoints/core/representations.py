@@ -0,0 +1,38 @@
+from django.core.cache import caches
+from django.db import transaction
+
+REPRESENTATION_VERSION = 2
+
+def get_representation_cache():
+    """
+    Get the cache of the serialized representation fragments.
+    """
+
+    return caches['representations']
+
+def get_point_key(pk):
+    """
+    Get the cache key of the representation fragment of a point.
+    """
+
+    return 'point:{}:{}'.format(REPRESENTATION_VERSION, pk)
+
+def invalidate_point_representations(ids):
+    """
+    Remove the cached representation fragments of the given points.
+
+    The fragments are removed right away and once more when the current
+    transaction is committed, so that a fragment cached by a concurrent
+    request from the data before the commit is not kept.
+
+    Parameters:
+        - ids: iterable of point ids
+    """
+
+    keys = [get_point_key(pk) for pk in set(ids)]
+    if not keys:
+        return
+
+    cache = get_representation_cache()
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
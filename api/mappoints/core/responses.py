@@ -1,5 +1,8 @@
+from django.http import StreamingHttpResponse
+from rest_framework.compat import SHORT_SEPARATORS, LONG_SEPARATORS
 from rest_framework.response import Response
-from mappoints.core.utils import get_url, get_parent_url
+from rest_framework.settings import api_settings
+from mappoints.core.utils import get_link_builder
 
 class LinkedCollectionResponse(Response):
     """
@@ -7,16 +10,59 @@ class LinkedCollectionResponse(Response):
     link attributes and wraps the list of resources under the '_items' attribute.
 
     Used when a list of items is requested from a collection (e.g. /users/)
+
+    The '_next' and '_prev' page links given by a paginator are appended
+    to the collection as well.
     """
 
-    def __init__(self, data, request, *args, **kwargs):
-        uri = request.build_absolute_uri()
+    def __init__(self, data, request, *args, links=None, **kwargs):
+        builder = get_link_builder(request)
         super().__init__({
             '_items': data,
-            '_url': get_url(uri),
-            '_parent': get_parent_url(uri)
+            '_url': builder.url,
+            '_parent': builder.parent_url,
+            **(links or {})
         }, *args, **kwargs)
 
+class StreamingLinkedCollectionResponse(StreamingHttpResponse):
+    """
+    A streaming counterpart of LinkedCollectionResponse that renders the same JSON
+    without holding the whole collection in memory.
+
+    The envelope is opened first, then every item is rendered as it is taken from
+    the items iterator, and the '_url', '_parent' and page links are written last,
+    since the page links are known only once all the items have been read.
+
+    Used with JSONRenderer for pages that span several database chunks.
+    """
+
+    def __init__(self, items, request, renderer, get_links=None, *args, **kwargs):
+        self.renderer = renderer
+        self.builder = get_link_builder(request)
+        self.get_links = get_links
+        kwargs.setdefault('content_type', renderer.media_type)
+        super().__init__(self.render_items(items), *args, **kwargs)
+
+    def render_items(self, items):
+        """
+        Render the collection envelope and its items as a sequence of byte strings.
+        """
+
+        item_separator, key_separator = SHORT_SEPARATORS if api_settings.COMPACT_JSON else LONG_SEPARATORS
+        yield '{{"_items"{}['.format(key_separator).encode()
+
+        for index, item in enumerate(items):
+            if index:
+                yield item_separator.encode()
+            yield self.renderer.render(item)
+
+        tail = self.renderer.render({
+            '_url': self.builder.url,
+            '_parent': self.builder.parent_url,
+            **(self.get_links() if self.get_links else {})
+        })
+        yield ']'.encode() + item_separator.encode() + tail[1:]
+
 class LinkedInstanceResponse(Response):
     """
     A specialized subclass of Response that appends a '_parent' link attribute
@@ -26,13 +72,43 @@ class LinkedInstanceResponse(Response):
     """
 
     def __init__(self, data, request, *args, **kwargs):
-        uri = request.build_absolute_uri()
+        builder = get_link_builder(request)
         if data.get('_url'):
-            parent_url = get_parent_url(data['_url'])
+            parent_url = builder.get_parent_url(data['_url'])
         else:
-            parent_url = get_parent_url(uri)
+            parent_url = builder.parent_url
 
         super().__init__({
             **data,
             '_parent': parent_url
         }, *args, **kwargs)
+
+class StreamingFeatureCollectionResponse(StreamingHttpResponse):
+    """
+    Stream a GeoJSON FeatureCollection rendered chunk by chunk of features,
+    so that exporting a collection of any size never holds it in memory.
+    """
+
+    def __init__(self, chunks, renderer, *args, **kwargs):
+        self.renderer = renderer
+        kwargs.setdefault('content_type', renderer.media_type)
+        super().__init__(self.render_chunks(chunks), *args, **kwargs)
+
+    def render_chunks(self, chunks):
+        """
+        Render the feature collection as a sequence of byte strings, one per chunk of features.
+        """
+
+        head, tail = self.renderer.render({'type': 'FeatureCollection', 'features': []}).split(b'[]')
+        item_separator = SHORT_SEPARATORS[0] if api_settings.COMPACT_JSON else LONG_SEPARATORS[0]
+
+        yield head + b'['
+        first = True
+        for features in chunks:
+            if not features:
+                continue
+            if not first:
+                yield item_separator.encode()
+            yield self.renderer.render(features)[1:-1]
+            first = False
+        yield b']' + tail
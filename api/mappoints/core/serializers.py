@@ -2,7 +2,7 @@ from rest_framework import serializers
 from rest_framework_nested.relations import NestedHyperlinkedRelatedField, NestedHyperlinkedIdentityField
 from rest_flex_fields.serializers import FlexFieldsSerializerMixin
 from mappoints.core.models import User, Point, Tag, Comment, Star
-from mappoints.core.utils import get_url, get_parent_url, wrap_url
+from mappoints.core.utils import get_link_builder, get_parent_path, wrap_url
 
 class CreatorSerializer(FlexFieldsSerializerMixin, serializers.HyperlinkedModelSerializer):
     """
@@ -107,12 +107,15 @@ class PointSerializer(FlexFieldsSerializerMixin, serializers.HyperlinkedModelSer
 
     class Meta:
         model = Point
-        fields = ('_url', 'id', 'name', 'latitude', 'longitude', 'description', 'created', 'creator', 'comments', 'tags', 'stars')
+        fields = ('_url', 'id', 'name', 'latitude', 'longitude', 'description', 'created', 'creator', 'comments', 'tags', 'stars',
+                  'comment_count', 'tag_count', 'star_count')
 
     def to_representation(self, instance):
         """
         Override the default serialization to add '_url' and '_parent' link attributes
-        to nested resources (comments, tags and stars).
+        to nested resources (comments, tags and stars) that are included in the representation.
+        The links are relative to the request path, or to the 'path' in the context
+        when the points are listed outside their collection (e.g. /points/nearby/).
 
         Parameters:
             - instance: the Point model instance to serialize.
@@ -122,20 +125,21 @@ class PointSerializer(FlexFieldsSerializerMixin, serializers.HyperlinkedModelSer
         """
 
         data = super().to_representation(instance)
-        uri = self.context['request'].build_absolute_uri()
-        url = get_url(uri)
+        links = get_link_builder(self.context['request'])
+        path = self.context.get('path', links.path)
 
         if self.context.get('action') in ['list', 'create', 'delete'] and hasattr(instance, 'pk'):
-            url = '{}{}/'.format(url, instance.pk)
+            path = '{}{}/'.format(path, instance.pk)
 
         if hasattr(instance, 'pk'):
-            parent_url = '{}{}/'.format(get_parent_url(url), instance.pk)
+            parent_url = '{}{}{}/'.format(links.prefix, get_parent_path(path), instance.pk)
         else:
-            parent_url = '{}/'.format(get_parent_url(url))
+            parent_url = '{}{}/'.format(links.prefix, get_parent_path(path))
+        url = links.get_url(path)
 
-        data['comments'] = {'_items': data['comments'], '_url': url + 'comments/', '_parent': parent_url}
-        data['tags'] = {'_items': data['tags'], '_url': url + 'tags/', '_parent': parent_url}
-        data['stars'] = {'_items': data['stars'], '_url': url + 'stars/', '_parent': parent_url}
+        for name in ('comments', 'tags', 'stars'):
+            if name in data:
+                data[name] = {'_items': data[name], '_url': url + name + '/', '_parent': parent_url}
 
         return data
 
@@ -225,7 +229,7 @@ class UserSerializer(FlexFieldsSerializerMixin, serializers.HyperlinkedModelSeri
     def to_representation(self, instance):
         """
         Override the default serialization to add '_url' and '_parent' link attributes
-        to nested resources (points, comments and stars).
+        to nested resources (points, comments and stars) that are included in the representation.
 
         Parameters:
             - instance: the User model instance to serialize.
@@ -235,30 +239,53 @@ class UserSerializer(FlexFieldsSerializerMixin, serializers.HyperlinkedModelSeri
         """
 
         data = super().to_representation(instance)
-        uri = self.context['request'].build_absolute_uri()
-        url = get_url(uri)
+        links = get_link_builder(self.context['request'])
+        path = self.context.get('path', links.path)
 
         if self.context.get('action') in ['list', 'create', 'delete'] and hasattr(instance, 'pk'):
-            url = '{}{}/'.format(url, instance.pk)
+            path = '{}{}/'.format(path, instance.pk)
 
         if hasattr(instance, 'pk'):
-            parent_url = '{}{}/'.format(get_parent_url(url), instance.pk)
+            parent_url = '{}{}{}/'.format(links.prefix, get_parent_path(path), instance.pk)
         else:
-            parent_url = '{}/'.format(get_parent_url(url))
+            parent_url = '{}{}/'.format(links.prefix, get_parent_path(path))
+        url = links.get_url(path)
 
-        data['points'] = {'_items': data['points'], '_url': url + 'points/', '_parent': parent_url}
-        data['comments'] = {'_items': data['comments'], '_url': url + 'comments/', '_parent': parent_url}
-        data['stars'] = {'_items': data['stars'], '_url': url + 'stars/', '_parent': parent_url}
+        for name in ('points', 'comments', 'stars'):
+            if name in data:
+                data[name] = {'_items': data[name], '_url': url + name + '/', '_parent': parent_url}
 
         return data
 
     class Meta:
         model = User
         fields = ('_url', 'id', 'username', 'password', 'location', 'points', 'comments', 'stars', 'created')
-        extra_kwargs = {'password': {'write_only': True}}
+        # The uniqueness of the username is left to the database (see save_unique in views).
+        extra_kwargs = {
+            'password': {'write_only': True},
+            'username': {'validators': [User.username_validator]},
+        }
 
     expandable_fields = {
         'points': (PointSerializer, {'source': 'points', 'many': True}),
         'comments': (CommentSerializer, {'source': 'comments', 'many': True}),
         'stars': (StarSerializer, {'source': 'stars', 'many': True})
     }
+
+class StarOperationSerializer(serializers.Serializer):
+    """
+    Deserializes an operation of a bulk star request: starring ('add') or unstarring ('remove') a point.
+    Validates each deserialized field.
+    """
+
+    op = serializers.ChoiceField(choices=['add', 'remove'])
+    point = serializers.IntegerField(min_value=1)
+
+class TagOperationSerializer(serializers.Serializer):
+    """
+    Deserializes an operation of a bulk tag request: adding ('add') or removing ('remove') a tag by name.
+    Validates each deserialized field.
+    """
+
+    op = serializers.ChoiceField(choices=['add', 'remove'])
+    name = serializers.CharField(max_length=Tag._meta.get_field('name').max_length)
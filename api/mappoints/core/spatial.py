@@ -0,0 +1,447 @@
+from math import radians, degrees, sin, cos, asin, sqrt, pi
+
+from django.db import connections
+from django.db.models import F, Q, Count, Avg, Window
+from django.db.models.functions import RowNumber, Substr
+from rest_framework.exceptions import ParseError
+
+from mappoints.core.filters import get_bbox_filter
+
+EARTH_RADIUS = 6371008.8
+MAX_DISTANCE = pi * EARTH_RADIUS
+INITIAL_SEARCH_RADIUS = 1000
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 12
+MAX_GEOHASH_CELLS = 32
+
+MAX_ZOOM = 20
+MAX_CLUSTER_CELLS = 2048
+# The number of point ids listed as the sample of a cluster (those with the lowest ids).
+CLUSTER_SAMPLE_SIZE = 5
+
+def get_distance(lat1, lon1, lat2, lon2):
+    """
+    Get the great-circle distance between two coordinates with the haversine formula.
+
+    Parameters:
+        - lat1, lon1: the coordinates of the first location in degrees
+        - lat2, lon2: the coordinates of the second location in degrees
+
+    Returns:
+        - distance in meters
+    """
+
+    lat1, lon1, lat2, lon2 = radians(lat1), radians(lon1), radians(lat2), radians(lon2)
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * asin(min(1, sqrt(a)))
+
+def get_radius_bbox(latitude, longitude, radius):
+    """
+    Get the smallest bounding box containing every location within a radius.
+
+    The longitude range covers the whole globe if the circle contains a pole
+    and wraps around the antimeridian if the circle crosses it.
+
+    Parameters:
+        - latitude, longitude: the center of the circle in degrees
+        - radius: the radius of the circle in meters
+
+    Returns:
+        - tuple of (min_lon, min_lat, max_lon, max_lat)
+    """
+
+    angle = radius / EARTH_RADIUS
+    min_lat = latitude - degrees(angle)
+    max_lat = latitude + degrees(angle)
+
+    if min_lat <= -90 or max_lat >= 90 or sin(angle) >= cos(radians(latitude)):
+        return -180, max(min_lat, -90), 180, min(max_lat, 90)
+
+    delta_lon = degrees(asin(sin(angle) / cos(radians(latitude))))
+    min_lon = longitude - delta_lon
+    max_lon = longitude + delta_lon
+    if min_lon < -180:
+        min_lon += 360
+    if max_lon > 180:
+        max_lon -= 360
+    return min_lon, min_lat, max_lon, max_lat
+
+def get_inner_bbox(latitude, longitude, radius):
+    """
+    Get a bounding box inside a circle, so that every location of the box is within the radius.
+
+    By the haversine formula, sin²(d / 2R) = sin²(Δlat / 2) + cos(lat1) cos(lat2) sin²(Δlon / 2),
+    so the distance is within the radius when each term is at most half of sin²(radius / 2R).
+
+    Parameters:
+        - latitude, longitude: the center of the circle in degrees
+        - radius: the radius of the circle in meters
+
+    Returns:
+        - tuple of (min_lon, min_lat, max_lon, max_lat), or None if the radius is not
+          positive or the box would reach a pole or cross the antimeridian
+    """
+
+    if radius <= 0:
+        return None
+
+    half = sin(radius / EARTH_RADIUS / 2) ** 2 / 2
+    delta_lat = degrees(2 * asin(sqrt(half)))
+    min_lat = latitude - delta_lat
+    max_lat = latitude + delta_lat
+    if min_lat <= -90 or max_lat >= 90 or half >= cos(radians(latitude)):
+        return None
+
+    delta_lon = degrees(2 * asin(sqrt(half / cos(radians(latitude)))))
+    min_lon = longitude - delta_lon
+    max_lon = longitude + delta_lon
+    if min_lon < -180 or max_lon > 180:
+        return None
+    return min_lon, min_lat, max_lon, max_lat
+
+def rank_by_distance(queryset, latitude, longitude, radius, min_radius=0):
+    """
+    Rank the points of a queryset within a ring around a location by their distance.
+
+    The candidates are narrowed down with the bounding box of the outer circle,
+    which is range scanned on the geohash (or the (latitude, longitude)) index,
+    minus a box inside the inner circle, before the exact distances are computed
+    for the candidates only.
+
+    Parameters:
+        - queryset: the Point queryset to search
+        - latitude, longitude: the location to measure the distances from
+        - radius: the maximum distance in meters
+        - min_radius: the minimum distance in meters
+
+    Returns:
+        - list of (distance, id) tuples sorted by distance and id
+    """
+
+    bbox = get_radius_bbox(latitude, longitude, radius)
+    candidates = queryset.filter(get_geohash_filter(*bbox), get_bbox_filter(*bbox))
+    # A meter less, so that no point at the minimum distance is left out by a rounding error.
+    inner_bbox = get_inner_bbox(latitude, longitude, min_radius - 1)
+    if inner_bbox is not None:
+        candidates = candidates.exclude(get_bbox_filter(*inner_bbox))
+    candidates = candidates.values_list('id', 'latitude', 'longitude')
+
+    ranked = []
+    for pk, point_latitude, point_longitude in candidates:
+        distance = get_distance(latitude, longitude, float(point_latitude), float(point_longitude))
+        if min_radius <= distance <= radius:
+            ranked.append((distance, pk))
+
+    ranked.sort()
+    return ranked
+
+def find_nearest(queryset, latitude, longitude, count, radius=None, after=None, before=None):
+    """
+    Find the points nearest to a location, ordered by distance and id.
+
+    The points are searched in a ring starting at the distance of the position
+    (or at the location), whose width starts small and grows until enough points
+    are found, so only the points near the position are scanned.
+
+    Parameters:
+        - queryset: the Point queryset to search
+        - latitude, longitude: the location to measure the distances from
+        - count: the maximum number of points to find
+        - radius: the maximum distance in meters (default: unlimited)
+        - after: only find points after this (distance, id) position
+        - before: only find the points closest to this (distance, id) position from below it
+
+    Returns:
+        - list of (distance, id) tuples sorted by distance and id
+    """
+
+    max_radius = MAX_DISTANCE if radius is None else min(radius, MAX_DISTANCE)
+    width = INITIAL_SEARCH_RADIUS
+
+    if before is not None:
+        outer_radius = min(before[0], max_radius)
+        while True:
+            inner_radius = max(outer_radius - width, 0)
+            ranked = rank_by_distance(queryset, latitude, longitude, outer_radius, inner_radius)
+            ranked = [position for position in ranked if position < before]
+            if len(ranked) >= count or inner_radius == 0:
+                return ranked[-count:]
+            width *= 4
+
+    inner_radius = after[0] if after is not None else 0
+    while True:
+        outer_radius = min(inner_radius + width, max_radius)
+        ranked = rank_by_distance(queryset, latitude, longitude, outer_radius, inner_radius)
+        if after is not None:
+            ranked = [position for position in ranked if position > after]
+        if len(ranked) >= count or outer_radius >= max_radius:
+            return ranked[:count]
+        width *= 4
+
+def get_geohash_bits(precision):
+    """
+    Get the number of longitude and latitude bits of a geohash of the given length.
+    """
+
+    bits = precision * 5
+    return (bits + 1) // 2, bits // 2
+
+def get_geohash_cell(latitude, longitude, precision):
+    """
+    Get the (longitude, latitude) cell indexes of a location on the geohash grid of the given length.
+    """
+
+    lon_bits, lat_bits = get_geohash_bits(precision)
+    lon_index = int((float(longitude) + 180) / 360 * (1 << lon_bits))
+    lat_index = int((float(latitude) + 90) / 180 * (1 << lat_bits))
+    return min(max(lon_index, 0), (1 << lon_bits) - 1), min(max(lat_index, 0), (1 << lat_bits) - 1)
+
+def interleave_geohash_cell(lon_index, lat_index, precision):
+    """
+    Get the Z-order number of a geohash cell by interleaving its longitude and latitude bits,
+    starting with the most significant longitude bit.
+    """
+
+    lon_bits, lat_bits = get_geohash_bits(precision)
+    number = 0
+    for bit in range(precision * 5):
+        if bit % 2 == 0:
+            lon_bits -= 1
+            number = (number << 1) | ((lon_index >> lon_bits) & 1)
+        else:
+            lat_bits -= 1
+            number = (number << 1) | ((lat_index >> lat_bits) & 1)
+    return number
+
+def format_geohash(number, precision):
+    """
+    Format the Z-order number of a geohash cell as a base32 geohash string.
+    """
+
+    chars = []
+    for _ in range(precision):
+        chars.append(GEOHASH_ALPHABET[number & 31])
+        number >>= 5
+    return ''.join(reversed(chars))
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """
+    Encode a location as a geohash.
+
+    A geohash is the Z-order curve position of the location's cell
+    in base32, so every prefix of a geohash is the geohash of an enclosing
+    cell and the points of a cell are a contiguous range in a B-tree index.
+
+    Parameters:
+        - latitude, longitude: the location in degrees
+        - precision: the length of the geohash (12 characters is a cell of a few centimeters)
+
+    Returns:
+        - the geohash string
+    """
+
+    lon_index, lat_index = get_geohash_cell(latitude, longitude, precision)
+    return format_geohash(interleave_geohash_cell(lon_index, lat_index, precision), precision)
+
+def split_bbox(min_lon, min_lat, max_lon, max_lat):
+    """
+    Split a bounding box crossing the antimeridian into the boxes on both sides of it.
+
+    Returns:
+        - list of (min_lon, min_lat, max_lon, max_lat) tuples
+    """
+
+    if min_lon > max_lon:
+        return [(min_lon, min_lat, 180, max_lat), (-180, min_lat, max_lon, max_lat)]
+    return [(min_lon, min_lat, max_lon, max_lat)]
+
+def count_geohash_cells(boxes, precision):
+    """
+    Count the geohash cells of the given length needed to cover a list of bounding boxes.
+    """
+
+    count = 0
+    for min_lon, min_lat, max_lon, max_lat in boxes:
+        min_lon_index, min_lat_index = get_geohash_cell(min_lat, min_lon, precision)
+        max_lon_index, max_lat_index = get_geohash_cell(max_lat, max_lon, precision)
+        count += (max_lon_index - min_lon_index + 1) * (max_lat_index - min_lat_index + 1)
+    return count
+
+def get_geohash_ranges(min_lon, min_lat, max_lon, max_lat, max_cells=MAX_GEOHASH_CELLS, precision=None):
+    """
+    Get the geohash ranges covering a bounding box.
+
+    Unless a geohash length is given, the longest geohash length whose cells
+    cover the bounding box with at most max_cells cells is used. Cells that are
+    adjacent on the Z-order curve are merged into a single range. A bounding box
+    crossing the antimeridian is covered on both sides of it.
+
+    Parameters:
+        - min_lon, min_lat, max_lon, max_lat: the bounding box in degrees
+        - max_cells: the maximum number of cells to cover the bounding box with
+        - precision: the geohash length of the cells (default: chosen with max_cells)
+
+    Returns:
+        - tuple of (sorted list of (first, last) Z-order numbers of the cell ranges, geohash length)
+    """
+
+    boxes = split_bbox(min_lon, min_lat, max_lon, max_lat)
+    if precision is None:
+        precision = 1
+        while precision < GEOHASH_PRECISION and count_geohash_cells(boxes, precision + 1) <= max_cells:
+            precision += 1
+
+    numbers = set()
+    for box_min_lon, box_min_lat, box_max_lon, box_max_lat in boxes:
+        min_lon_index, min_lat_index = get_geohash_cell(box_min_lat, box_min_lon, precision)
+        max_lon_index, max_lat_index = get_geohash_cell(box_max_lat, box_max_lon, precision)
+        for lon_index in range(min_lon_index, max_lon_index + 1):
+            for lat_index in range(min_lat_index, max_lat_index + 1):
+                numbers.add(interleave_geohash_cell(lon_index, lat_index, precision))
+
+    ranges = []
+    for number in sorted(numbers):
+        if ranges and ranges[-1][1] == number - 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return [tuple(cell_range) for cell_range in ranges], precision
+
+def get_geohash_filter(min_lon, min_lat, max_lon, max_lat, max_cells=MAX_GEOHASH_CELLS, precision=None):
+    """
+    Build a filter selecting the points in the geohash cells covering a bounding box.
+
+    Each range of cells is matched with a plain range comparison on the geohash
+    column, from the first cell up to the cell following the range, which is
+    a B-tree range scan of the geohash index on any database (unlike LIKE,
+    which depends on the collation of the column).
+    The cells may extend beyond the bounding box, so the filter is meant to be
+    combined with an exact filter such as get_bbox_filter.
+
+    Parameters:
+        - min_lon, min_lat, max_lon, max_lat: the bounding box in degrees
+        - max_cells: the maximum number of cells to cover the bounding box with
+        - precision: the geohash length of the cells (default: chosen with max_cells)
+
+    Returns:
+        - Q object matching the geohash ranges
+    """
+
+    ranges, precision = get_geohash_ranges(min_lon, min_lat, max_lon, max_lat, max_cells, precision)
+    last_cell = (1 << precision * 5) - 1
+
+    condition = Q()
+    for first, last in ranges:
+        term = Q(geohash__gte=format_geohash(first, precision))
+        if last < last_cell:
+            term &= Q(geohash__lt=format_geohash(last + 1, precision))
+        condition |= term
+    return condition
+
+def get_cluster_precision(zoom):
+    """
+    Get the geohash length of the clusters at a map zoom level.
+
+    The longest geohash whose cells are at least a quarter of a map tile
+    wide is used, i.e. cells of about 64 pixels with 256 pixel tiles.
+    """
+
+    precision = 2 * (int(zoom) + 2) // 5
+    return min(max(precision, 1), GEOHASH_PRECISION)
+
+def get_cluster_cache_key(min_lon, min_lat, max_lon, max_lat, zoom):
+    """
+    Get the cache key of the clusters of a bounding box at a zoom level.
+
+    The key is made of the geohash length and the cells at the corners of the
+    bounding box, so the bounding boxes and zoom levels resulting in the same
+    clusters share the key.
+    """
+
+    precision = get_cluster_precision(zoom)
+    corners = get_geohash_cell(min_lat, min_lon, precision) + get_geohash_cell(max_lat, max_lon, precision)
+    return 'clusters:{}:{}'.format(precision, ':'.join(str(index) for index in corners))
+
+def get_clusters(queryset, min_lon, min_lat, max_lon, max_lat, zoom):
+    """
+    Aggregate the points in a bounding box into clusters on the geohash grid of a zoom level.
+
+    The points are grouped by the prefix of their geohash in a single query,
+    so the size of the result depends on the number of cells in the bounding
+    box rather than the number of points. The bounding box is extended to
+    the cells it overlaps, so a cluster always contains all the points of its cell.
+    The sample ids of the clusters are selected by a second query (see get_cluster_samples).
+
+    Parameters:
+        - queryset: the Point queryset to aggregate
+        - min_lon, min_lat, max_lon, max_lat: the bounding box in degrees
+        - zoom: the map zoom level
+
+    Errors:
+        - the bounding box covers more than MAX_CLUSTER_CELLS cells at the zoom level (400)
+
+    Returns:
+        - list of dictionaries with the 'cell', 'count', centroid 'latitude' and 'longitude'
+          and up to CLUSTER_SAMPLE_SIZE sample 'ids' of the clusters, ordered by cell
+    """
+
+    precision = get_cluster_precision(zoom)
+    if count_geohash_cells(split_bbox(min_lon, min_lat, max_lon, max_lat), precision) > MAX_CLUSTER_CELLS:
+        raise ParseError('The bbox is too large for the zoom level.')
+
+    queryset = queryset.filter(get_geohash_filter(min_lon, min_lat, max_lon, max_lat, precision=precision))
+    rows = (
+        queryset
+        .annotate(cell=Substr('geohash', 1, precision))
+        .order_by('cell')
+        .values('cell')
+        .annotate(count=Count('id'), latitude=Avg('latitude'), longitude=Avg('longitude'))
+    )
+    samples = get_cluster_samples(queryset, precision)
+
+    return [
+        {
+            'cell': row['cell'],
+            'count': row['count'],
+            'latitude': round(float(row['latitude']), 6),
+            'longitude': round(float(row['longitude']), 6),
+            'ids': samples.get(row['cell'], []),
+        }
+        for row in rows
+    ]
+
+def get_cluster_samples(queryset, precision, size=CLUSTER_SAMPLE_SIZE):
+    """
+    Get the lowest ids of the points of each geohash cell.
+
+    The points are numbered within their cell by a window function, and only
+    the first of each cell are selected, so the result is bounded by the number
+    of cells instead of the number of points. The window is filtered in an
+    outer query, as the ORM cannot filter on a window function.
+
+    Parameters:
+        - queryset: the Point queryset to sample
+        - precision: the length of the geohash prefix of the cells
+        - size: the maximum number of ids of a cell
+
+    Returns:
+        - dictionary of the sorted sample ids by cell
+    """
+
+    cell = Substr('geohash', 1, precision)
+    ranked = (
+        queryset
+        .order_by()
+        .annotate(cell=cell, sample_rank=Window(RowNumber(), partition_by=[cell], order_by=F('id').asc()))
+        .values_list('cell', 'id', 'sample_rank')
+    )
+    sql, params = ranked.query.sql_with_params()
+
+    samples = {}
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute('SELECT cell, id FROM ({}) ranked WHERE sample_rank <= %s ORDER BY cell, id'.format(sql),
+                       params + (size,))
+        for cell, pk in cursor.fetchall():
+            samples.setdefault(cell, []).append(pk)
+    return samples
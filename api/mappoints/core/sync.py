@@ -0,0 +1,190 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import APIException, ParseError
+
+from mappoints.core.compiled import get_compiled_serializer
+from mappoints.core.models import Point, Comment, Tag, Star, Tombstone
+from mappoints.core.pagination import KeysetPagination
+from mappoints.core.queries import plan_queryset
+from mappoints.core.serializers import PointSerializer, CommentSerializer, TagSerializer, StarSerializer
+
+# The synced collections with their models and serializers.
+SYNC_MODELS = (
+    ('points', Point, PointSerializer),
+    ('comments', Comment, CommentSerializer),
+    ('tags', Tag, TagSerializer),
+    ('stars', Star, StarSerializer),
+)
+
+# The number of changed instances of each collection (and of deletions) in a response.
+SYNC_LIMIT = 1000
+
+# The updated time of an instance is set before its transaction commits, so the
+# changes of the last seconds are sent again by the next sync in case a
+# transaction with an earlier updated time committed after this sync read them.
+SYNC_LAG = timedelta(seconds=5)
+
+# The tombstones are kept (see the prune_tombstones command), and sync tokens are valid, this long.
+TOMBSTONE_RETENTION = timedelta(days=30)
+
+class SyncTokenExpired(APIException):
+    """
+    Raised when the deletions since a sync token have been pruned.
+    """
+
+    status_code = 410
+    default_detail = 'The sync token has expired, sync again without a token.'
+    default_code = 'sync_token_expired'
+
+def encode_sync_token(positions):
+    """
+    Encode the sync positions into an opaque token.
+
+    Parameters:
+        - positions: dictionary mapping the collection names and 'deleted'
+          to the (time, id) position the next sync continues from
+
+    Returns:
+        - the token string
+    """
+
+    payload = {name: [time.isoformat(), pk] for name, (time, pk) in positions.items()}
+    payload = json.dumps(payload, separators=(',', ':'), sort_keys=True)
+    return urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_sync_token(token):
+    """
+    Decode a sync token into the positions it holds (see encode_sync_token).
+
+    Errors:
+        - the token is malformed (400)
+    """
+
+    try:
+        padding = '=' * (-len(token) % 4)
+        payload = json.loads(urlsafe_b64decode(token + padding).decode())
+        positions = {}
+        for name in [name for name, model, serializer_class in SYNC_MODELS] + ['deleted']:
+            time, pk = payload[name]
+            time = parse_datetime(time)
+            if time is None or timezone.is_naive(time):
+                raise ValueError
+            positions[name] = (time, int(pk))
+    except (TypeError, ValueError, KeyError, AttributeError):
+        raise ParseError('Invalid sync token.')
+
+    return positions
+
+def get_changed_queryset(queryset, position, time_field):
+    """
+    Filter the instances changed after a (time, id) position, ordered by their changes.
+
+    Parameters:
+        - queryset: the instances (or tombstones)
+        - position: the (time, id) position, or None for every instance
+        - time_field: the field of the time of the change ('updated' or 'deleted')
+    """
+
+    ordering = (time_field, 'id')
+    if position is not None:
+        queryset = queryset.filter(KeysetPagination(ordering).get_position_filter(position))
+    return queryset.order_by(*ordering)
+
+def serialize_changes(request, queryset, serializer_class):
+    """
+    Serialize the first SYNC_LIMIT changed instances with the compiled serializer
+    (or the regular one for expanded requests), in the same representation as in
+    their collections. One extra instance is read to find out whether there are
+    more changes.
+
+    Returns:
+        - tuple of (list of representations, (updated, id) position of the last
+          instance of the page or None, whether there are more changes)
+    """
+
+    context = {'request': request, 'action': 'list'}
+    if serializer_class is PointSerializer:
+        context['path'] = reverse('point-list')
+    compiled = get_compiled_serializer(serializer_class, context)
+
+    if compiled is not None:
+        rows = list(compiled.get_queryset(queryset, ['updated', 'id'])[:SYNC_LIMIT + 1])
+        more = len(rows) > SYNC_LIMIT
+        rows = rows[:SYNC_LIMIT]
+        last = (rows[-1]['updated'], rows[-1]['id']) if rows else None
+        return compiled.serialize(rows), last, more
+
+    instances = list(plan_queryset(queryset, serializer_class, context)[:SYNC_LIMIT + 1])
+    more = len(instances) > SYNC_LIMIT
+    instances = instances[:SYNC_LIMIT]
+    last = (instances[-1].updated, instances[-1].id) if instances else None
+    return serializer_class(instances, many=True, context=context).data, last, more
+
+def get_sync_data(request, token=None):
+    """
+    Get the points, comments, tags and stars created, updated or deleted since a sync token.
+
+    Each collection (and the deletions) is read from its own (time, id) position
+    held by the token with a keyset query on the (updated, id) or (deleted, id)
+    index, so a sync takes a constant number of queries whose cost is proportional
+    to the number of changes, not to the size of the dataset. At most SYNC_LIMIT changes of each are returned at a
+    time: the token of a response with more changes continues after the last
+    change of every truncated collection. The changes of the last SYNC_LAG are
+    sent again by the next sync, so applying the changes must be idempotent.
+
+    Without a token every instance is returned (page by page) and no deletions.
+
+    Parameters:
+        - request: the request of the sync
+        - token: the token of the previous sync, or None for a full sync
+
+    Errors:
+        - the token is malformed (400)
+        - the token is older than the tombstones are kept (410)
+
+    Returns:
+        - ordered dictionary with the changed instances of each collection, the
+          ids of the deleted instances of each collection ('deleted'), the token
+          of the next sync ('token') and whether there are more changes ('more')
+    """
+
+    start = timezone.now()
+    positions = decode_sync_token(token) if token else None
+    if positions is not None and positions['deleted'][0] < start - TOMBSTONE_RETENTION:
+        raise SyncTokenExpired
+
+    restart = (start - SYNC_LAG, 0)
+    next_positions = {}
+    data = OrderedDict()
+    more = False
+
+    for name, model, serializer_class in SYNC_MODELS:
+        queryset = get_changed_queryset(model.objects.all(), positions and positions[name], 'updated')
+        data[name], last, truncated = serialize_changes(request, queryset, serializer_class)
+        next_positions[name] = last if truncated else restart
+        more = more or truncated
+
+    deleted = OrderedDict((name, []) for name, model, serializer_class in SYNC_MODELS)
+    if positions is not None:
+        names = {model._meta.model_name: name for name, model, serializer_class in SYNC_MODELS}
+        queryset = get_changed_queryset(Tombstone.objects.all(), positions['deleted'], 'deleted')
+        tombstones = list(queryset.values_list('model', 'instance_id', 'deleted', 'id')[:SYNC_LIMIT + 1])
+        truncated = len(tombstones) > SYNC_LIMIT
+        tombstones = tombstones[:SYNC_LIMIT]
+        for model_name, instance_id, time, pk in tombstones:
+            deleted[names[model_name]].append(instance_id)
+        next_positions['deleted'] = tombstones[-1][2:] if truncated else restart
+        more = more or truncated
+    else:
+        next_positions['deleted'] = restart
+
+    data['deleted'] = deleted
+    data['token'] = encode_sync_token(next_positions)
+    data['more'] = more
+    return data
@@ -0,0 +1,25 @@
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+class TileCacheTestRunner(DiscoverRunner):
+    """
+    Run the tests with the file-backed tile cache in a temporary directory,
+    so that the tiles rendered by the tests are not written next to the
+    tiles of the development server. The directory is removed after the run.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.tile_dir = tempfile.mkdtemp(prefix='tiles')
+        tiles = {**settings.CACHES['tiles'], 'LOCATION': self.tile_dir}
+        self.tile_settings = override_settings(CACHES={**settings.CACHES, 'tiles': tiles})
+        self.tile_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.tile_settings.disable()
+        shutil.rmtree(self.tile_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
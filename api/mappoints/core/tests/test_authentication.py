@@ -0,0 +1,126 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+from rest_framework_jwt.utils import jwt_encode_handler, jwt_payload_handler
+
+from mappoints.core.models import User, Point
+from mappoints.core.tokens import get_token_cache
+
+class ClaimsAuthenticationTest(APITestCase):
+    """
+    Test the authentication of requests from the claims of JWT tokens.
+    """
+
+    def setUp(self):
+        get_token_cache().clear()
+        self.user = User(username='tester', location='Test')
+        self.user.set_password('tester')
+        self.user.save()
+
+    def get_token(self, username='tester', password='tester'):
+        """
+        Obtain a JWT token with the username and password of a user.
+        """
+
+        response = self.client.post('/api-token-auth/', {'username': username, 'password': password})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['token']
+
+    def test_claims_authentication(self):
+        """
+        Test that requests are authenticated from the token's claims.
+        Checks:
+            - authenticated requests don't query the user table once the token version is cached
+            - resources are created with the token's user as their creator
+            - tokens without a token version are authenticated with a user lookup
+            - a token with tampered claims gives a 401
+        """
+
+        token = self.get_token()
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + token)
+
+        response = self.client.post(reverse('point-list'), {'name': 'test', 'latitude': 1, 'longitude': 1})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Point.objects.get(name='test').creator_id, self.user.id)
+
+        url = reverse('point-list')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries if 'core_user' in query['sql']])
+
+        self.client.credentials()
+        with self.assertNumQueries(len(queries)):
+            self.client.get(url)
+
+        legacy_token = jwt_encode_handler(jwt_payload_handler(self.user))
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + legacy_token)
+        self.assertEqual(self.client.post(reverse('point-star-list', args=[response.data['id']])).status_code,
+                         status.HTTP_201_CREATED)
+
+        header, payload, signature = token.split('.')
+        self.client.credentials(HTTP_AUTHORIZATION='JWT {}.{}.{}'.format(header, payload[:-2] + 'xx', signature))
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_token_revocation(self):
+        """
+        Test that the tokens of a user are invalidated when they are revoked or the user changes.
+        Checks:
+            - changing the location of the user keeps the token valid
+            - changing the password of the user invalidates the token
+            - revoking the tokens invalidates the token
+            - only the user can revoke their tokens
+            - deactivating the user invalidates the token
+        """
+
+        url = reverse('point-list')
+        data = {'name': 'test', 'latitude': 1, 'longitude': 1}
+        user_url = reverse('user-detail', args=[self.user.id])
+
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + self.get_token())
+        self.user.location = 'Moved'
+        self.user.save()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+        user_data = {'username': 'tester', 'password': 'changed', 'location': 'Moved'}
+        self.assertEqual(self.client.put(user_url, user_data).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.post(url, data).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + self.get_token(password='changed'))
+        self.assertEqual(self.client.post(url, data).status_code, status.HTTP_201_CREATED)
+
+        other = User.objects.create(username='other', password='other')
+        self.assertEqual(self.client.post(reverse('user-revoke-tokens', args=[other.id])).status_code,
+                         status.HTTP_403_FORBIDDEN)
+
+        revoke_response = self.client.post(reverse('user-revoke-tokens', args=[self.user.id]))
+        self.assertEqual(revoke_response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + self.get_token(password='changed'))
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        self.user.refresh_from_db()
+        self.user.save()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(CACHES=dict(settings.CACHES, tokens={'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}))
+    def test_uncached_revocation(self):
+        """
+        Test that the tokens revoked by another process are rejected without a shared token cache.
+        Checks:
+            - a token version changed without removing the cached versions of this process
+              invalidates the token right away
+        """
+
+        url = reverse('point-list')
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + self.get_token())
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+        User.objects.filter(pk=self.user.pk).update(token_version=F('token_version') + 1)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
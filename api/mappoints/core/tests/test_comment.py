@@ -106,6 +106,7 @@ class CommentTest(APITestCase):
             - trying to update the comment without authentication gives a 401
             - trying to update the comment as a different user gives a 403
             - valid PUT response status is 200
+            - trying to update the comment under another point gives a 404
         """
 
         user = User(username='tester', location='Test')
@@ -136,6 +137,10 @@ class CommentTest(APITestCase):
         response = self.client.put(url, data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+        other_point = Point.objects.create(name='other', latitude=1, longitude=1, creator=user)
+        other_url = reverse('point-comment-detail', args=[other_point.id, comment.id])
+        self.assertEqual(self.client.put(other_url, data).status_code, status.HTTP_404_NOT_FOUND)
+
     def test_comment_delete(self):
         """
         Test that a comment can be deleted.
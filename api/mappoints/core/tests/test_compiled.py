@@ -0,0 +1,189 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.reverse import reverse
+from rest_framework.test import APIRequestFactory
+
+from mappoints.core.models import User, Point, Comment, Tag, Star
+from mappoints.core.serializers import (UserSerializer,
+                                        PointSerializer,
+                                        CommentSerializer,
+                                        TagSerializer,
+                                        StarSerializer)
+from mappoints.core.compiled import get_compiled_serializer
+from mappoints.core.queries import plan_queryset
+
+class CompiledSerializerTest(TestCase):
+    """
+    Test that the compiled serializers give the same JSON output as the regular serializers.
+    """
+
+    def setUp(self):
+        self.users = []
+        for i in range(3):
+            user = User.objects.create(username='tester{}'.format(i), password='tester',
+                                       location='Tëst "{}"'.format(i) if i else '')
+            self.users.append(user)
+
+        coordinates = [(12.123, 45.456), (-90, 180), (0, -0.000001), ('89.1234565', '-179.9999995')]
+        for user in self.users:
+            for i, (latitude, longitude) in enumerate(coordinates):
+                point = Point.objects.create(name='tëst{}'.format(i), description='ünicode\n' * i,
+                                             latitude=latitude, longitude=longitude, creator=user)
+                for other in self.users[:i]:
+                    Comment.objects.create(content='comment by {}'.format(other.username), point=point, creator=other)
+                    Star.objects.create(point=point, creator=other)
+                    Tag.objects.create(name='tag{}'.format(other.id), point=point, creator=user)
+
+    def assert_equivalent(self, url, serializer_class, queryset):
+        """
+        Assert that the compiled and the regular serializer render the same bytes.
+
+        Parameters:
+            - url: the url of the list request
+            - serializer_class: the regular serializer class
+            - queryset: the queryset of the serialized resources
+        """
+
+        request = Request(APIRequestFactory().get(url))
+        context = {'request': request, 'action': 'list'}
+        queryset = queryset.order_by('created', 'id')
+
+        compiled = get_compiled_serializer(serializer_class, context)
+        self.assertIsNotNone(compiled)
+        compiled_data = compiled.serialize(list(compiled.get_queryset(queryset)))
+
+        instances = plan_queryset(queryset, serializer_class, context)
+        data = serializer_class(instances, many=True, context=context).data
+
+        self.assertTrue(len(data) > 0)
+        self.assertEqual(JSONRenderer().render(compiled_data), JSONRenderer().render(data))
+
+    def test_user_serializer(self):
+        """
+        Test the compiled UserSerializer on the user list.
+        """
+
+        self.assert_equivalent(reverse('user-list'), UserSerializer, User.objects.all())
+
+    def test_point_serializer(self):
+        """
+        Test the compiled PointSerializer on the point lists.
+        """
+
+        self.assert_equivalent(reverse('point-list'), PointSerializer, Point.objects.all())
+
+        user = self.users[1]
+        self.assert_equivalent(reverse('user-point-list', args=[user.id]),
+                               PointSerializer, Point.objects.filter(creator=user))
+
+    def test_point_child_serializers(self):
+        """
+        Test the compiled CommentSerializer, TagSerializer and StarSerializer on the nested lists.
+        """
+
+        user = self.users[1]
+        point = Point.objects.filter(creator=user).last()
+
+        self.assert_equivalent(reverse('point-comment-list', args=[point.id]),
+                               CommentSerializer, Comment.objects.filter(point=point))
+        self.assert_equivalent(reverse('point-tag-list', args=[point.id]),
+                               TagSerializer, Tag.objects.filter(point=point))
+        self.assert_equivalent(reverse('point-star-list', args=[point.id]),
+                               StarSerializer, Star.objects.filter(point=point))
+        self.assert_equivalent(reverse('user-comment-list', args=[user.id]),
+                               CommentSerializer, Comment.objects.filter(creator=user))
+        self.assert_equivalent(reverse('user-star-list', args=[user.id]),
+                               StarSerializer, Star.objects.filter(creator=user))
+
+    def test_sparse_fields(self):
+        """
+        Test the compiled serializers on sparse fieldsets.
+        Checks:
+            - the requested fields are rendered like the regular serializers do
+            - link lists are only rendered (and fetched) when requested
+        """
+
+        user = self.users[1]
+        point = Point.objects.filter(creator=user).last()
+
+        for fields in ['id,name,latitude,longitude', '_url,creator,tags,star_count', 'comments,stars,unknown', 'unknown']:
+            with self.subTest(fields=fields):
+                query = '?fields=' + fields
+                self.assert_equivalent(reverse('point-list') + query, PointSerializer, Point.objects.all())
+                self.assert_equivalent(reverse('user-list') + query.replace('name', 'username'),
+                                       UserSerializer, User.objects.all())
+                self.assert_equivalent(reverse('point-comment-list', args=[point.id]) + query.replace('name', 'content'),
+                                       CommentSerializer, Comment.objects.filter(point=point))
+
+        self.assert_equivalent(reverse('user-list') + '?fields=points,comments', UserSerializer, User.objects.all())
+        self.assert_equivalent(reverse('user-star-list', args=[user.id]) + '?fields=point,created',
+                               StarSerializer, Star.objects.filter(creator=user))
+
+    def test_sparse_fields_queries(self):
+        """
+        Test that sparse fieldsets only read the requested columns and link lists.
+        Checks:
+            - a page of points with ?fields=id,name,latitude,longitude takes a single query
+              of the requested columns (and the ordering columns of the cursors)
+            - a requested link list takes one more query
+            - a single point is retrieved with the requested fields
+        """
+
+        url = reverse('point-list')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'fields': 'id,name,latitude,longitude', 'limit': 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.data['_items'][0]), ['id', 'name', 'latitude', 'longitude'])
+        self.assertIsNotNone(response.data['_next'])
+
+        point_queries = [query['sql'] for query in queries.captured_queries if 'core_version' not in query['sql']]
+        self.assertEqual(len(point_queries), 1)
+        self.assertNotIn('description', point_queries[0])
+        self.assertNotIn('creator_id', point_queries[0])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(response.data['_next'] + '&fields=id,tags')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len([query for query in queries.captured_queries if 'core_version' not in query['sql']]), 2)
+        self.assertEqual(set(response.data['_items'][0]), {'id', 'tags'})
+
+        point = Point.objects.last()
+        response = self.client.get(reverse('point-detail', args=[point.id]), {'fields': 'name,comment_count'})
+        self.assertEqual((response.data['name'], response.data['comment_count']), (point.name, point.comment_count))
+        self.assertNotIn('comments', response.data)
+        self.assertEqual(self.client.get(reverse('point-detail', args=[0]), {'fields': 'name'}).status_code, 404)
+
+    def test_expanded_fallback(self):
+        """
+        Test that requests with an 'expand' parameter use the regular serializers,
+        also when they select fields.
+        """
+
+        for params in [{'expand': 'creator'}, {'expand': 'creator', 'fields': 'id,creator'}]:
+            request = Request(APIRequestFactory().get(reverse('point-list'), params))
+            self.assertIsNone(get_compiled_serializer(PointSerializer, {'request': request, 'action': 'list'}))
+
+        response = self.client.get(reverse('point-list'), {'expand': 'creator', 'fields': 'id,creator'})
+        self.assertEqual(list(response.data['_items'][0]), ['id', 'creator'])
+        self.assertIn('username', response.data['_items'][0]['creator'])
+
+    def test_benchmark_command(self):
+        """
+        Test that the benchmark_serializers command reports every collection and rolls back the generated rows.
+        """
+
+        counts = [model.objects.count() for model in (User, Point, Comment, Tag, Star)]
+        stdout, stderr = StringIO(), StringIO()
+        call_command('benchmark_serializers', '--generate', '--rows', '5', '--repeat', '1', stdout=stdout, stderr=stderr)
+
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual([line.split()[:2] for line in lines],
+                         [['users', '4'], ['points', '5'], ['comments', '5'], ['tags', '5'], ['stars', '5']])
+        self.assertEqual(stderr.getvalue(), '')
+        self.assertEqual([model.objects.count() for model in (User, Point, Comment, Tag, Star)], counts)
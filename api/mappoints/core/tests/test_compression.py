@@ -0,0 +1,192 @@
+import gzip
+from io import StringIO
+from unittest import mock
+
+import brotli
+from django.core.management import call_command
+from django.test import RequestFactory
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from mappoints.core import compression
+from mappoints.core.compression import get_accepted_encoding, get_compressed_cache
+from mappoints.core.management.commands.benchmark_compression import BENCHMARK_LEVELS
+from mappoints.core.models import User, Point
+from mappoints.core.tests import utils
+
+DECOMPRESS = {
+    'br': brotli.decompress,
+    'gzip': gzip.decompress,
+}
+
+class CompressionTest(APITestCase):
+    """
+    Test the negotiated compression of the responses.
+    """
+
+    def setUp(self):
+        get_compressed_cache().clear()
+        self.user = User(username='tester', location='Test')
+        self.user.set_password('tester')
+        self.user.save()
+        Point.objects.bulk_create([
+            Point(name='test {}'.format(i), latitude=i % 90, longitude=i % 180, creator=self.user)
+            for i in range(150)
+        ])
+
+    def test_accepted_encoding(self):
+        """
+        Test the negotiation of the content encoding from the Accept-Encoding header.
+        """
+
+        cases = [
+            ('gzip, deflate, br', 'br'),
+            ('gzip', 'gzip'),
+            ('br;q=0.5, gzip;q=0.8', 'gzip'),
+            ('br;q=0, *', 'gzip'),
+            ('*;q=0.1', 'br'),
+            ('identity', None),
+            ('gzip;q=0, br;q=invalid', None),
+            ('', None),
+        ]
+        for header, expected in cases:
+            with self.subTest(header=header):
+                request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=header)
+                self.assertEqual(get_accepted_encoding(request), expected)
+
+    def test_compressed_response(self):
+        """
+        Test that responses are compressed with the negotiated encoding.
+        Checks:
+            - the compressed body decompresses to the uncompressed body
+            - the Content-Encoding, Content-Length and Vary headers are set
+            - small responses and clients accepting neither encoding get uncompressed bodies
+        """
+
+        url = reverse('point-list')
+        expected = self.client.get(url).content
+
+        for encoding, decompress in DECOMPRESS.items():
+            with self.subTest(encoding=encoding):
+                response = self.client.get(url, HTTP_ACCEPT_ENCODING=encoding)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response['Content-Encoding'], encoding)
+                self.assertEqual(response['Content-Length'], str(len(response.content)))
+                self.assertIn('Accept-Encoding', response['Vary'])
+                self.assertLess(len(response.content), len(expected) / 4)
+                self.assertEqual(decompress(response.content), expected)
+
+        identity_response = self.client.get(url, HTTP_ACCEPT_ENCODING='identity')
+        self.assertFalse(identity_response.has_header('Content-Encoding'))
+        self.assertEqual(identity_response.content, expected)
+
+        small_response = self.client.get(reverse('point-detail', args=[0]), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(small_response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(small_response.has_header('Content-Encoding'))
+
+    def test_compressed_cache(self):
+        """
+        Test that the compressed bodies of anonymous responses are cached by ETag.
+        Checks:
+            - a response is compressed once for every request of the same version
+            - a change of the data gives a newly compressed body
+            - authenticated responses are compressed for every request
+        """
+
+        url = reverse('point-list')
+        with mock.patch.object(compression, 'compress', wraps=compression.compress) as compress:
+            first = self.client.get(url, HTTP_ACCEPT_ENCODING='br')
+            second = self.client.get(url, HTTP_ACCEPT_ENCODING='br')
+            self.assertEqual(compress.call_count, 1)
+            self.assertEqual(first.content, second.content)
+            self.assertEqual(first['ETag'], second['ETag'])
+
+            Point.objects.filter(name='test 0').update(name='changed')
+            utils.run_commit_hooks()
+            changed = self.client.get(url, HTTP_ACCEPT_ENCODING='br')
+            self.assertEqual(compress.call_count, 2)
+            self.assertNotEqual(changed['ETag'], first['ETag'])
+            self.assertIn(b'changed', brotli.decompress(changed.content))
+
+            self.client.credentials(HTTP_AUTHORIZATION=utils.get_basic_auth_header('tester:tester'))
+            self.client.get(url, HTTP_ACCEPT_ENCODING='br')
+            self.client.get(url, HTTP_ACCEPT_ENCODING='br')
+            self.assertEqual(compress.call_count, 4)
+
+    def test_compressed_sessions(self):
+        """
+        Test that the compressed bodies of session authenticated responses are never shared.
+        Checks:
+            - the responses to two users logged in with a session are compressed for each
+              request and never cached, although their ETags are the same
+            - the responses vary by cookie
+            - the browsable API pages are not compressed
+        """
+
+        url = reverse('point-list')
+        cache = get_compressed_cache()
+        clients = []
+        for username in ['alice', 'bobby']:
+            user = User(username=username)
+            user.set_password(username)
+            user.save()
+            client = self.client_class()
+            client.login(username=username, password=username)
+            clients.append(client)
+
+        etags = []
+        with mock.patch.object(compression, 'compress', wraps=compression.compress) as compress:
+            for client in clients:
+                for i in range(2):
+                    response = client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+                    self.assertEqual(response['Content-Encoding'], 'gzip')
+                    self.assertIn('Cookie', response['Vary'])
+                    etags.append(response['ETag'])
+                self.assertIsNone(cache.get(compression.get_compressed_key(
+                    response.wsgi_request, client.get(url), 'gzip'
+                )))
+
+            self.assertEqual(compress.call_count, 4)
+            self.assertEqual(len(set(etags)), 1)
+
+        page = clients[0].get(url, HTTP_ACCEPT='text/html', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(page.status_code, status.HTTP_200_OK)
+        self.assertFalse(page.has_header('Content-Encoding'))
+        self.assertIn(b'alice', page.content)
+
+    def test_compressed_stream(self):
+        """
+        Test that streaming responses are compressed incrementally.
+        Checks:
+            - a streamed page and a GeoJSON export decompress to their uncompressed bodies
+            - the compressed stream is not cached
+        """
+
+        urls = [reverse('point-list') + '?limit=150', reverse('point-export') + '?format=geojson']
+        for url in urls:
+            expected = b''.join(self.client.get(url).streaming_content)
+            for encoding, decompress in DECOMPRESS.items():
+                with self.subTest(url=url, encoding=encoding):
+                    with mock.patch.object(compression, 'compress') as compress:
+                        response = self.client.get(url, HTTP_ACCEPT_ENCODING=encoding)
+                        content = b''.join(response.streaming_content)
+                    self.assertTrue(response.streaming)
+                    self.assertEqual(response['Content-Encoding'], encoding)
+                    self.assertFalse(response.has_header('Content-Length'))
+                    self.assertEqual(decompress(content), expected)
+                    self.assertFalse(compress.called)
+
+    def test_benchmark_command(self):
+        """
+        Test that the benchmark_compression command reports every encoding and level of a response.
+        """
+
+        stdout, stderr = StringIO(), StringIO()
+        call_command('benchmark_compression', reverse('point-list'), reverse('point-detail', args=[0]),
+                     repeat=1, stdout=stdout, stderr=stderr)
+
+        lines = stdout.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith(reverse('point-list') + ' (application/json): '))
+        self.assertEqual(len(lines), 1 + sum(len(levels) for levels in BENCHMARK_LEVELS.values()))
+        self.assertIn('status 404', stderr.getvalue())
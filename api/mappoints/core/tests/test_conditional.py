@@ -0,0 +1,125 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from mappoints.core import conditional
+from mappoints.core.models import User, Point, Comment, Version
+from mappoints.core.tests import utils
+
+class ConditionalGetTest(APITestCase):
+    """
+    Test the conditional GET requests (ETag, Last-Modified and 304 responses) of the API.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='tester', password='tester', location='Test')
+        self.point = Point.objects.create(name='test', latitude=1, longitude=1, creator=self.user)
+        utils.run_commit_hooks()
+
+    def test_not_modified(self):
+        """
+        Test that an unchanged resource is answered with a 304 after a single version lookup.
+        Checks:
+            - responses have ETag and Last-Modified headers
+            - a matching If-None-Match or If-Modified-Since gives an empty 304 response
+            - nested collections don't look up their parent
+            - other pages and representations have other ETags
+        """
+
+        Version.objects.update(updated=timezone.now() - timedelta(seconds=2))
+        for url in [reverse('point-list'), reverse('point-detail', args=[self.point.id]), reverse('user-list')]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn('Last-Modified', response)
+
+            with self.assertNumQueries(1):
+                not_modified_response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(not_modified_response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(not_modified_response.content, b'')
+            self.assertEqual(not_modified_response['ETag'], response['ETag'])
+
+            since_response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(since_response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        nested_url = reverse('point-comment-list', args=[self.point.id])
+        nested_response = self.client.get(nested_url)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(nested_url, HTTP_IF_NONE_MATCH=nested_response['ETag']).status_code,
+                             status.HTTP_304_NOT_MODIFIED)
+
+        url = reverse('point-list')
+        etag = self.client.get(url)['ETag']
+        for params in [{'limit': 1}, {'expand': 'creator'}, {'format': 'api'}]:
+            self.assertNotEqual(self.client.get(url, params)['ETag'], etag)
+
+    def test_modified(self):
+        """
+        Test that a resource is served again once it or a resource its representation depends on changes.
+        Checks:
+            - adding a comment changes the ETag of the point and the point list but not of the user's stars
+            - updating a user changes the ETag of the expanded point list
+            - the comments of a deleted point are not found instead of not modified
+            - the updated time of an instance changes when it is saved
+        """
+
+        point_url = reverse('point-detail', args=[self.point.id])
+        stars_url = reverse('user-star-list', args=[self.user.id])
+        point_etag = self.client.get(point_url)['ETag']
+        stars_etag = self.client.get(stars_url)['ETag']
+
+        Comment.objects.create(content='testing', point=self.point, creator=self.user)
+        utils.run_commit_hooks()
+        point_response = self.client.get(point_url, HTTP_IF_NONE_MATCH=point_etag)
+        self.assertEqual(point_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(point_response.data['comments']['_items']), 1)
+        self.assertEqual(self.client.get(stars_url, HTTP_IF_NONE_MATCH=stars_etag).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+
+        list_url = reverse('point-list')
+        list_etag = self.client.get(list_url, {'expand': 'creator'})['ETag']
+        updated = self.user.updated
+        self.user.location = 'Changed'
+        self.user.save()
+        utils.run_commit_hooks()
+        self.assertGreater(self.user.updated, updated)
+        self.assertEqual(self.client.get(list_url, {'expand': 'creator'}, HTTP_IF_NONE_MATCH=list_etag).status_code,
+                         status.HTTP_200_OK)
+
+        comments_url = reverse('point-comment-list', args=[self.point.id])
+        comments_etag = self.client.get(comments_url)['ETag']
+        self.point.delete()
+        utils.run_commit_hooks()
+        self.assertEqual(self.client.get(comments_url, HTTP_IF_NONE_MATCH=comments_etag).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+        self.assertEqual(self.client.get(list_url, HTTP_IF_MODIFIED_SINCE=http_date(0)).status_code,
+                         status.HTTP_200_OK)
+
+    def test_modified_same_second(self):
+        """
+        Test that a change made in the same second as the client's copy is not answered with a 304.
+        Checks:
+            - the Last-Modified time is the end of the second of the latest change
+            - no Last-Modified time is given until the second of the latest change is over
+            - If-Modified-Since is not evaluated until then, so a date of that second gives a 200
+        """
+
+        url = reverse('point-list')
+        changed = timezone.now().replace(microsecond=300000) - timedelta(seconds=10)
+        Version.objects.update(updated=changed)
+        with mock.patch.object(conditional, 'time') as clock:
+            clock.time.return_value = changed.timestamp() + 0.5
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(changed.timestamp()))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('Last-Modified', response)
+
+            clock.time.return_value = changed.timestamp() + 1
+            response = self.client.get(url)
+            self.assertEqual(response['Last-Modified'], http_date(changed.timestamp() // 1 + 1))
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code,
+                             status.HTTP_304_NOT_MODIFIED)
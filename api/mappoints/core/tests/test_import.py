@@ -0,0 +1,154 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from mappoints.core import importer
+from mappoints.core.models import User, Point, Tag, Comment
+from mappoints.core.spatial import encode_geohash
+
+def get_feature(name, latitude, longitude, **properties):
+    """
+    Build the GeoJSON feature of a point.
+    """
+
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [longitude, latitude]},
+        'properties': dict(properties, name=name),
+    }
+
+class ImportTest(TestCase):
+    """
+    Test the import_points command.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='tester', password='tester')
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, content):
+        """
+        Write an input file to the temporary directory and return its path.
+        """
+
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def run_import(self, *args, **options):
+        """
+        Run the import_points command and return its output and errors.
+        """
+
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_points', *args, stdout=stdout, stderr=stderr, **options)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_import_geojson(self):
+        """
+        Test that the points of a GeoJSON FeatureCollection are imported.
+        Checks:
+            - features split across read blocks are decoded
+            - points are created with their geohash, tags, comments and counts
+            - invalid records and unknown creators are reported and skipped
+            - records without a creator are created by the default creator
+            - importing the same file again skips the existing points
+        """
+
+        features = [
+            get_feature('first', 1.5, 2.5, creator='tester', description='testing',
+                        tags=['camping', 'hiking', 'camping'], comments=['nice', 'nice']),
+            get_feature('invalid', 91, 2.5, creator='tester'),
+            get_feature('unknown', 1, 1, creator='nobody'),
+            get_feature('default', -1, -1),
+            {'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': [[0, 0], [1, 1]]}},
+        ]
+        path = self.write('points.geojson', json.dumps({'type': 'FeatureCollection', 'features': features}, indent=2))
+
+        with mock.patch.object(importer, 'READ_BLOCK_SIZE', 16):
+            output, errors = self.run_import(path, creator='tester', batch_size=2)
+
+        self.assertIn('Created 2 point(s), skipped 0 existing point(s) and 3 invalid record(s).', output)
+        self.assertIn('Record 2: latitude:', errors)
+        self.assertIn("Record 3: creator: Unknown user 'nobody'.", errors)
+        self.assertIn('Record 5:', errors)
+
+        point = Point.objects.get(name='first')
+        self.assertEqual((point.creator, point.description, float(point.latitude)), (self.user, 'testing', 1.5))
+        self.assertEqual(point.geohash, encode_geohash(point.latitude, point.longitude))
+        self.assertEqual(sorted(point.tags.values_list('name', flat=True)), ['camping', 'hiking'])
+        self.assertEqual(list(point.comments.values_list('content', flat=True)), ['nice', 'nice'])
+        self.assertEqual((point.tag_count, point.comment_count, point.star_count), (2, 2, 0))
+        self.assertEqual(Point.objects.get(name='default').creator, self.user)
+        self.assertEqual(Point.objects.update_counts(), 0)
+
+        output, errors = self.run_import(path, creator='tester')
+        self.assertIn('Created 0 point(s), skipped 2 existing point(s)', output)
+        self.assertEqual(Point.objects.count(), 2)
+
+    def test_import_csv(self):
+        """
+        Test that the points of a CSV file are imported, checked with a dry run and resumed from a checkpoint.
+        Checks:
+            - a dry run validates the records without creating points
+            - an import resumed from a checkpoint skips the records already imported
+            - the checkpoint records the number of records read
+            - a checkpoint of another file is rejected
+        """
+
+        path = self.write('points.csv', '\n'.join([
+            'name,latitude,longitude,description,creator,tags',
+            'first,1,1,,tester,a|b',
+            'second,2,2,testing,tester,',
+            'third,3,abc,,tester,',
+            'fourth,4,4,,tester,c',
+        ]))
+        checkpoint = os.path.join(self.directory.name, 'checkpoint.json')
+
+        output, errors = self.run_import(path, dry_run=True, checkpoint=checkpoint)
+        self.assertIn('Would create 3 point(s)', output)
+        self.assertIn('Record 3: longitude:', errors)
+        self.assertFalse(Point.objects.exists())
+        self.assertFalse(os.path.exists(checkpoint))
+
+        with open(checkpoint, 'w') as file:
+            json.dump({'path': os.path.abspath(path), 'records': 2}, file)
+        output, errors = self.run_import(path, checkpoint=checkpoint, batch_size=1)
+        self.assertIn('Resuming after 2 record(s).', output)
+        self.assertEqual(list(Point.objects.values_list('name', flat=True)), ['fourth'])
+        self.assertEqual(list(Tag.objects.values_list('name', flat=True)), ['c'])
+        with open(checkpoint) as file:
+            self.assertEqual(json.load(file)['records'], 4)
+
+        other_path = self.write('other.csv', 'name,latitude,longitude\n')
+        with self.assertRaises(CommandError):
+            self.run_import(other_path, checkpoint=checkpoint)
+
+    def test_import_workers(self):
+        """
+        Test that the records of a GeoJSON sequence are validated in worker processes.
+        Checks:
+            - every valid record is imported in the order of the file
+            - malformed lines are reported as invalid records
+        """
+
+        lines = [json.dumps(get_feature('point {}'.format(i), i % 90, i % 180, creator='tester')) for i in range(50)]
+        lines.insert(10, '{"type": "Feature", ')
+        path = self.write('points.geojsonl', '\n'.join(lines) + '\n')
+
+        output, errors = self.run_import(path, workers=2, batch_size=7)
+        self.assertIn('Created 50 point(s), skipped 0 existing point(s) and 1 invalid record(s).', output)
+        self.assertIn('Record 11: The line is not valid JSON', errors)
+        self.assertEqual(list(Point.objects.order_by('id').values_list('name', flat=True)),
+                         ['point {}'.format(i) for i in range(50)])
+        self.assertFalse(Comment.objects.exists())
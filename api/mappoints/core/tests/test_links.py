@@ -0,0 +1,77 @@
+from django.test import TestCase
+from rest_framework.request import Request
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient, APIRequestFactory
+
+from mappoints.core.models import User, Point
+from mappoints.core.utils import LinkBuilder, get_link_builder, get_url, get_parent_url
+
+class LinkBuilderTest(TestCase):
+    """
+    Test that the links built by LinkBuilder are identical to the ones
+    given by get_url and get_parent_url.
+    """
+
+    paths = [
+        '/',
+        '/points/',
+        '/points/5/',
+        '/points/5/comments/?expand=creator&limit=2#fragment',
+        '/points/5',
+        '/users/1/points//',
+        '/a b/ä/1/',
+    ]
+    hosts = ['testserver', 'TestServer:80', 'example.com:8000', '[::1]:8000']
+
+    def test_request_links(self):
+        """
+        Test that the request url and parent url match for varying paths and hosts.
+        """
+
+        factory = APIRequestFactory()
+
+        for host in self.hosts:
+            for path in self.paths:
+                with self.subTest(host=host, path=path):
+                    request = Request(factory.get(path, HTTP_HOST=host))
+                    uri = request.build_absolute_uri()
+                    builder = LinkBuilder(request)
+
+                    self.assertEqual(builder.url, get_url(uri))
+                    self.assertEqual(builder.parent_url, get_parent_url(uri))
+                    self.assertEqual(builder.get_parent_url(builder.url), get_parent_url(uri))
+                    self.assertEqual(builder.get_url(builder.path + '12/'), get_url(uri) + '12/')
+                    self.assertEqual(builder.get_parent_url(uri), get_parent_url(uri))
+
+    def test_request_scope(self):
+        """
+        Test that a single LinkBuilder is shared during a request.
+        """
+
+        request = Request(APIRequestFactory().get('/points/'))
+        self.assertIs(get_link_builder(request), get_link_builder(request))
+
+    def test_serialized_links(self):
+        """
+        Test that the nested '_url' and '_parent' links of a serialized point are
+        the same as when they were built from the parsed request url.
+        """
+
+        user = User.objects.create(username='tester', password='tester')
+        point = Point.objects.create(name='test', latitude=1, longitude=1, creator=user)
+        client = APIClient()
+
+        list_url = 'http://testserver' + reverse('point-list')
+        item = client.get(list_url).data['_items'][0]
+        url = '{}{}/'.format(get_url(list_url), point.pk)
+        parent_url = '{}{}/'.format(get_parent_url(url), point.pk)
+        self.assertEqual(item['comments']['_url'], url + 'comments/')
+        self.assertEqual(item['comments']['_parent'], parent_url)
+
+        detail_url = 'http://testserver' + reverse('point-detail', args=[point.pk])
+        data = client.get(detail_url + '?expand=creator').data
+        url = get_url(detail_url)
+        parent_url = '{}{}/'.format(get_parent_url(url), point.pk)
+        self.assertEqual(data['stars']['_url'], url + 'stars/')
+        self.assertEqual(data['stars']['_parent'], parent_url)
+        self.assertEqual(data['_parent'], get_parent_url(data['_url']))
@@ -1,7 +1,17 @@
+import random
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
 from django.test import TestCase
 from django.db.utils import IntegrityError
 from django.core.exceptions import ValidationError
-from mappoints.core.models import User, Point, Comment, Tag, Star
+from django.db.models import F
+from mappoints.core.models import User, Point, PointQuerySet, Comment, Tag, Star
+from mappoints.core.filters import get_bbox_filter
+from mappoints.core import spatial
+from mappoints.core.spatial import (CLUSTER_SAMPLE_SIZE, encode_geohash, find_nearest, get_clusters, get_distance,
+                                    get_geohash_filter, get_geohash_ranges, get_inner_bbox, rank_by_distance)
 
 from decimal import Decimal
 
@@ -292,6 +302,197 @@ class PointTest(TestCase):
             point.longitude = 180.00001
             point.full_clean()
 
+    def test_point_geohash(self):
+        """
+        Test that the geohash of a point is kept up to date when its location changes,
+        also in the bulk operations.
+        """
+
+        user = User.objects.get(username='tester')
+        point = Point.objects.get(name='Brisbane')
+        self.assertEqual(point.geohash, encode_geohash(-27.466667, 153.033333))
+        self.assertTrue(point.geohash.startswith('r7hg'))
+
+        point.latitude = 42.6
+        point.longitude = -5.6
+        point.save(update_fields=['latitude', 'longitude'])
+        self.assertEqual(Point.objects.get(id=point.id).geohash[:5], 'ezs42')
+
+        Point.objects.filter(id=point.id).update(latitude=57.64911, longitude=10.40744)
+        self.assertEqual(Point.objects.get(id=point.id).geohash[:11], 'u4pruydqqvj')
+
+        Point.objects.filter(id=point.id).update(longitude=F('longitude') + 1)
+        point.refresh_from_db()
+        self.assertEqual(point.geohash, encode_geohash(point.latitude, point.longitude))
+
+        Point.objects.bulk_create([Point(name='Perth', latitude=-31.95, longitude=115.86, creator=user)])
+        perth = Point.objects.get(name='Perth')
+        self.assertEqual(perth.geohash, encode_geohash(-31.95, 115.86))
+
+        perth.latitude = -31.96
+        Point.objects.bulk_update([perth], ['latitude'])
+        self.assertEqual(Point.objects.get(name='Perth').geohash, encode_geohash(-31.96, 115.86))
+
+    def test_point_geohash_filter(self):
+        """
+        Test that the geohash cells covering a bounding box select the points inside it,
+        also across the antimeridian.
+        """
+
+        user = User.objects.get(username='tester')
+        for name, latitude, longitude in [('Suva', -18.14, 178.44), ('Apia', -13.83, -171.76),
+                                          ('Perth', -31.95, 115.86)]:
+            Point.objects.create(name=name, latitude=latitude, longitude=longitude, creator=user)
+
+        for bbox, names in [((150, -30, 155, -25), {'Brisbane'}),
+                            ((170, -20, -170, -10), {'Suva', 'Apia'}),
+                            ((-180, -90, 180, 90), {'Brisbane', 'Suva', 'Apia', 'Perth'})]:
+            points = Point.objects.filter(get_geohash_filter(*bbox), get_bbox_filter(*bbox))
+            self.assertEqual({point.name for point in points}, names)
+            self.assertLessEqual(len(get_geohash_ranges(*bbox)[0]), 32)
+
+    def test_point_find_nearest(self):
+        """
+        Test that the nearest points are found from any position without ranking every closer point.
+        Checks:
+            - the points after and before every position match a ranking of every point
+            - the locations of the box inside a circle are within its radius
+            - the candidates of a ring leave out most of the points inside it
+        """
+
+        user = User.objects.get(username='tester')
+        rng = random.Random(7)
+        locations = [(rng.uniform(-60, 60), rng.uniform(-180, 180)) for i in range(40)]
+        locations += [(-27.47 + rng.uniform(-0.5, 0.5), 153.03 + rng.uniform(-0.5, 0.5)) for i in range(80)]
+        locations += [(-27.4, 153.1)] * 3
+        Point.objects.bulk_create([Point(name=str(i), latitude=round(latitude, 6), longitude=round(longitude, 6), creator=user)
+                                   for i, (latitude, longitude) in enumerate(locations)])
+
+        latitude, longitude = -27.466667, 153.033333
+        expected = sorted((get_distance(latitude, longitude, float(point.latitude), float(point.longitude)), point.id)
+                          for point in Point.objects.all())
+        for index, position in enumerate(expected):
+            self.assertEqual(find_nearest(Point.objects.all(), latitude, longitude, 5, after=position),
+                             expected[index + 1:index + 6])
+            self.assertEqual(find_nearest(Point.objects.all(), latitude, longitude, 5, before=position),
+                             expected[max(index - 5, 0):index])
+
+        for radius in [10, 5000, 2000000]:
+            min_lon, min_lat, max_lon, max_lat = get_inner_bbox(latitude, longitude, radius)
+            for corner in [(min_lat, min_lon), (min_lat, max_lon), (max_lat, min_lon), (max_lat, max_lon)]:
+                self.assertLessEqual(get_distance(latitude, longitude, *corner), radius)
+
+        with mock.patch.object(spatial, 'get_distance', wraps=get_distance) as distance:
+            ranked = rank_by_distance(Point.objects.all(), latitude, longitude, expected[70][0], expected[60][0])
+        self.assertEqual(ranked, expected[60:71])
+        self.assertLess(distance.call_count, 60)
+
+    def test_point_cluster_samples(self):
+        """
+        Test that the clusters list a bounded sample of the ids of their points.
+        Checks:
+            - a cluster lists the CLUSTER_SAMPLE_SIZE lowest ids of its points
+            - a cluster with fewer points lists all of them
+        """
+
+        user = User.objects.get(username='tester')
+        Point.objects.bulk_create([Point(name='Gold Coast {}'.format(i), latitude=-28 + i / 100, longitude=153.4,
+                                         creator=user) for i in range(CLUSTER_SAMPLE_SIZE + 3)])
+        Point.objects.create(name='Perth', latitude=-31.95, longitude=115.86, creator=user)
+
+        clusters = get_clusters(Point.objects.all(), 110, -35, 155, -25, 3)
+        ids = sorted(Point.objects.exclude(name='Perth').values_list('id', flat=True))
+        self.assertEqual(sorted(cluster['count'] for cluster in clusters), [1, CLUSTER_SAMPLE_SIZE + 4])
+        east = [cluster for cluster in clusters if cluster['count'] > 1][0]
+        self.assertEqual(east['ids'], ids[:CLUSTER_SAMPLE_SIZE])
+        west = [cluster for cluster in clusters if cluster['count'] == 1][0]
+        self.assertEqual(west['ids'], [Point.objects.get(name='Perth').id])
+
+    def test_point_counts(self):
+        """
+        Test that the comment, tag and star counts of the points are maintained
+        and that the repair command corrects counts that have drifted.
+        """
+
+        user = User.objects.get(username='tester')
+        point = Point.objects.get(name='Brisbane')
+        comment = Comment.objects.create(content='test', creator=user, point=point)
+        Tag.objects.create(name='test', creator=user, point=point)
+        Star.objects.create(creator=user, point=point)
+        comment.save()
+        point.refresh_from_db()
+        self.assertEqual((point.comment_count, point.tag_count, point.star_count), (1, 1, 1))
+
+        comment.delete()
+        point.refresh_from_db()
+        self.assertEqual(point.comment_count, 0)
+
+        Comment.objects.bulk_create([Comment(content='bulk', creator=user, point=point)] * 2)
+        Star.objects.all().delete()
+        Point.objects.filter(id=point.id).update(tag_count=5)
+
+        output = StringIO()
+        call_command('repair_point_counts', '--batch-size', '1', stdout=output)
+        self.assertIn('1 point(s)', output.getvalue())
+        point.refresh_from_db()
+        self.assertEqual((point.comment_count, point.tag_count, point.star_count), (2, 1, 0))
+
+        self.assertEqual(Point.objects.update_counts(), 0)
+
+    def test_point_counts_cascade(self):
+        """
+        Test that the counts of the points are changed once per point when many
+        comments, tags and stars are deleted at once.
+        Checks:
+            - deleting a point with its children does not update the point for each child
+            - deleting a user updates the counts of the other users' points once per count
+            - the counts are correct after the deletions
+        """
+
+        user = User.objects.get(username='tester')
+        other = User.objects.create(username='other', password='other')
+        hobart, suva = [Point.objects.create(name=name, latitude=0, longitude=0, creator=user)
+                          for name in ('Hobart', 'Suva')]
+        for point in (hobart, suva):
+            for i in range(5):
+                Comment.objects.create(content=str(i), creator=other, point=point)
+            Tag.objects.create(name='test', creator=other, point=point)
+            Star.objects.create(creator=other, point=point)
+        Comment.objects.create(content='kept', creator=user, point=suva)
+
+        with mock.patch.object(PointQuerySet, 'change_counts', autospec=True,
+                               side_effect=PointQuerySet.change_counts) as change_counts:
+            hobart.delete()
+            self.assertEqual(change_counts.call_count, 0)
+
+            other.delete()
+            self.assertEqual(change_counts.call_count, 3)
+
+        suva.refresh_from_db()
+        self.assertEqual((suva.comment_count, suva.tag_count, suva.star_count), (1, 0, 0))
+        self.assertEqual(Point.objects.update_counts(), 0)
+
+    def test_point_save_counts(self):
+        """
+        Test that saving a point does not write its counts but still inserts a deleted point.
+        Checks:
+            - saving a stale instance keeps the counts changed meanwhile
+            - saving an instance whose row was deleted inserts it again
+        """
+
+        user = User.objects.get(username='tester')
+        stale = Point.objects.get(name='Brisbane')
+        Star.objects.create(creator=user, point=stale)
+        stale.description = 'changed'
+        stale.save()
+
+        point = Point.objects.get(id=stale.id)
+        self.assertEqual((point.description, point.star_count), ('changed', 1))
+
+        Point.objects.filter(id=point.id).delete()
+        point.save()
+        self.assertEqual(Point.objects.get(id=point.id).name, 'Brisbane')
+
 class CommentTest(TestCase):
     """
     Test the create, read, update and delete operations on Comment models.
@@ -0,0 +1,109 @@
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from mappoints.core.models import User, Point, Comment
+from mappoints.core.tests import utils
+
+class PaginationTest(APITestCase):
+    """
+    Test the keyset pagination of the collections in the API.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='tester', password='tester', location='Test')
+        self.points = [
+            Point.objects.create(name='test{}'.format(i), latitude=i, longitude=i, creator=self.user)
+            for i in range(5)
+        ]
+
+    def get_ids(self, response):
+        return [item['id'] for item in response.data['_items']]
+
+    def test_point_list_pages(self):
+        """
+        Test that the points can be paged through forwards and backwards.
+        Checks:
+            - every page has at most 'limit' items
+            - pages follow the creation order without gaps or duplicates
+            - the first page has no '_prev' link and the last page no '_next' link
+            - the '_prev' link of the last page returns the previous page
+            - _url and _parent links are valid (accessible with a GET request)
+        """
+
+        url = reverse('point-list')
+        response = self.client.get(url, {'limit': 2})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_ids(response), [p.id for p in self.points[:2]])
+        self.assertIsNone(response.data['_prev'])
+        self.assertTrue(utils.check_url_get(self.client, response.data))
+        self.assertTrue(utils.check_parent_get(self.client, response.data))
+
+        second_response = self.client.get(response.data['_next'])
+        self.assertEqual(self.get_ids(second_response), [p.id for p in self.points[2:4]])
+        self.assertIsNotNone(second_response.data['_prev'])
+
+        last_response = self.client.get(second_response.data['_next'])
+        self.assertEqual(self.get_ids(last_response), [self.points[4].id])
+        self.assertIsNone(last_response.data['_next'])
+
+        prev_response = self.client.get(last_response.data['_prev'])
+        self.assertEqual(self.get_ids(prev_response), [p.id for p in self.points[2:4]])
+        self.assertIsNotNone(prev_response.data['_next'])
+
+        first_response = self.client.get(prev_response.data['_prev'])
+        self.assertEqual(self.get_ids(first_response), [p.id for p in self.points[:2]])
+        self.assertIsNone(first_response.data['_prev'])
+
+    def test_equal_created_order(self):
+        """
+        Test that items created at the same time are ordered by id without being skipped.
+        """
+
+        Point.objects.update(created=self.points[0].created)
+
+        url = reverse('point-list')
+        ids = []
+        next_url = url + '?limit=2'
+        while next_url:
+            response = self.client.get(next_url)
+            ids.extend(self.get_ids(response))
+            next_url = response.data['_next']
+
+        self.assertEqual(ids, [p.id for p in self.points])
+
+    def test_nested_list_pages(self):
+        """
+        Test that nested collections are paginated and keep their other query parameters.
+        """
+
+        point = self.points[0]
+        for i in range(3):
+            Comment.objects.create(content='comment{}'.format(i), point=point, creator=self.user)
+
+        url = reverse('point-comment-list', args=[point.id])
+        response = self.client.get(url, {'limit': 2, 'expand': 'creator'})
+
+        self.assertEqual(len(response.data['_items']), 2)
+        self.assertIn('expand=creator', response.data['_next'])
+
+        next_response = self.client.get(response.data['_next'])
+        self.assertEqual(len(next_response.data['_items']), 1)
+        self.assertEqual(next_response.data['_items'][0]['creator']['username'], 'tester')
+        self.assertIsNone(next_response.data['_next'])
+
+    def test_invalid_cursor(self):
+        """
+        Test that a malformed cursor gives a 404 and an invalid limit falls back to the default.
+        """
+
+        url = reverse('point-list')
+
+        invalid_response = self.client.get(url, {'cursor': 'invalid'})
+        self.assertEqual(invalid_response.status_code, status.HTTP_404_NOT_FOUND)
+
+        invalid_limit_response = self.client.get(url, {'limit': 'a'})
+        self.assertEqual(invalid_limit_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(invalid_limit_response.data['_items']), 5)
+        self.assertIsNone(invalid_limit_response.data['_next'])
@@ -0,0 +1,85 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase, APIRequestFactory
+
+from mappoints.urls import router, users_router, points_router
+from mappoints.core.authentication import get_claims_user
+from mappoints.core.models import User, Point, Comment, Tag, Star
+from mappoints.core.permissions import ActionPermission, IsCreator, IsSelf
+from mappoints.core.tokens import get_token_cache
+
+class PermissionTest(APITestCase):
+    """
+    Test that the permission layer of the API doesn't query the database.
+    """
+
+    def setUp(self):
+        get_token_cache().clear()
+        self.user = User(username='tester', location='Test')
+        self.user.set_password('tester')
+        self.user.save()
+
+        point = Point.objects.create(name='test', latitude=1, longitude=1, creator=self.user)
+        Comment.objects.create(content='test', point=point, creator=self.user)
+        Tag.objects.create(name='test', point=point, creator=self.user)
+        Star.objects.create(point=point, creator=self.user)
+
+    def test_permission_queries(self):
+        """
+        Test that checking the permissions of every action of every route with action permissions takes no queries.
+        Checks:
+            - view and object permissions are checked without queries for the creator and for another user
+            - only the creator is allowed the actions limited to the creator or the user themselves
+            - actions that are not listed are denied
+        """
+
+        claims = {'user_id': self.user.id, 'username': 'tester', 'is_superuser': False, 'token_version': 0}
+        creator = get_claims_user(claims)
+        other = get_claims_user(dict(claims, user_id=self.user.id + 1, username='other'))
+        factory = APIRequestFactory()
+
+        for prefix, viewset, basename in router.registry + users_router.registry + points_router.registry:
+            if ActionPermission not in viewset.permission_classes:
+                continue
+
+            model = viewset.serializer_class.Meta.model
+            obj = model.objects.first()
+
+            for action in set().union(*viewset.action_permissions.values()):
+                method = 'get' if action in ('list', 'retrieve', 'nearby', 'clusters') else 'post'
+                for user in (creator, other):
+                    with self.subTest(route=basename, action=action, user=user.username):
+                        view = viewset(action=action)
+                        request = Request(getattr(factory, method)('/'))
+                        request.user = user
+                        permission = ActionPermission()
+
+                        with self.assertNumQueries(0):
+                            allowed = (permission.has_permission(request, view) and
+                                       permission.has_object_permission(request, view, obj))
+
+                        restricted = viewset.action_permissions.get(IsCreator, []) + \
+                            viewset.action_permissions.get(IsSelf, [])
+                        self.assertEqual(allowed, user is creator or action not in restricted)
+
+            view = viewset(action='unknown')
+            self.assertFalse(ActionPermission().has_permission(Request(factory.get('/')), view))
+
+    def test_creator_request(self):
+        """
+        Test that a JWT authenticated change by the creator doesn't query the user table.
+        """
+
+        response = self.client.post('/api-token-auth/', {'username': 'tester', 'password': 'tester'})
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + response.data['token'])
+        point = Point.objects.get(name='test')
+        url = reverse('point-comment-detail', args=[point.id, Comment.objects.get().id])
+
+        self.client.get(reverse('point-list'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(url, {'content': 'changed'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries if 'FROM "core_user"' in query['sql']])
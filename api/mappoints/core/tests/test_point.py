@@ -1,8 +1,12 @@
+from unittest import skipUnless
+
+from django.db import connection
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase, APIRequestFactory
 
-from mappoints.core.models import User, Point
+from mappoints.core.models import User, Point, Star
+from mappoints.core.filters import get_bbox_filter
 from mappoints.core.tests import utils
 
 class PointTest(APITestCase):
@@ -286,3 +290,276 @@ class PointTest(APITestCase):
 
         not_found_response = self.client.delete(url)
         self.assertEqual(not_found_response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_point_list_bbox(self):
+        """
+        Test that the list of points can be filtered with a bounding box.
+        Checks:
+            - only the points inside the bounding box are returned
+            - a bounding box crossing the antimeridian returns the points on both sides of it
+            - points of a single user can be filtered as well
+            - malformed or out of range bounding boxes give a 400
+        """
+
+        user = User.objects.create(username='tester', password='tester', location='Test')
+        coordinates = {'helsinki': (60.17, 24.94), 'fiji': (-17.7, 178.1), 'samoa': (-13.8, -172.1),
+                       'santiago': (-33.45, -70.67), 'edge': (60, 25)}
+        for name, (latitude, longitude) in coordinates.items():
+            Point.objects.create(name=name, latitude=latitude, longitude=longitude, creator=user)
+
+        def get_names(url, bbox):
+            response = self.client.get(url, {'bbox': bbox})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return sorted(item['name'] for item in response.data['_items'])
+
+        url = reverse('point-list')
+        self.assertEqual(get_names(url, '20,55,25,65'), ['edge', 'helsinki'])
+        self.assertEqual(get_names(url, '170,-20,-170,-10'), ['fiji', 'samoa'])
+        self.assertEqual(get_names(url, '-180,-90,180,90'), sorted(coordinates))
+        self.assertEqual(get_names(url, '0,0,1,1'), [])
+        self.assertEqual(get_names(reverse('user-point-list', args=[user.id]), '-80,-40,-60,-30'), ['santiago'])
+
+        for bbox in ['1,2,3', 'a,b,c,d', '0,0,200,10', '0,-100,10,10', '0,20,10,10', 'nan,0,1,1']:
+            invalid_response = self.client.get(url, {'bbox': bbox})
+            self.assertEqual(invalid_response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def get_query_plan(self, queryset):
+        """
+        Get the SQLite query plan of a queryset as a single string.
+        """
+
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return ' '.join(str(row) for row in cursor.fetchall())
+
+    @skipUnless(connection.vendor == 'sqlite', 'query plans are only checked on SQLite')
+    def test_point_bbox_index(self):
+        """
+        Test that bounding box queries use the (latitude, longitude) index, also across the antimeridian.
+        """
+
+        index_name = [index.name for index in Point._meta.indexes if index.fields == ['latitude', 'longitude']][0]
+
+        for bbox in [(20, 55, 25, 65), (170, -20, -170, -10)]:
+            queryset = Point.objects.filter(get_bbox_filter(*bbox)).order_by('created', 'id')[:101]
+            self.assertIn(index_name, self.get_query_plan(queryset))
+
+    def test_point_nearby(self):
+        """
+        Test that the points nearest to a location can be retrieved.
+        Checks:
+            - valid GET response status is 200
+            - points are ordered by distance and include the distance in meters
+            - the radius limits the distance of the returned points
+            - points across the antimeridian are found
+            - k limits the page size and the '_next' and '_prev' links page through the points
+            - point _url and nested collection links are the same as in the point list
+              and _parent links are valid (accessible with a GET request)
+            - a missing or invalid location or radius gives a 400
+        """
+
+        user = User.objects.create(username='tester', password='tester', location='Test')
+        coordinates = {'helsinki': (60.1699, 24.9384), 'espoo': (60.2055, 24.6559),
+                       'tampere': (61.4978, 23.7610), 'oulu': (65.0121, 25.4651),
+                       'fiji': (-17.7134, 178.0650), 'samoa': (-13.7590, -172.1046)}
+        for name, (latitude, longitude) in coordinates.items():
+            Point.objects.create(name=name, latitude=latitude, longitude=longitude, creator=user)
+
+        url = reverse('point-nearby')
+        response = self.client.get(url, {'lat': 60.1699, 'lon': 24.9384})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        names = [item['name'] for item in response.data['_items']]
+        self.assertEqual(names, ['helsinki', 'espoo', 'tampere', 'oulu', 'samoa', 'fiji'])
+        self.assertEqual(response.data['_items'][0]['distance'], 0)
+        self.assertAlmostEqual(response.data['_items'][1]['distance'], 16000, delta=500)
+        self.assertTrue(utils.check_parent_get(self.client, response.data))
+        self.assertTrue(utils.check_url_get(self.client, response.data['_items'][0]))
+
+        list_item = self.client.get(reverse('point-list'), {'bbox': '24,60,25,60.18'}).data['_items'][0]
+        nearby_item = response.data['_items'][0]
+        self.assertEqual(nearby_item['_url'], list_item['_url'])
+        self.assertEqual(nearby_item['comments'], list_item['comments'])
+
+        radius_response = self.client.get(url, {'lat': 60.1699, 'lon': 24.9384, 'radius': 200000})
+        self.assertEqual([item['name'] for item in radius_response.data['_items']], ['helsinki', 'espoo', 'tampere'])
+
+        antimeridian_response = self.client.get(url, {'lat': -16, 'lon': 179.9, 'radius': 1500000})
+        self.assertEqual([item['name'] for item in antimeridian_response.data['_items']], ['fiji', 'samoa'])
+
+        first_response = self.client.get(url, {'lat': 60.1699, 'lon': 24.9384, 'k': 2})
+        self.assertEqual([item['name'] for item in first_response.data['_items']], ['helsinki', 'espoo'])
+        self.assertIsNone(first_response.data['_prev'])
+
+        second_response = self.client.get(first_response.data['_next'])
+        self.assertEqual([item['name'] for item in second_response.data['_items']], ['tampere', 'oulu'])
+
+        last_response = self.client.get(second_response.data['_next'])
+        self.assertEqual([item['name'] for item in last_response.data['_items']], ['samoa', 'fiji'])
+        self.assertIsNone(last_response.data['_next'])
+
+        prev_response = self.client.get(last_response.data['_prev'])
+        self.assertEqual([item['name'] for item in prev_response.data['_items']], ['tampere', 'oulu'])
+
+        expanded_response = self.client.get(url, {'lat': 65, 'lon': 25.5, 'k': 1, 'expand': 'creator'})
+        self.assertEqual(expanded_response.data['_items'][0]['name'], 'oulu')
+        self.assertEqual(expanded_response.data['_items'][0]['creator']['username'], 'tester')
+
+        for params in [{}, {'lat': 60}, {'lat': 'a', 'lon': 24}, {'lat': 91, 'lon': 24}, {'lat': 60, 'lon': 24, 'radius': -1}]:
+            invalid_response = self.client.get(url, params)
+            self.assertEqual(invalid_response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_point_clusters(self):
+        """
+        Test that the points can be retrieved as clusters on the grid of a map zoom level.
+        Checks:
+            - valid GET response status is 200
+            - clusters have the count, centroid and sample ids of their points
+            - nearby points are merged into a single cluster when zoomed out and split when zoomed in
+            - the bbox limits the clusters, also across the antimeridian
+            - clusters are updated when a point is created or deleted
+            - a missing or invalid zoom level or bbox gives a 400
+        """
+
+        user = User.objects.create(username='tester', password='tester', location='Test')
+        coordinates = {'helsinki': (60.1699, 24.9384), 'espoo': (60.2055, 24.6559),
+                       'fiji': (-17.7134, 178.0650), 'samoa': (-13.7590, -172.1046)}
+        points = {name: Point.objects.create(name=name, latitude=latitude, longitude=longitude, creator=user)
+                  for name, (latitude, longitude) in coordinates.items()}
+
+        url = reverse('point-clusters')
+        response = self.client.get(url, {'zoom': 3})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sum(cluster['count'] for cluster in response.data['_items']), 4)
+        finland = [cluster for cluster in response.data['_items'] if cluster['count'] == 2][0]
+        self.assertEqual(finland['ids'], sorted([points['helsinki'].id, points['espoo'].id]))
+        self.assertAlmostEqual(finland['latitude'], 60.1877, places=4)
+        self.assertAlmostEqual(finland['longitude'], 24.79715, places=4)
+
+        zoomed_response = self.client.get(url, {'zoom': 12, 'bbox': '24,60,25,61'})
+        self.assertEqual([cluster['count'] for cluster in zoomed_response.data['_items']], [1, 1])
+
+        antimeridian_response = self.client.get(url, {'zoom': 3, 'bbox': '170,-20,-170,-10'})
+        self.assertEqual(sorted(cluster['ids'][0] for cluster in antimeridian_response.data['_items']),
+                         sorted([points['fiji'].id, points['samoa'].id]))
+
+        Point.objects.create(name='vantaa', latitude=60.2934, longitude=25.0378, creator=user)
+        points['samoa'].delete()
+        utils.run_commit_hooks()
+        updated_response = self.client.get(url, {'zoom': 3})
+        self.assertEqual(sorted(cluster['count'] for cluster in updated_response.data['_items']), [1, 3])
+
+        for params in [{}, {'zoom': 'a'}, {'zoom': 21}, {'zoom': 3, 'bbox': '1,2,3'}, {'zoom': 20}]:
+            invalid_response = self.client.get(url, params)
+            self.assertEqual(invalid_response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_point_counts(self):
+        """
+        Test that the points have up to date comment, tag and star counts.
+        Checks:
+            - creating and deleting comments, tags and stars changes the counts
+            - updating a point does not overwrite the counts
+            - the points can be ordered by their star count in both directions and paged
+            - an invalid ordering gives a 400
+        """
+
+        user = User(username='tester', location='Test')
+        user.set_password('tester')
+        user.save()
+        self.client.credentials(HTTP_AUTHORIZATION=utils.get_basic_auth_header('tester:tester'))
+
+        points = [Point.objects.create(name='test{}'.format(i), latitude=i, longitude=i, creator=user) for i in range(3)]
+        point = points[1]
+        url = reverse('point-detail', args=[point.id])
+
+        comment_response = self.client.post(reverse('point-comment-list', args=[point.id]), {'content': 'test'})
+        self.client.post(reverse('point-tag-list', args=[point.id]), {'name': 'test'})
+        star_response = self.client.post(reverse('point-star-list', args=[point.id]))
+        response = self.client.get(url)
+        self.assertEqual((response.data['comment_count'], response.data['tag_count'], response.data['star_count']),
+                         (1, 1, 1))
+
+        stale_point = Point.objects.get(id=point.id)
+        self.client.delete(comment_response.data['_url'])
+        stale_point.description = 'updated'
+        stale_point.save()
+        response = self.client.get(url)
+        self.assertEqual(response.data['description'], 'updated')
+        self.assertEqual(response.data['comment_count'], 0)
+        self.assertEqual(response.data['star_count'], 1)
+
+        self.client.post(reverse('point-star-list', args=[points[2].id]))
+        other = User.objects.create(username='other', password='other')
+        for target in points[1:]:
+            Star.objects.create(point=target, creator=other)
+        self.assertEqual(Point.objects.get(id=point.id).star_count, 2)
+
+        ordered_response = self.client.get(reverse('point-list'), {'ordering': '-star_count'})
+        self.assertEqual([item['id'] for item in ordered_response.data['_items']],
+                         [points[2].id, points[1].id, points[0].id])
+
+        first_page = self.client.get(reverse('point-list'), {'ordering': 'star_count', 'limit': 2})
+        next_page = self.client.get(first_page.data['_next'])
+        self.assertEqual([item['id'] for item in first_page.data['_items'] + next_page.data['_items']],
+                         [points[0].id, points[1].id, points[2].id])
+
+        self.client.delete(star_response.data['_url'])
+        self.assertEqual(self.client.get(url).data['star_count'], 1)
+
+        invalid_response = self.client.get(reverse('point-list'), {'ordering': 'name'})
+        self.assertEqual(invalid_response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_point_bulk_create(self):
+        """
+        Test that many points can be created at once from a list.
+        Checks:
+            - trying to create points without authentication gives a 401
+            - valid items are created and invalid or conflicting items are reported in the order of the items
+            - a list with conflicts gives a 207 and a list of created points a 201
+            - the _url links of the created points are valid (accessible with a GET request)
+            - the number of queries does not depend on the number of points
+            - trying to create too many points at once gives a 400
+        """
+
+        user = User(username='tester', location='Test')
+        user.set_password('tester')
+        user.save()
+        Point.objects.create(name='taken', latitude=1, longitude=1, creator=user)
+        url = reverse('point-list')
+
+        data = [
+            {'name': 'first', 'latitude': 1, 'longitude': 2},
+            {'name': 'taken', 'latitude': 1, 'longitude': 2},
+            {'name': 'invalid', 'latitude': 91, 'longitude': 2},
+            {'name': 'first', 'latitude': 3, 'longitude': 4},
+            {'name': 'second', 'latitude': 3, 'longitude': 4, 'description': 'testing'},
+        ]
+
+        unauthorized_response = self.client.post(url, data, format='json')
+        self.assertEqual(unauthorized_response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.client.credentials(HTTP_AUTHORIZATION=utils.get_basic_auth_header('tester:tester'))
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, 207)
+
+        items = response.data['_items']
+        self.assertEqual([item['status'] for item in items], [201, 409, 400, 409, 201])
+        self.assertIn('latitude', items[2]['errors'])
+        self.assertTrue(utils.check_url_get(self.client, items[0]))
+        second = self.client.get(items[4]['_url']).data
+        self.assertEqual((second['name'], second['description'], second['creator']['_url'].endswith(
+            '/users/{}/'.format(user.id))), ('second', 'testing', True))
+        self.assertEqual(Point.objects.get(name='first').latitude, 1)
+
+        for count in [5, 50]:
+            data = [{'name': 'bulk{}-{}'.format(count, i), 'latitude': i, 'longitude': i} for i in range(count)]
+            # The version of the points is changed once the transaction commits.
+            with self.subTest(count=count), self.assertNumQueries(6):
+                response = self.client.post(url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(Point.objects.filter(name__startswith='bulk{}-'.format(count)).count(), count)
+
+        too_many_response = self.client.post(url, [{}] * 5001, format='json')
+        self.assertEqual(too_many_response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,178 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from mappoints.core.models import User, Point, Comment, Tag, Star
+from mappoints.core.representations import get_representation_cache
+from mappoints.core.tests import utils
+
+class QueryCountTest(APITestCase):
+    """
+    Test that the number of queries made by the read actions does not depend
+    on the number of serialized resources or their related resources.
+    """
+
+    def setUp(self):
+        self.create_resources(3)
+
+    def create_resources(self, count):
+        """
+        Create users that each have points with a comment, a tag and a star.
+        """
+
+        for i in range(count):
+            user = User.objects.create(username='tester{}{}'.format(count, i), password='tester')
+            for j in range(count):
+                point = Point.objects.create(name='test{}'.format(j), latitude=j, longitude=j, creator=user)
+                Comment.objects.create(content='testing', point=point, creator=user)
+                Tag.objects.create(name='test', point=point, creator=user)
+                Star.objects.create(point=point, creator=user)
+
+        self.user = User.objects.first()
+        self.point = Point.objects.filter(creator=self.user).first()
+
+    def assert_queries(self, url, expected):
+        """
+        Assert the number of queries made when getting the url with each expand parameter.
+        The cached point representations are cleared before each request.
+
+        Parameters:
+            - url: the url to get
+            - expected: dictionary mapping expand parameters to the expected number of queries
+        """
+
+        for expand, num in expected.items():
+            get_representation_cache().clear()
+            with self.subTest(url=url, expand=expand), self.assertNumQueries(num):
+                response = self.client.get(url, {'expand': expand} if expand else {})
+                self.assertEqual(response.status_code, 200)
+
+    def test_point_queries(self):
+        """
+        Test the number of queries of the point list and retrieve actions.
+        Checks:
+            - a point list costs a version lookup, a single query and one query per prefetched relation
+            - expanding the creator adds a join instead of a query
+            - expanding comments, tags and stars reuses their prefetch queries
+            - the number of queries stays the same after adding more resources
+        """
+
+        expected = {
+            '': 5,
+            'creator': 5,
+            'comments': 5,
+            'comments.creator': 5,
+            'creator,comments,tags,stars': 5,
+        }
+        self.assert_queries(reverse('point-list'), expected)
+        self.assert_queries(reverse('point-detail', args=[self.point.id]), expected)
+        self.assert_queries(reverse('user-point-list', args=[self.user.id]), expected)
+
+        self.create_resources(5)
+        self.assert_queries(reverse('point-list'), expected)
+
+    def test_user_queries(self):
+        """
+        Test the number of queries of the user list and retrieve actions.
+        Checks:
+            - a user list costs a version lookup, a single query and one query per prefetched relation
+            - expanding nested points prefetches their comments, tags and stars
+            - the number of queries stays the same after adding more resources
+        """
+
+        expected = {
+            '': 5,
+            'comments': 5,
+            'comments.creator,stars.creator': 5,
+            'points': 8,
+            'points.comments.creator,comments,stars': 8,
+        }
+        self.assert_queries(reverse('user-list'), expected)
+        self.assert_queries(reverse('user-detail', args=[self.user.id]), expected)
+
+        self.create_resources(5)
+        self.assert_queries(reverse('user-list'), expected)
+
+    def test_nested_queries(self):
+        """
+        Test the number of queries of the comment, tag and star actions under users and points.
+        Checks:
+            - a nested list costs a version lookup and a single list query
+            - expanding the creator adds a join instead of a query
+            - an empty nested list adds a lookup of its parent, and a missing parent gives a 404
+        """
+
+        expected = {'': 2, 'creator': 2}
+
+        for view_name in ['user-comment-list', 'user-star-list']:
+            self.assert_queries(reverse(view_name, args=[self.user.id]), expected)
+
+        for view_name in ['point-comment-list', 'point-tag-list', 'point-star-list']:
+            self.assert_queries(reverse(view_name, args=[self.point.id]), expected)
+
+        self.create_resources(5)
+
+        for view_name in ['point-comment-list', 'point-tag-list', 'point-star-list']:
+            self.assert_queries(reverse(view_name, args=[self.point.id]), expected)
+
+        empty_point = Point.objects.create(name='empty', latitude=0, longitude=0, creator=self.user)
+        for view_name in ['point-comment-list', 'point-tag-list', 'point-star-list']:
+            self.assert_queries(reverse(view_name, args=[empty_point.id]), {'': 3, 'creator': 3})
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse(view_name, args=[empty_point.id + 1]), {'limit': 500})
+            self.assertEqual(response.status_code, 404)
+
+    def test_create_queries(self):
+        """
+        Test that the creates check for duplicates with the unique constraints instead of queries.
+        Checks:
+            - creating a user, a point, a tag and a star doesn't select from their tables before the insert
+            - creating a point doesn't look up its comments, tags and stars, and creating a star
+              only looks up the id of its point, with a 404 for a missing point
+            - duplicates of each give a 409
+            - updating a user or a point to a taken username or name gives a 409
+        """
+
+        user = User(username='creator')
+        user.set_password('creator')
+        user.save()
+        auth = {'HTTP_AUTHORIZATION': utils.get_basic_auth_header('creator:creator')}
+        point = Point.objects.create(name='mine', latitude=1, longitude=1, creator=user)
+
+        # The point and the star take the user lookup of the authentication, the savepoint, the
+        # insert and its release, and the star the lookup of its point and the change of its count.
+        creates = [
+            ('core_user', {}, reverse('user-list'), {'username': 'new', 'password': 'new'}, None),
+            ('core_point', auth, reverse('point-list'), {'name': 'new', 'latitude': 1, 'longitude': 1}, 4),
+            ('core_tag', auth, reverse('point-tag-list', args=[point.id]), {'name': 'new'}, None),
+            ('core_star', auth, reverse('point-star-list', args=[point.id]), {}, 6),
+        ]
+        for table, credentials, url, data, count in creates:
+            self.client.credentials(**credentials)
+            with self.subTest(url=url), CaptureQueriesContext(connection) as queries:
+                response = self.client.post(url, data)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            if count is not None:
+                self.assertEqual(len(queries), count, [query['sql'] for query in queries])
+            inserts = [i for i, query in enumerate(queries) if query['sql'].startswith('INSERT INTO "{}"'.format(table))]
+            selects = [i for i, query in enumerate(queries) if 'FROM "{}"'.format(table) in query['sql']]
+            self.assertTrue(inserts)
+            self.assertFalse([i for i in selects if i < inserts[0]])
+
+            duplicate_response = self.client.post(url, data)
+            self.assertEqual(duplicate_response.status_code, status.HTTP_409_CONFLICT)
+
+        user_url = reverse('user-detail', args=[user.id])
+        user_response = self.client.put(user_url, {'username': 'new', 'password': 'creator'})
+        self.assertEqual(user_response.status_code, status.HTTP_409_CONFLICT)
+
+        point_url = reverse('point-detail', args=[point.id])
+        point_response = self.client.put(point_url, {'name': 'new', 'latitude': 1, 'longitude': 1})
+        self.assertEqual(point_response.status_code, status.HTTP_409_CONFLICT)
+
+        missing_response = self.client.post(reverse('point-star-list', args=[0]))
+        self.assertEqual(missing_response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.put(point_url, {'name': 'mine', 'latitude': 2, 'longitude': 2}).status_code,
+                         status.HTTP_200_OK)
@@ -0,0 +1,92 @@
+import json
+from datetime import datetime
+from decimal import Decimal
+
+import cbor2
+import msgpack
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from mappoints.core.models import User, Point, Tag, Comment
+from mappoints.core.renderers import MessagePackRenderer, CBORRenderer
+from mappoints.core.tests import utils
+
+FORMATS = {
+    'application/msgpack': lambda content: msgpack.unpackb(content, raw=False),
+    'application/cbor': cbor2.loads,
+}
+ENCODERS = {
+    'application/msgpack': msgpack.packb,
+    'application/cbor': cbor2.dumps,
+}
+
+class BinaryRendererTest(APITestCase):
+    """
+    Test the MessagePack and CBOR representations of the API.
+    """
+
+    def setUp(self):
+        self.user = User(username='tester', location='Test')
+        self.user.set_password('tester')
+        self.user.save()
+        self.point = Point.objects.create(name='test', description='testing',
+                                          latitude=12.123, longitude=-45.456, creator=self.user)
+        Tag.objects.create(name='camping', point=self.point, creator=self.user)
+        Comment.objects.create(content='nice', point=self.point, creator=self.user)
+
+    def test_binary_round_trip(self):
+        """
+        Test that the binary representations decode to the same data as the JSON representation.
+        Checks:
+            - the response is negotiated from the Accept header and has the binary media type
+            - collections, instances and expanded instances decode to the JSON data
+            - decimals and datetimes are represented the same way as in JSON
+        """
+
+        urls = [
+            reverse('point-list'),
+            reverse('point-detail', args=[self.point.id]),
+            reverse('point-detail', args=[self.point.id]) + '?expand=creator',
+            reverse('user-detail', args=[self.user.id]),
+            reverse('point-tag-list', args=[self.point.id]),
+        ]
+
+        for url in urls:
+            expected = json.loads(self.client.get(url, HTTP_ACCEPT='application/json').content.decode())
+            for media_type, decode in FORMATS.items():
+                with self.subTest(url=url, media_type=media_type):
+                    response = self.client.get(url, HTTP_ACCEPT=media_type)
+                    self.assertEqual(response.status_code, status.HTTP_200_OK)
+                    self.assertEqual(response['Content-Type'], media_type)
+                    self.assertEqual(decode(response.content), expected)
+
+        data = {'latitude': Decimal('12.123000'), 'created': timezone.make_aware(datetime(2020, 1, 2, 3, 4, 5, 678000))}
+        expected = json.loads(JSONRenderer().render(data).decode())
+        self.assertEqual(msgpack.unpackb(MessagePackRenderer().render(data), raw=False), expected)
+        self.assertEqual(cbor2.loads(CBORRenderer().render(data)), expected)
+
+    def test_binary_bulk_create(self):
+        """
+        Test that bulk requests can be sent in the binary formats.
+        Checks:
+            - a list of points encoded in each format is created in bulk
+            - a malformed body gives a 400
+        """
+
+        self.client.credentials(HTTP_AUTHORIZATION=utils.get_basic_auth_header('tester:tester'))
+        url = reverse('point-list')
+
+        for media_type, encode in ENCODERS.items():
+            with self.subTest(media_type=media_type):
+                name = media_type.split('/')[1]
+                body = encode([{'name': name, 'latitude': '1.5', 'longitude': 2.5}])
+                response = self.client.post(url, body, content_type=media_type, HTTP_ACCEPT=media_type)
+                self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+                self.assertEqual(FORMATS[media_type](response.content)['_items'][0]['status'], 201)
+                self.assertEqual(Point.objects.get(name=name).latitude, Decimal('1.5'))
+
+                malformed_response = self.client.post(url, body[:-3], content_type=media_type)
+                self.assertEqual(malformed_response.status_code, status.HTTP_400_BAD_REQUEST)
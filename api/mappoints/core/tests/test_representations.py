@@ -0,0 +1,81 @@
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from mappoints.core.models import User, Point, Comment, Tag, Star
+from mappoints.core.representations import get_representation_cache, get_point_key
+
+class RepresentationCacheTest(APITestCase):
+    """
+    Test the cached representation fragments of the points.
+    """
+
+    def setUp(self):
+        get_representation_cache().clear()
+        self.user = User.objects.create(username='tester', password='tester', location='Test')
+        self.other = User.objects.create(username='other', password='other', location='Test')
+        self.point = Point.objects.create(name='test', latitude=1, longitude=1, creator=self.user)
+        self.url = reverse('point-detail', args=[self.point.id])
+
+    def test_cached_point(self):
+        """
+        Test that a cached point is served with a lookup of its updated time only.
+        Checks:
+            - the cached representation equals the uncached one
+            - a cached retrieve takes the version and updated time lookups only
+            - the fragment is shared by the point list and the user's point list
+            - the urls of the fragment follow the host of the request
+        """
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(get_representation_cache().get(get_point_key(self.point.id)))
+
+        with self.assertNumQueries(2):
+            cached_response = self.client.get(self.url)
+        self.assertEqual(cached_response.data, response.data)
+
+        item = self.client.get(reverse('point-list')).data['_items'][0]
+        self.assertEqual(dict(item, _parent=response.data['_parent']), response.data)
+        user_url = reverse('user-point-detail', args=[self.user.id, self.point.id])
+        self.assertEqual(self.client.get(user_url).data['id'], self.point.id)
+        self.assertEqual(self.client.get(reverse('user-point-detail', args=[self.other.id, self.point.id])).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+        other_host_response = self.client.get(self.url, HTTP_HOST='example.com')
+        self.assertTrue(other_host_response.data['_url'].startswith('http://example.com/'))
+
+    def test_invalidated_point(self):
+        """
+        Test that the cached representation of a point changes with the point and its children.
+        Checks:
+            - updating the point is shown
+            - adding and deleting comments, tags and stars is shown
+            - a queryset update of the point is shown through its updated time
+            - a deleted point is not found
+        """
+
+        self.client.get(self.url)
+        self.point.name = 'changed'
+        self.point.save()
+        self.assertEqual(self.client.get(self.url).data['name'], 'changed')
+
+        comment = Comment.objects.create(content='test', point=self.point, creator=self.other)
+        tag = Tag.objects.create(name='test', point=self.point, creator=self.other)
+        star = Star.objects.create(point=self.point, creator=self.other)
+        data = self.client.get(self.url).data
+        self.assertEqual(len(data['comments']['_items']), 1)
+        self.assertEqual(len(data['tags']['_items']), 1)
+        self.assertEqual(len(data['stars']['_items']), 1)
+
+        comment.delete()
+        tag.delete()
+        star.delete()
+        data = self.client.get(self.url).data
+        self.assertEqual([data[name]['_items'] for name in ('comments', 'tags', 'stars')], [[], [], []])
+
+        Point.objects.filter(pk=self.point.id).update(description='updated')
+        self.assertEqual(self.client.get(self.url).data['description'], 'updated')
+
+        self.point.delete()
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
@@ -1,7 +1,11 @@
+from unittest import mock
+
+from django.db import IntegrityError
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase, APIRequestFactory
 
+from mappoints.core.bulk import insert_children
 from mappoints.core.models import User, Point, Star
 from mappoints.core.tests import utils
 
@@ -195,3 +199,97 @@ class StarTest(APITestCase):
         invalid_user_url = reverse('user-star-list', args=[0])
         invalid_user_response = self.client.get(invalid_user_url)
         self.assertEqual(invalid_user_response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_user_star_bulk(self):
+        """
+        Test that many points can be starred and unstarred at once by a user.
+        Checks:
+            - trying to change the stars without authentication gives a 401
+            - trying to change the stars of another user gives a 403
+            - the results of the operations are in the order of the operations
+            - a list with failed operations gives a 207 and a list of successful operations a 200
+            - the _url links of the created stars are valid (accessible with a GET request)
+            - the star counts of the points are kept consistent
+            - the number of queries does not depend on the number of operations
+        """
+
+        user = User(username='tester', location='Test')
+        user.set_password('tester')
+        user.save()
+        other = User.objects.create(username='other', password='other')
+        points = [Point.objects.create(name='test{}'.format(i), latitude=i, longitude=i, creator=other)
+                  for i in range(60)]
+        Star.objects.create(creator=user, point=points[1])
+        Star.objects.create(creator=other, point=points[2])
+
+        url = reverse('user-star-bulk', args=[user.id])
+        data = [
+            {'op': 'add', 'point': points[0].id},
+            {'op': 'add', 'point': points[1].id},
+            {'op': 'remove', 'point': points[2].id},
+            {'op': 'add', 'point': points[-1].id + 1},
+            {'op': 'remove', 'point': points[1].id},
+            {'op': 'add', 'point': points[0].id},
+            {'op': 'star', 'point': points[3].id},
+        ]
+
+        unauthorized_response = self.client.post(url, data, format='json')
+        self.assertEqual(unauthorized_response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.client.credentials(HTTP_AUTHORIZATION=utils.get_basic_auth_header('tester:tester'))
+        forbidden_response = self.client.post(reverse('user-star-bulk', args=[other.id]), data, format='json')
+        self.assertEqual(forbidden_response.status_code, status.HTTP_403_FORBIDDEN)
+
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, 207)
+        items = response.data['_items']
+        self.assertEqual([item['status'] for item in items], [201, 409, 404, 404, 409, 409, 400])
+        self.assertTrue(utils.check_url_get(self.client, items[0]))
+        self.assertEqual(Star.objects.get(id=items[0]['id']).point_id, points[0].id)
+
+        response = self.client.post(url, [{'op': 'remove', 'point': points[1].id}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['_items'], [{'status': 204}])
+
+        counts = dict(Point.objects.values_list('id', 'star_count'))
+        self.assertEqual((counts[points[0].id], counts[points[1].id], counts[points[2].id]), (1, 0, 1))
+
+        for operations in [points[10:15], points[15:60]]:
+            data = [{'op': 'add', 'point': point.id} for point in operations]
+            data[0]['op'] = 'remove'
+            # The version of the stars is changed once the transaction commits.
+            with self.subTest(count=len(data)), self.assertNumQueries(10):
+                response = self.client.post(url, data, format='json')
+            self.assertEqual(response.status_code, 207)
+
+        self.assertEqual(Point.objects.filter(star_count=1).count(), 2 + 4 + 44)
+        self.assertFalse(Point.objects.filter(id__in=[point.id for point in points], star_count__gt=1).exists())
+
+    def test_user_star_bulk_errors(self):
+        """
+        Test the errors of the bulk star changes that must not fail the request.
+        Checks:
+            - changing the stars of a user with an invalid id as a superuser gives a 404
+            - starring a point deleted by a concurrent request gives a 404 result
+        """
+
+        user = User(username='tester', location='Test', is_superuser=True)
+        user.set_password('tester')
+        user.save()
+        point = Point.objects.create(name='test', latitude=1, longitude=1, creator=user)
+        self.client.credentials(HTTP_AUTHORIZATION=utils.get_basic_auth_header('tester:tester'))
+
+        data = [{'op': 'add', 'point': point.id}]
+        for user_pk in ['invalid', user.id + 1]:
+            response = self.client.post(reverse('user-star-bulk', args=[user_pk]), data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # The point is deleted by a concurrent request after the batch was built, and
+        # saving its star violates the foreign key (SQLite only checks it on commit).
+        results = [None]
+        star = Star(creator=user, point_id=point.id)
+        point.delete()
+        with mock.patch.object(Star.objects, 'bulk_create', side_effect=IntegrityError), \
+                mock.patch.object(Star, 'save', side_effect=IntegrityError):
+            self.assertEqual(insert_children([(0, star)], Star.objects.filter(creator=user), 'point', results), [])
+        self.assertEqual(results, [{'status': 404, 'detail': 'The point does not exist.'}])
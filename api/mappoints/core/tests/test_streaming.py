@@ -0,0 +1,137 @@
+import json
+from collections import OrderedDict
+
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from mappoints.core.geojson import iterate_feature_chunks
+from mappoints.core.models import User, Point, Tag
+
+class StreamingTest(APITestCase):
+    """
+    Test the streamed rendering of large collection pages.
+    """
+
+    def setUp(self):
+        user = User.objects.create(username='tester', password='tester', location='Test')
+        Point.objects.bulk_create([
+            Point(name='tëst {}'.format(i), latitude=i % 90, longitude=i % 180, creator=user)
+            for i in range(250)
+        ])
+
+    def get_streamed(self, url, params):
+        """
+        Get a streamed response and parse its content.
+        """
+
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content)
+        return content, json.loads(content.decode(), object_pairs_hook=OrderedDict)
+
+    def test_streamed_page(self):
+        """
+        Test that a page larger than a database chunk is streamed.
+        Checks:
+            - the streamed content is the same JSON as the rendered collection
+            - the streamed items are the same as in the regular pages
+            - the '_next' and '_prev' links lead to the adjacent pages
+        """
+
+        url = reverse('point-list')
+        content, data = self.get_streamed(url, {'limit': 200})
+
+        self.assertEqual(content, JSONRenderer().render(data))
+        self.assertEqual(list(data.keys()), ['_items', '_url', '_parent', '_next', '_prev'])
+        self.assertEqual(len(data['_items']), 200)
+        self.assertIsNone(data['_prev'])
+
+        first_response = self.client.get(url, {'limit': 100})
+        self.assertFalse(first_response.streaming)
+        self.assertEqual(json.loads(first_response.content.decode())['_items'], data['_items'][:100])
+
+        next_content, next_data = self.get_streamed(data['_next'], {})
+        self.assertEqual(len(next_data['_items']), 50)
+        self.assertIsNone(next_data['_next'])
+
+        last_content, last_data = self.get_streamed(next_data['_prev'], {})
+        self.assertEqual(last_data['_items'], data['_items'])
+        self.assertIsNone(last_data['_prev'])
+
+    def test_streamed_empty_page(self):
+        """
+        Test that an empty streamed page is valid JSON without page links.
+        """
+
+        Point.objects.all().delete()
+        content, data = self.get_streamed(reverse('point-list'), {'limit': 200})
+
+        self.assertEqual(content, JSONRenderer().render(data))
+        self.assertEqual(data['_items'], [])
+        self.assertIsNone(data['_next'])
+
+    def test_non_streamed_formats(self):
+        """
+        Test that expanded and browsable API pages are not streamed.
+        """
+
+        url = reverse('point-list')
+
+        expanded_response = self.client.get(url, {'limit': 200, 'expand': 'creator'})
+        self.assertFalse(expanded_response.streaming)
+        self.assertEqual(len(expanded_response.data['_items']), 200)
+
+        browsable_response = self.client.get(url, {'limit': 200}, HTTP_ACCEPT='text/html')
+        self.assertFalse(browsable_response.streaming)
+
+    def test_invalid_cursor(self):
+        """
+        Test that a malformed cursor on a streamed page gives a 404.
+        """
+
+        response = self.client.get(reverse('point-list'), {'limit': 200, 'cursor': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_geojson_export(self):
+        """
+        Test that the points are exported as a streamed GeoJSON feature collection.
+        Checks:
+            - the response is a streamed FeatureCollection of every point
+            - the features have the location, creator username and tag names of the points
+            - the export is filtered with the same bbox as the point list
+            - the points are read in chunks with one tag query per chunk of tagged points
+            - the _url links of the features are valid (accessible with a GET request)
+        """
+
+        point = Point.objects.filter(latitude=3, longitude=3).order_by('id').first()
+        Tag.objects.create(name='b', point=point, creator=point.creator)
+        Tag.objects.create(name='a', point=point, creator=point.creator)
+
+        url = reverse('point-export', kwargs={'format': 'geojson'})
+        self.assertEqual(url, '/points/export.geojson')
+
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.streaming)
+            self.assertEqual(response['Content-Type'], 'application/geo+json')
+            data = json.loads(b''.join(response.streaming_content).decode())
+
+        self.assertEqual(data['type'], 'FeatureCollection')
+        self.assertEqual(len(data['features']), 250)
+        feature = next(feature for feature in data['features'] if feature['id'] == point.id)
+        self.assertEqual(feature['geometry'], {'type': 'Point', 'coordinates': [3.0, 3.0]})
+        self.assertEqual(feature['properties']['creator'], 'tester')
+        self.assertEqual(feature['properties']['tags'], ['a', 'b'])
+        self.assertEqual(self.client.get(feature['properties']['_url']).data['name'], point.name)
+
+        bbox_response = self.client.get(url, {'bbox': '0,0,2.5,2.5'})
+        bbox_data = json.loads(b''.join(bbox_response.streaming_content).decode())
+        self.assertEqual(sorted(feature['geometry']['coordinates'][1] for feature in bbox_data['features']),
+                         [0.0, 0.0, 1.0, 1.0, 2.0, 2.0])
+
+        chunks = list(iterate_feature_chunks(Point.objects.order_by('id'), '{}', chunk_size=100))
+        self.assertEqual([len(chunk) for chunk in chunks], [100, 100, 50])
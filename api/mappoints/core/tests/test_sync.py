@@ -0,0 +1,222 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db.models import QuerySet
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from mappoints.core import sync
+from mappoints.core.models import User, Point, Comment, Tag, Star, Tombstone, TombstoneManager, Version, VersionManager
+from mappoints.core.sync import encode_sync_token
+from mappoints.core.tests import utils
+
+class SyncTest(APITestCase):
+    """
+    Test the delta sync of the points, comments, tags and stars.
+    """
+
+    def setUp(self):
+        self.user = User(username='tester', location='Test')
+        self.user.set_password('tester')
+        self.user.save()
+        self.points = []
+        for i in range(3):
+            point = Point.objects.create(name='test {}'.format(i), latitude=i, longitude=i, creator=self.user)
+            Comment.objects.create(content='comment {}'.format(i), point=point, creator=self.user)
+            Tag.objects.create(name='tag {}'.format(i), point=point, creator=self.user)
+            Star.objects.create(point=point, creator=self.user)
+            self.points.append(point)
+
+        patcher = mock.patch.object(sync, 'SYNC_LAG', timedelta(0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_sync(self, token=None):
+        """
+        Sync with a token and return the response data.
+        """
+
+        response = self.client.get(reverse('sync'), {'since': token} if token else {})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_sync(self):
+        """
+        Test a full sync followed by incremental syncs.
+        Checks:
+            - a full sync returns every instance in the representation of its collection
+            - an incremental sync returns only the instances changed since the token
+            - deletions (also cascaded and bulk ones) are returned as ids under 'deleted'
+            - a sync without changes returns nothing
+        """
+
+        data = self.get_sync()
+        self.assertEqual(list(data.keys()),
+                         ['points', 'comments', 'tags', 'stars', 'deleted', 'token', 'more', '_url', '_parent'])
+        self.assertEqual(data['points'], self.client.get(reverse('point-list')).data['_items'])
+        point = self.points[0]
+        self.assertEqual(data['comments'][:1], self.client.get(reverse('point-comment-list', args=[point.id])).data['_items'])
+        self.assertEqual([len(data[name]) for name in ('comments', 'tags', 'stars')], [3, 3, 3])
+        self.assertEqual(data['deleted'], {'points': [], 'comments': [], 'tags': [], 'stars': []})
+        self.assertFalse(data['more'])
+
+        Point.objects.filter(pk=point.pk).update(name='changed')
+        comment = Comment.objects.create(content='new', point=self.points[1], creator=self.user)
+        tag_id = point.tags.get().id
+        point.tags.get().delete()
+        star = self.points[2].stars.get()
+        self.client.credentials(HTTP_AUTHORIZATION=utils.get_basic_auth_header('tester:tester'))
+        response = self.client.post(reverse('user-star-bulk', args=[self.user.id]),
+                                    [{'op': 'remove', 'point': self.points[2].id}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.credentials()
+
+        changes = self.get_sync(data['token'])
+        self.assertEqual(sorted(p['id'] for p in changes['points']), [point.id, self.points[1].id, self.points[2].id])
+        self.assertEqual([c['id'] for c in changes['comments']], [comment.id])
+        self.assertEqual((changes['tags'], changes['stars']), ([], []))
+        self.assertEqual(changes['deleted'], {'points': [], 'comments': [], 'tags': [tag_id], 'stars': [star.id]})
+
+        point_id = point.id
+        children = [point.comments.get().id, point.stars.get().id]
+        point.delete()
+        deletions = self.get_sync(changes['token'])
+        self.assertEqual(deletions['points'], [])
+        self.assertEqual(deletions['deleted']['points'], [point_id])
+        self.assertEqual([deletions['deleted']['comments'], deletions['deleted']['stars']], [children[:1], children[1:]])
+
+        unchanged = self.get_sync(deletions['token'])
+        self.assertEqual([unchanged[name] for name in ('points', 'comments', 'tags', 'stars')], [[], [], [], []])
+        self.assertFalse(any(unchanged['deleted'].values()))
+
+    def test_sync_pages(self):
+        """
+        Test that the changes are returned a limited number at a time.
+        Checks:
+            - 'more' is true until every change has been returned
+            - every instance is returned once while the changes are paged
+        """
+
+        for i in range(2):
+            Point.objects.create(name='extra {}'.format(i), latitude=5, longitude=5, creator=self.user)
+        Tombstone.objects.record('comment', range(100, 105))
+
+        with mock.patch.object(sync, 'SYNC_LIMIT', 2):
+            pages = [self.get_sync()]
+            while pages[-1]['more']:
+                pages.append(self.get_sync(pages[-1]['token']))
+
+            self.assertEqual(len(pages), 3)
+            self.assertEqual(sorted(p['id'] for page in pages for p in page['points']),
+                             sorted(Point.objects.values_list('id', flat=True)))
+
+            token = encode_sync_token({name: (timezone.now() - timedelta(hours=1), 0)
+                                       for name in ('points', 'comments', 'tags', 'stars', 'deleted')})
+            deletions = [self.get_sync(token)]
+            while deletions[-1]['more']:
+                deletions.append(self.get_sync(deletions[-1]['token']))
+            self.assertEqual([pk for page in deletions for pk in page['deleted']['comments']], list(range(100, 105)))
+
+    def test_sync_queries(self):
+        """
+        Test that an incremental sync takes a constant number of queries.
+        Checks:
+            - a sync without changes takes one query per collection and one for the deletions
+        """
+
+        token = self.get_sync()['token']
+        with self.assertNumQueries(5):
+            self.get_sync(token)
+
+    def test_sync_token(self):
+        """
+        Test the validation of the sync tokens and the pruning of the tombstones.
+        Checks:
+            - a malformed token gives a 400
+            - a token older than the tombstone retention gives a 410
+            - the prune_tombstones command deletes the tombstones older than the retention
+        """
+
+        for token in ['invalid', encode_sync_token({'points': (timezone.now(), 0)})]:
+            response = self.client.get(reverse('sync'), {'since': token})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        old = timezone.now() - sync.TOMBSTONE_RETENTION - timedelta(days=1)
+        token = encode_sync_token({name: (old, 0) for name in ('points', 'comments', 'tags', 'stars', 'deleted')})
+        response = self.client.get(reverse('sync'), {'since': token})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+        self.points[0].delete()
+        Tombstone.objects.filter(model='point').update(deleted=old)
+        stdout = StringIO()
+        call_command('prune_tombstones', stdout=stdout)
+        self.assertIn('Deleted 1 tombstone(s).', stdout.getvalue())
+        self.assertEqual(sorted(Tombstone.objects.values_list('model', flat=True)), ['comment', 'star', 'tag'])
+
+    def test_sync_cascade(self):
+        """
+        Test that the deletions of a cascade are recorded in one batch.
+        Checks:
+            - deleting a user records the tombstones of each model with a single insert
+              and changes the version of each model once
+            - every deleted instance has a tombstone
+        """
+
+        ids = {name: sorted(model.objects.values_list('id', flat=True))
+               for name, model in [('point', Point), ('comment', Comment), ('tag', Tag), ('star', Star)]}
+        with mock.patch.object(TombstoneManager, 'record', autospec=True, side_effect=TombstoneManager.record) as record:
+            with mock.patch.object(VersionManager, 'bump', autospec=True, side_effect=VersionManager.bump) as bump:
+                self.user.delete()
+
+        self.assertEqual(sorted(call[0][1] for call in record.call_args_list), sorted(ids))
+        self.assertEqual(sorted(call[0][1] for call in bump.call_args_list), sorted(list(ids) + ['user']))
+        for name, pks in ids.items():
+            self.assertEqual(sorted(Tombstone.objects.filter(model=name).values_list('instance_id', flat=True)), pks)
+
+    def test_version_race(self):
+        """
+        Test that concurrent first changes of a model all change its version.
+        Checks:
+            - a first change that finds the version inserted by a concurrent one updates it
+        """
+
+        update = QuerySet.update
+
+        def concurrent_update(queryset, **kwargs):
+            # A concurrent first change inserts the version after this one found none to update.
+            if not Version.objects.filter(name='race').exists():
+                Version.objects.create(name='race', value=1)
+                return 0
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=concurrent_update):
+            Version.objects.bump('race')
+            utils.run_commit_hooks()
+        self.assertEqual(Version.objects.get(name='race').value, 2)
+
+    def test_version_commit(self):
+        """
+        Test that the versions are changed once per model when the transaction of the changes commits.
+        Checks:
+            - no version is changed before the commit
+            - the commit changes each changed version with a single update
+            - a comment, tag or star does not change the version of the points
+        """
+
+        utils.run_commit_hooks()
+        versions = dict(Version.objects.values_list('name', 'value'))
+        point = self.points[0]
+        with self.assertNumQueries(8):
+            Comment.objects.create(content='first', point=point, creator=self.user)
+            Comment.objects.create(content='second', point=point, creator=self.user)
+            Star.objects.filter(point=point).delete()
+        self.assertEqual(dict(Version.objects.values_list('name', 'value')), versions)
+
+        with self.assertNumQueries(2):
+            utils.run_commit_hooks()
+        changed = dict(Version.objects.values_list('name', 'value'))
+        self.assertEqual(changed, dict(versions, comment=versions['comment'] + 1, star=versions['star'] + 1))
@@ -180,3 +180,59 @@ class TagTest(APITestCase):
 
         not_found_response = self.client.delete(url)
         self.assertEqual(not_found_response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_tag_bulk(self):
+        """
+        Test that many tags of a point can be added and removed at once.
+        Checks:
+            - trying to change the tags without authentication gives a 401
+            - trying to change the tags of a point as a different user gives a 403
+            - trying to change the tags of a non-existent point gives a 404
+            - the results of the operations are in the order of the operations
+            - the _url links of the created tags are valid (accessible with a GET request)
+            - the tag count of the point is kept consistent
+        """
+
+        user = User(username='tester', location='Test')
+        user.set_password('tester')
+        user.save()
+        user2 = User(username='tester2', location='Test')
+        user2.set_password('tester2')
+        user2.save()
+        point = Point.objects.create(name='test', latitude=12.123, longitude=45.456, creator=user)
+        Tag.objects.create(name='hiking', creator=user, point=point)
+        Tag.objects.create(name='camping', creator=user, point=point)
+
+        url = reverse('point-tag-bulk', args=[point.id])
+        data = [
+            {'op': 'add', 'name': 'fishing'},
+            {'op': 'remove', 'name': 'hiking'},
+            {'op': 'add', 'name': 'camping'},
+            {'op': 'remove', 'name': 'swimming'},
+            {'op': 'add', 'name': ''},
+            {'op': 'add', 'name': 'climbing'},
+        ]
+
+        unauthorized_response = self.client.post(url, data, format='json')
+        self.assertEqual(unauthorized_response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.client.credentials(HTTP_AUTHORIZATION=utils.get_basic_auth_header('tester2:tester2'))
+        forbidden_response = self.client.post(url, data, format='json')
+        self.assertEqual(forbidden_response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.credentials(HTTP_AUTHORIZATION=utils.get_basic_auth_header('tester:tester'))
+        not_found_response = self.client.post(reverse('point-tag-bulk', args=[0]), data, format='json')
+        self.assertEqual(not_found_response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, 207)
+        items = response.data['_items']
+        self.assertEqual([item['status'] for item in items], [201, 204, 409, 404, 400, 201])
+        self.assertTrue(utils.check_url_get(self.client, items[5]))
+
+        point.refresh_from_db()
+        self.assertEqual(sorted(point.tags.values_list('name', flat=True)), ['camping', 'climbing', 'fishing'])
+        self.assertEqual(point.tag_count, 3)
+
+        invalid_response = self.client.post(url, {'op': 'add', 'name': 'test'}, format='json')
+        self.assertEqual(invalid_response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,125 @@
+from django.db.models import F
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from mappoints.core.models import User, Point
+from mappoints.core.tiles import get_tile, get_tile_bbox, get_tile_cache
+from mappoints.core.tests import utils
+
+class TileTest(APITestCase):
+    """
+    Test the web mercator tiles of the points and their cache.
+    """
+
+    def setUp(self):
+        get_tile_cache().clear()
+        self.user = User.objects.create(username='tester', password='tester', location='Test')
+        self.helsinki = Point.objects.create(name='helsinki', latitude=60.1699, longitude=24.9384, creator=self.user)
+        self.espoo = Point.objects.create(name='espoo', latitude=60.2055, longitude=24.6559, creator=self.user)
+        self.fiji = Point.objects.create(name='fiji', latitude=-17.7134, longitude=178.0650, creator=self.user)
+        utils.run_commit_hooks()
+
+    def get_tile_url(self, latitude, longitude, zoom):
+        x, y = get_tile(latitude, longitude, zoom)
+        return reverse('tile', kwargs={'z': zoom, 'x': x, 'y': y})
+
+    def test_tile_math(self):
+        """
+        Test that a location is inside the bounding box of its tile on every zoom level.
+        """
+
+        for latitude, longitude in [(60.1699, 24.9384), (-17.7134, 178.065), (0, 0), (-85, -180)]:
+            for zoom in range(21):
+                min_lon, min_lat, max_lon, max_lat = get_tile_bbox(zoom, *get_tile(latitude, longitude, zoom))
+                self.assertTrue(min_lon <= longitude <= max_lon)
+                self.assertTrue(min_lat <= latitude <= max_lat)
+
+        self.assertIsNone(get_tile(89, 0, 3))
+
+    def test_tile_points(self):
+        """
+        Test that the points of a tile can be retrieved.
+        Checks:
+            - valid GET response status is 200
+            - high zoom tiles list the points inside the tile only
+            - low zoom tiles aggregate the points into clusters
+            - point _url links are valid (accessible with a GET request)
+            - tiles out of range give a 404
+        """
+
+        response = self.client.get(self.get_tile_url(60.1699, 24.9384, 12))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['name'] for item in response.data['_items']], ['helsinki'])
+        self.assertEqual(response.data['_items'][0]['latitude'], '60.169900')
+        self.assertTrue(utils.check_url_get(self.client, response.data['_items'][0]))
+
+        cluster_response = self.client.get(reverse('tile', kwargs={'z': 2, 'x': 2, 'y': 1}))
+        self.assertEqual([cluster['count'] for cluster in cluster_response.data['_items']], [2])
+
+        for z, x, y in [(21, 0, 0), (2, 4, 0), (2, 0, 4)]:
+            invalid_response = self.client.get(reverse('tile', kwargs={'z': z, 'x': x, 'y': y}))
+            self.assertEqual(invalid_response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_tile_cache(self):
+        """
+        Test that rendered tiles are cached and only the tiles containing a changed point are invalidated.
+        Checks:
+            - a cached tile is returned without database queries
+            - creating, moving and deleting a point updates the tiles of its old and new location
+            - the tiles of other locations stay cached
+        """
+
+        helsinki_url = self.get_tile_url(60.1699, 24.9384, 10)
+        fiji_url = self.get_tile_url(-17.7134, 178.0650, 10)
+        self.client.get(helsinki_url)
+        self.client.get(fiji_url)
+
+        with self.assertNumQueries(0):
+            self.assertEqual([item['name'] for item in self.client.get(helsinki_url).data['_items']], ['helsinki', 'espoo'])
+
+        vantaa = Point.objects.create(name='vantaa', latitude=60.17, longitude=24.94, creator=self.user)
+        utils.run_commit_hooks()
+        self.assertEqual([item['name'] for item in self.client.get(helsinki_url).data['_items']], ['helsinki', 'espoo', 'vantaa'])
+        with self.assertNumQueries(0):
+            self.assertEqual([item['name'] for item in self.client.get(fiji_url).data['_items']], ['fiji'])
+
+        vantaa = Point.objects.get(id=vantaa.id)
+        vantaa.latitude = -17.71
+        vantaa.longitude = 178.06
+        vantaa.save()
+        utils.run_commit_hooks()
+        self.assertEqual([item['name'] for item in self.client.get(helsinki_url).data['_items']], ['helsinki', 'espoo'])
+        self.assertEqual([item['name'] for item in self.client.get(fiji_url).data['_items']], ['fiji', 'vantaa'])
+
+        self.fiji.delete()
+        utils.run_commit_hooks()
+        self.assertEqual([item['name'] for item in self.client.get(fiji_url).data['_items']], ['vantaa'])
+
+        Point.objects.filter(id=vantaa.id).update(latitude=60.171, longitude=F('longitude') - 153.12)
+        utils.run_commit_hooks()
+        self.assertEqual([item['name'] for item in self.client.get(helsinki_url).data['_items']], ['helsinki', 'espoo', 'vantaa'])
+
+    def test_tile_cache_commit(self):
+        """
+        Test that the tiles are invalidated when the transaction of a change commits.
+        Checks:
+            - a tile cached before the change is served until the commit and not after it,
+              for both a saved point and a bulk update
+        """
+
+        helsinki_url = self.get_tile_url(60.1699, 24.9384, 10)
+        changes = [
+            (lambda: Point.objects.create(name='vantaa', latitude=60.17, longitude=24.94, creator=self.user),
+             ['helsinki', 'espoo', 'vantaa']),
+            (lambda: Point.objects.filter(name='vantaa').update(latitude=-17.71, longitude=178.06),
+             ['helsinki', 'espoo']),
+        ]
+        for change, expected in changes:
+            cached = [item['name'] for item in self.client.get(helsinki_url).data['_items']]
+            change()
+            self.assertEqual([item['name'] for item in self.client.get(helsinki_url).data['_items']], cached)
+
+            utils.run_commit_hooks()
+            self.assertEqual([item['name'] for item in self.client.get(helsinki_url).data['_items']], expected)
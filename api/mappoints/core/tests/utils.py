@@ -1,5 +1,7 @@
 from base64 import b64encode
 
+from django.db import DEFAULT_DB_ALIAS, connections
+
 def check_url_get(client, body, status=200):
     """
     Check that the url contained in the _url attribute
@@ -84,3 +86,19 @@ def get_basic_auth_header(data):
     """
 
     return 'Basic {}'.format(b64encode(str.encode(data)).decode())
+
+def run_commit_hooks(using=DEFAULT_DB_ALIAS):
+    """
+    Run the functions registered with transaction.on_commit as if the
+    transaction of the test case committed. The functions registered
+    meanwhile by the hooks are run as well.
+
+    Parameters:
+    - using: alias of the database connection (default: 'default')
+    """
+
+    connection = connections[using]
+    while connection.run_on_commit:
+        callbacks, connection.run_on_commit = connection.run_on_commit, []
+        for _, callback in callbacks:
+            callback()
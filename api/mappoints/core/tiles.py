@@ -0,0 +1,216 @@
+import time
+from math import atan, sinh, degrees, radians, log, tan, cos, pi
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Q
+from django.urls import reverse
+from rest_framework import serializers
+
+from mappoints.core.spatial import MAX_ZOOM, get_clusters
+
+MAX_LATITUDE = 85.05112878
+TILE_POINT_ZOOM = 10
+MAX_TILE_POINTS = 500
+MAX_INVALIDATED_LOCATIONS = 100
+TILE_GENERATION_KEY = 'tiles:generation'
+
+coordinate_field = serializers.DecimalField(max_digits=9, decimal_places=6)
+
+def get_tile_cache():
+    """
+    Get the file-backed cache of the rendered tiles.
+    """
+
+    return caches['tiles']
+
+def get_tile_bbox(zoom, x, y):
+    """
+    Get the bounding box of a web mercator tile.
+
+    Parameters:
+        - zoom, x, y: the tile coordinates
+
+    Returns:
+        - tuple of (min_lon, min_lat, max_lon, max_lat)
+    """
+
+    count = 1 << zoom
+    min_lon = x / count * 360 - 180
+    max_lon = (x + 1) / count * 360 - 180
+    max_lat = degrees(atan(sinh(pi * (1 - 2 * y / count))))
+    min_lat = degrees(atan(sinh(pi * (1 - 2 * (y + 1) / count))))
+    return min_lon, min_lat, max_lon, max_lat
+
+def get_tile(latitude, longitude, zoom):
+    """
+    Get the web mercator tile containing a location at a zoom level.
+
+    Parameters:
+        - latitude, longitude: the location in degrees
+        - zoom: the zoom level
+
+    Returns:
+        - tuple of (x, y), or None if the location is beyond the latitudes covered by the tiles
+    """
+
+    latitude = float(latitude)
+    if abs(latitude) > MAX_LATITUDE:
+        return None
+
+    count = 1 << zoom
+    x = int((float(longitude) + 180) / 360 * count)
+    y = int((1 - log(tan(radians(latitude)) + 1 / cos(radians(latitude))) / pi) / 2 * count)
+    return min(max(x, 0), count - 1), min(max(y, 0), count - 1)
+
+def get_tile_filter(zoom, x, y):
+    """
+    Build a filter selecting the points inside a tile.
+
+    The western and southern edges are included and the eastern and northern
+    edges excluded (except at the edges of the map), so every point belongs
+    to a single tile of a zoom level.
+    """
+
+    count = 1 << zoom
+    min_lon, min_lat, max_lon, max_lat = get_tile_bbox(zoom, x, y)
+
+    condition = Q(latitude__gte=min_lat, longitude__gte=min_lon)
+    condition &= Q(latitude__lte=max_lat) if y == 0 else Q(latitude__lt=max_lat)
+    condition &= Q(longitude__lte=max_lon) if x == count - 1 else Q(longitude__lt=max_lon)
+    return condition
+
+def render_tile(queryset, zoom, x, y):
+    """
+    Render the contents of a tile.
+
+    Below TILE_POINT_ZOOM, and when a tile has more than MAX_TILE_POINTS points,
+    the points are aggregated into clusters like in get_clusters. Otherwise the
+    tile lists the points with their '_url', 'id', 'name', 'latitude' and 'longitude'.
+
+    The '_url' of the points are paths, so the rendered tile does not depend
+    on the host it is requested from.
+
+    Parameters:
+        - queryset: the Point queryset to render
+        - zoom, x, y: the tile coordinates
+
+    Returns:
+        - list of clusters or points
+    """
+
+    queryset = queryset.filter(get_tile_filter(zoom, x, y))
+
+    if zoom >= TILE_POINT_ZOOM:
+        rows = list(queryset.order_by('id').values('id', 'name', 'latitude', 'longitude')[:MAX_TILE_POINTS + 1])
+        if len(rows) <= MAX_TILE_POINTS:
+            url = reverse('point-detail', kwargs={'pk': '~pk~'}).replace('~pk~', '{}')
+            return [
+                {
+                    '_url': url.format(row['id']),
+                    'id': row['id'],
+                    'name': row['name'],
+                    'latitude': coordinate_field.to_representation(row['latitude']),
+                    'longitude': coordinate_field.to_representation(row['longitude']),
+                }
+                for row in rows
+            ]
+
+    return get_clusters(queryset, *get_tile_bbox(zoom, x, y), zoom)
+
+def get_tile_generation():
+    """
+    Get the generation of the tile cache, which is part of the keys of the cached tiles.
+    A missing generation is initialized from the clock so that it never returns to a previous value.
+    """
+
+    cache = get_tile_cache()
+    generation = cache.get(TILE_GENERATION_KEY)
+    if generation is None:
+        cache.add(TILE_GENERATION_KEY, int(time.time() * 1000), None)
+        generation = cache.get(TILE_GENERATION_KEY)
+    return generation
+
+def get_tile_key(generation, zoom, x, y):
+    """
+    Get the cache key of a rendered tile.
+    """
+
+    return 'tile:{}:{}:{}:{}'.format(generation, zoom, x, y)
+
+def get_cached_tile(queryset, zoom, x, y):
+    """
+    Get the contents of a tile from the tile cache, rendering and caching it if it is missing.
+
+    Parameters:
+        - queryset: the Point queryset to render
+        - zoom, x, y: the tile coordinates
+
+    Returns:
+        - list of clusters or points as given by render_tile
+    """
+
+    cache = get_tile_cache()
+    key = get_tile_key(get_tile_generation(), zoom, x, y)
+
+    tile = cache.get(key)
+    if tile is None:
+        tile = render_tile(queryset, zoom, x, y)
+        cache.set(key, tile)
+    return tile
+
+def get_location_tile_keys(locations):
+    """
+    Get the cache keys of the tiles containing any of the given locations on every zoom level.
+    """
+
+    keys = set()
+    generation = get_tile_generation()
+    for latitude, longitude in locations:
+        for zoom in range(MAX_ZOOM + 1):
+            tile = get_tile(latitude, longitude, zoom)
+            if tile is not None:
+                keys.add(get_tile_key(generation, zoom, *tile))
+    return keys
+
+def invalidate_tiles(locations):
+    """
+    Remove the cached tiles containing any of the given locations on every zoom level.
+
+    When there are more than MAX_INVALIDATED_LOCATIONS locations, the whole tile
+    cache is invalidated instead. The tiles are removed once the current transaction
+    is committed (right away outside of a transaction), as until then the other
+    requests render them from the data before the change.
+
+    Parameters:
+        - locations: iterable of (latitude, longitude) tuples
+    """
+
+    locations = set(locations)
+    if len(locations) > MAX_INVALIDATED_LOCATIONS:
+        invalidate_all_tiles()
+        return
+    if not locations:
+        return
+
+    transaction.on_commit(lambda: get_tile_cache().delete_many(get_location_tile_keys(locations)))
+
+def start_tile_generation():
+    """
+    Start a new tile cache generation.
+    """
+
+    cache = get_tile_cache()
+    try:
+        cache.incr(TILE_GENERATION_KEY)
+    except ValueError:
+        cache.add(TILE_GENERATION_KEY, int(time.time() * 1000), None)
+
+def invalidate_all_tiles():
+    """
+    Invalidate every cached tile by starting a new tile cache generation once the
+    current transaction is committed (see invalidate_tiles). The tiles of previous
+    generations are removed by the culling of the cache.
+    """
+
+    transaction.on_commit(start_tile_generation)
@@ -0,0 +1,36 @@
+from django.core.cache import caches
+from django.db import transaction
+
+def get_token_cache():
+    """
+    Get the cache of the current token versions of the users.
+    """
+
+    return caches['tokens']
+
+def get_token_version_key(pk):
+    """
+    Get the cache key of the current token version of a user.
+    """
+
+    return 'token_version:{}'.format(pk)
+
+def invalidate_token_versions(ids):
+    """
+    Remove the cached token versions of the given users.
+
+    The versions are removed right away and once more when the current
+    transaction is committed, so that a version cached by a concurrent
+    request from the data before the commit is not kept.
+
+    Parameters:
+        - ids: iterable of user ids
+    """
+
+    keys = [get_token_version_key(pk) for pk in set(ids)]
+    if not keys:
+        return
+
+    cache = get_token_cache()
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
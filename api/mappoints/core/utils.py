@@ -53,3 +53,68 @@ def wrap_url(base_field):
             return {'_url': rep}
 
     return CustomField
+
+def get_parent_path(path):
+    """
+    Get the parent of an url path by dropping its last two segments,
+    like get_parent_url does for a full url.
+
+    Parameters:
+        - path: the url path string without query parameters and fragments.
+
+    Returns:
+        - parent url path string ending with a slash.
+    """
+    segments = path[1:].split('/') if path else []
+    return '/' + '/'.join(segments[:-2] + [''])
+
+class LinkBuilder:
+    """
+    Build '_url' and '_parent' links for a single request by string concatenation.
+
+    The request url is parsed and normalized only once, after which links
+    for every serialized instance are derived from its scheme and host prefix
+    and its path, giving the same result as get_url and get_parent_url.
+    """
+
+    def __init__(self, request):
+        url = get_url(request.build_absolute_uri())
+        path_start = url.find('/', url.find('://') + 3)
+        if path_start == -1:
+            path_start = len(url)
+
+        self.prefix = url[:path_start]
+        self.path = url[path_start:]
+        self.url = url
+        self.parent_url = self.prefix + get_parent_path(self.path)
+
+    def get_url(self, path):
+        """
+        Get the absolute url of a path on the same host as the request.
+        """
+        return self.prefix + path
+
+    def get_parent_url(self, url):
+        """
+        Get the parent url of an absolute url. Urls that are not on the request's
+        host or that contain query parameters or fragments fall back to get_parent_url.
+        """
+        if url.startswith(self.prefix + '/') and '?' not in url and '#' not in url:
+            return self.prefix + get_parent_path(url[len(self.prefix):])
+        return get_parent_url(url)
+
+def get_link_builder(request):
+    """
+    Get the LinkBuilder of a request, creating it on first use.
+
+    Parameters:
+        - request: the request the links are built for.
+
+    Returns:
+        - LinkBuilder shared by every serializer and response of the request.
+    """
+    builder = getattr(request, '_link_builder', None)
+    if builder is None:
+        builder = LinkBuilder(request)
+        request._link_builder = builder
+    return builder
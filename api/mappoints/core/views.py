@@ -1,9 +1,19 @@
+from itertools import chain
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.http import Http404
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from rest_framework import viewsets, mixins, permissions
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, APIException, ParseError
+from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.exceptions import PermissionDenied
+from rest_framework.renderers import JSONRenderer
 
-from mappoints.core.models import User, Point, Comment, Star, Tag
+from mappoints.core.models import User, Point, Comment, Star, Tag, Version
 from mappoints.core.serializers import (UserSerializer,
                                         PointSerializer,
                                         CommentSerializer,
@@ -12,10 +22,229 @@ from mappoints.core.serializers import (UserSerializer,
 from mappoints.core.permissions import (IsCreator,
                                         IsSelf,
                                         ActionPermission)
-from mappoints.core.responses import LinkedCollectionResponse, LinkedInstanceResponse
+from mappoints.core.responses import (LinkedCollectionResponse,
+                                      LinkedInstanceResponse,
+                                      StreamingFeatureCollectionResponse,
+                                      StreamingLinkedCollectionResponse)
+from mappoints.core.pagination import KeysetPagination, DistancePagination
+from mappoints.core.queries import plan_queryset
+from mappoints.core.compiled import get_compiled_serializer
+from mappoints.core.conditional import ConditionalGetMixin
+from mappoints.core.filters import filter_points, get_float_param, get_point_ordering, parse_bbox
+from mappoints.core.spatial import MAX_DISTANCE, MAX_ZOOM, get_clusters, get_cluster_cache_key
+from mappoints.core.tiles import get_cached_tile
+from mappoints.core.geojson import GeoJSONRenderer, iterate_feature_chunks
+from mappoints.core.bulk import MAX_BULK_POINTS, MAX_BULK_OPERATIONS, change_stars, change_tags, create_points
+from mappoints.core.sync import get_sync_data
+from mappoints.core.utils import get_link_builder
+
+CLUSTER_CACHE_TIMEOUT = 300
+
+
+class Conflict(APIException):
+    """
+    Raised when a resource conflicts with an existing resource.
+    """
+
+    status_code = 409
+    default_detail = 'The resource conflicts with an existing resource.'
+    default_code = 'conflict'
+
+def save_unique(save, exists, detail):
+    """
+    Save a resource in a savepoint, answering a violated unique constraint with a 409.
+
+    The insert (or update) is attempted right away instead of checking for a
+    duplicate first, so a save takes a single round trip and concurrent
+    duplicates are caught by the database. Only when the save fails is the
+    conflicting row looked up, to tell a duplicate apart from other integrity errors.
+
+    Parameters:
+        - save: function saving the resource
+        - exists: function telling whether a conflicting resource exists
+        - detail: the detail message of the 409 response
+
+    Errors:
+        - a conflicting resource exists (409)
+
+    Returns:
+        - the return value of save
+    """
+
+    try:
+        with transaction.atomic():
+            return save()
+    except IntegrityError:
+        if exists():
+            raise Conflict(detail)
+        raise
+
+def get_operations(request):
+    """
+    Get the list of operations of a bulk request.
+
+    Errors:
+        - the body is not a list or has more than MAX_BULK_OPERATIONS items (400)
+    """
+
+    if not isinstance(request.data, list):
+        raise ParseError('Expected a list of operations.')
+    if len(request.data) > MAX_BULK_OPERATIONS:
+        raise ParseError('At most {} operations can be applied at a time.'.format(MAX_BULK_OPERATIONS))
+    return request.data
+
+def get_bulk_response(request, results):
+    """
+    Get the response of a bulk request from the results of its operations:
+    200 if every operation succeeded, else 207.
+    """
+
+    succeeded = all(result['status'] < 400 for result in results)
+    return LinkedCollectionResponse(results, request, status=200 if succeeded else 207)
+
+def get_collection_response(request, queryset, serializer_class, ordering=None, parent=None):
+    """
+    Serialize a page of a collection into a LinkedCollectionResponse.
+
+    The default representation and sparse fieldsets are produced by the compiled serializer
+    from .values() rows of the needed columns (and the ordering columns for the cursors).
+    Requests that expand fields use the regular serializer on a queryset planned for the
+    expanded relations.
+
+    JSON pages larger than a single database chunk are streamed chunk by chunk
+    with a StreamingLinkedCollectionResponse.
+
+    Parameters:
+        - request: the request of the list action
+        - queryset: the queryset of the whole collection
+        - serializer_class: the serializer class of the collection's resources
+        - ordering: the keyset ordering of the collection (default: ('created', 'id'))
+        - parent: queryset of the parent resource of a nested collection,
+          only checked for existence when the page is empty
+
+    Errors:
+        - the parent of a nested collection does not exist (404)
+
+    Returns:
+        - LinkedCollectionResponse containing the requested page
+    """
+
+    context = {'request': request, 'action': 'list'}
+    paginator = KeysetPagination(ordering)
+    compiled = get_compiled_serializer(serializer_class, context)
+    cursor_columns = [field.lstrip('-') for field in paginator.ordering]
+
+    renderer = getattr(request, 'accepted_renderer', None)
+    streaming = (
+        compiled is not None and
+        isinstance(renderer, JSONRenderer) and
+        renderer.get_indent(request.accepted_media_type, {}) is None and
+        paginator.get_page_size(request) > paginator.chunk_size
+    )
+
+    if streaming:
+        rows = paginator.iterate_queryset(compiled.get_queryset(queryset, cursor_columns), request)
+        first = next(rows, None)
+        if first is None and parent is not None and not parent.exists():
+            raise Http404
+        rows = chain([first], rows) if first is not None else iter(())
+        items = compiled.serialize_iterator(rows, paginator.chunk_size)
+        return StreamingLinkedCollectionResponse(items, request, renderer, get_links=paginator.get_links)
+    elif compiled is not None:
+        page = paginator.paginate_queryset(compiled.get_queryset(queryset, cursor_columns), request)
+        data = compiled.serialize(page)
+    else:
+        page = paginator.paginate_queryset(plan_queryset(queryset, serializer_class, context), request)
+        data = serializer_class(page, many=True, context=context).data
+
+    if not streaming and not page and parent is not None and not parent.exists():
+        raise Http404
+
+    return LinkedCollectionResponse(data, request, links=paginator.get_links())
+
+def get_point_response(request, queryset, pk):
+    """
+    Serialize a single point into a LinkedInstanceResponse.
+
+    The default representation is rendered by the compiled serializer from the
+    point's cached representation fragment, which only costs a lookup of the
+    point's updated time while the fragment is current. A sparse fieldset is
+    rendered by the compiled serializer from the requested columns only.
 
+    Parameters:
+        - request: the request of the retrieve action
+        - queryset: the queryset the point is looked up from
+        - pk: id of the point
 
-class UserViewSet(mixins.CreateModelMixin,
+    Errors:
+        - the point does not exist in the queryset (404)
+
+    Returns:
+        - LinkedInstanceResponse containing the point
+    """
+
+    context = {'request': request, 'action': 'retrieve'}
+    compiled = get_compiled_serializer(PointSerializer, context)
+
+    if compiled is not None and compiled.fields is None:
+        fragment = compiled.get_fragment(queryset, pk)
+        if fragment is None:
+            raise Http404
+        return LinkedInstanceResponse(compiled.render([fragment])[0], request)
+    elif compiled is not None:
+        rows = list(compiled.get_queryset(queryset.filter(pk=pk)))
+        if not rows:
+            raise Http404
+        return LinkedInstanceResponse(compiled.serialize(rows)[0], request)
+
+    point = get_object_or_404(plan_queryset(queryset.filter(pk=pk), PointSerializer, context), pk=pk)
+    serializer = PointSerializer(point, context=context)
+    return LinkedInstanceResponse(serializer.data, request)
+
+
+class NestedParentMixin:
+    """
+    Look up the parent resource of a nested viewset only when an action needs it.
+
+    Retrieving, updating and deleting filter the resource by the parent's pk, so
+    a missing parent gives a 404 from the main query. Lists only check that the
+    parent exists when the page is empty. Creates (and the other parent_actions)
+    load the parent once before handling the request and keep it as self.parent.
+
+    Attributes:
+        - parent_model: the model of the parent resource
+        - parent_lookup: the url keyword argument holding the parent's pk
+        - parent_field: the field of the nested resource pointing to its parent
+        - parent_actions: the actions that load the parent
+    """
+
+    parent_model = None
+    parent_lookup = None
+    parent_field = None
+    parent_actions = ('create',)
+
+    def initial(self, request, *args, **kwargs):
+        """
+        Load the parent of a create, or give a 404 if it does not exist.
+        """
+
+        self.parent = None
+        if self.action in self.parent_actions:
+            self.parent = get_object_or_404(self.parent_model.objects.all(), pk=kwargs[self.parent_lookup])
+        return super().initial(request, *args, **kwargs)
+
+    def get_queryset(self):
+        return super().get_queryset().filter(**{self.parent_field: self.kwargs[self.parent_lookup]})
+
+    def get_parent_queryset(self):
+        """
+        Get a queryset of the parent, for telling an empty collection apart from a missing parent.
+        """
+
+        return self.parent_model.objects.filter(pk=self.kwargs[self.parent_lookup])
+
+class UserViewSet(ConditionalGetMixin,
+                  mixins.CreateModelMixin,
                   mixins.ListModelMixin,
                   mixins.RetrieveModelMixin,
                   mixins.UpdateModelMixin,
@@ -33,20 +262,23 @@ class UserViewSet(mixins.CreateModelMixin,
     permission_classes = (ActionPermission,)
     action_permissions = {
         permissions.AllowAny: ['list', 'retrieve', 'create'],
-        IsSelf: ['update', 'destroy'],
+        IsSelf: ['update', 'destroy', 'revoke_tokens'],
     }
 
     def list(self, request):
         """
         Get all users.
 
+        Query parameters:
+            - cursor: opaque cursor from the '_next' or '_prev' link of a previous page.
+            - limit: maximum number of users per page.
+
         Returns:
-            - list of all users.
+            - page of users ordered by creation time.
         """
 
         queryset = User.objects.all()
-        serializer = UserSerializer(queryset, many=True, context={'request': request, 'action': 'list'})
-        return LinkedCollectionResponse(serializer.data, request)
+        return get_collection_response(request, queryset, UserSerializer)
 
     def retrieve(self, request, pk=None):
         """
@@ -59,15 +291,19 @@ class UserViewSet(mixins.CreateModelMixin,
             - single user object.
         """
 
-        queryset = User.objects.filter()
+        context = {'request': request, 'action': 'retrieve'}
+        queryset = plan_queryset(User.objects.filter(), UserSerializer, context)
         user = get_object_or_404(queryset, pk=pk)
-        serializer = UserSerializer(user, context={'request': request, 'action': 'retrieve'})
+        serializer = UserSerializer(user, context=context)
         return LinkedInstanceResponse(serializer.data, request)
 
     def update(self, request, *args, **kwargs):
         """
         Update a single user's details.
 
+        Errors:
+            - a user with the same username already exists (409)
+
         Returns:
             - updated user object.
         """
@@ -86,35 +322,61 @@ class UserViewSet(mixins.CreateModelMixin,
             - created user object.
         """
 
-        try:
-            user = User.objects.get(username=request.data.get('username'))
-            if user:
-                return Response({'detail': 'A user with this username already exists.'}, status=409)
-        except User.DoesNotExist:
-            pass
-
         response = super().create(request, *args, **kwargs)
         return LinkedInstanceResponse(response.data, request, status=201)
 
-class UserPointViewSet(viewsets.ViewSet):
-    """
-    Handle read actions for a Point resource under a User.
+    def perform_create(self, serializer):
+        """
+        Create the user, answering a taken username with a 409.
+        """
 
-    URLs: /users/:user_id/points/, /users/:user_id/points/:point_id
-    """
+        self.save_user(serializer)
 
-    serializer_class = PointSerializer
+    def perform_update(self, serializer):
+        """
+        Update the user, answering a taken username with a 409.
+        """
 
-    def initial(self, request, *args, **kwargs):
+        self.save_user(serializer)
+
+    def save_user(self, serializer):
         """
-        Ensure that the specified user exists before handling any actions.
+        Save a user with a single write, answering a taken username with a 409.
+        """
+
+        username = serializer.validated_data.get('username')
+        save_unique(
+            serializer.save,
+            lambda: User.objects.filter(username=username).exclude(pk=getattr(serializer.instance, 'pk', None)).exists(),
+            'A user with this username already exists.'
+        )
+
+    @action(detail=True, methods=['post'], url_path='revoke-tokens')
+    def revoke_tokens(self, request, pk=None):
+        """
+        Revoke every JWT token issued to a user so far.
 
         Path parameters:
-            - user_pk: id of the user whose points are of interest.
+            - pk: id of the user.
+
+        Returns:
+            - empty response (204).
         """
 
-        get_object_or_404(User.objects.all(), pk=kwargs['user_pk'])
-        return super().initial(request, args, kwargs)
+        self.get_object().revoke_tokens()
+        return Response(status=204)
+
+class UserPointViewSet(NestedParentMixin, ConditionalGetMixin, viewsets.ViewSet):
+    """
+    Handle read actions for a Point resource under a User.
+
+    URLs: /users/:user_id/points/, /users/:user_id/points/:point_id
+    """
+
+    serializer_class = PointSerializer
+    parent_model = User
+    parent_lookup = 'user_pk'
+    parent_field = 'creator'
 
     def list(self, request, user_pk=None):
         """
@@ -123,13 +385,17 @@ class UserPointViewSet(viewsets.ViewSet):
         Path parameters:
             - user_pk: id of the user whose points are retrieved.
 
+        Query parameters:
+            - cursor: opaque cursor from the '_next' or '_prev' link of a previous page.
+            - limit: maximum number of points per page.
+            - bbox: only include points inside the bounding box 'minLon,minLat,maxLon,maxLat'.
+
         Returns:
-            - list of all points of a user.
+            - page of points of a user ordered by creation time.
         """
 
-        queryset = Point.objects.filter(creator=user_pk)
-        serializer = PointSerializer(queryset, many=True, context={'request': request, 'action': 'list'})
-        return LinkedCollectionResponse(serializer.data, request)
+        queryset = filter_points(Point.objects.filter(creator=user_pk), request)
+        return get_collection_response(request, queryset, PointSerializer, parent=self.get_parent_queryset())
 
     def retrieve(self, request, pk=None, user_pk=None):
         """
@@ -143,30 +409,21 @@ class UserPointViewSet(viewsets.ViewSet):
             - single point object of the specified user.
         """
 
-        queryset = Point.objects.filter(pk=pk, creator=user_pk)
-        point = get_object_or_404(queryset, pk=pk)
-        serializer = PointSerializer(point, context={'request': request, 'action': 'retrieve'})
-        return LinkedInstanceResponse(serializer.data, request)
+        return get_point_response(request, Point.objects.filter(creator=user_pk), pk)
 
-class UserCommentViewSet(viewsets.ViewSet):
+class UserCommentViewSet(NestedParentMixin, ConditionalGetMixin, viewsets.ViewSet):
     """
     Handle read actions for a Comment resource under a User.
 
     URLs: /users/:user_id/comments/, /users/:user_id/comments/:comment_id
     """
 
-    serializer_class = CommentSerializer
-
-    def initial(self, request, *args, **kwargs):
-        """
-        Ensure that the specified user exists before handling any actions.
-
-        Path parameters:
-            - user_pk: id of the user whose comments are of interest.
-        """
+    version_names = ('user', 'comment')
 
-        get_object_or_404(User.objects.all(), pk=kwargs['user_pk'])
-        return super().initial(request, args, kwargs)
+    serializer_class = CommentSerializer
+    parent_model = User
+    parent_lookup = 'user_pk'
+    parent_field = 'creator'
 
     def list(self, request, user_pk=None):
         """
@@ -175,13 +432,16 @@ class UserCommentViewSet(viewsets.ViewSet):
         Path parameters:
             - user_pk: id of the user whose comments are retrieved.
 
+        Query parameters:
+            - cursor: opaque cursor from the '_next' or '_prev' link of a previous page.
+            - limit: maximum number of comments per page.
+
         Returns:
-            - list of all comments of a user.
+            - page of comments of a user ordered by creation time.
         """
 
         queryset = Comment.objects.filter(creator=user_pk)
-        serializer = CommentSerializer(queryset, many=True, context={'request': request, 'action': 'list'})
-        return LinkedCollectionResponse(serializer.data, request)
+        return get_collection_response(request, queryset, CommentSerializer, parent=self.get_parent_queryset())
 
     def retrieve(self, request, pk=None, user_pk=None):
         """
@@ -195,30 +455,25 @@ class UserCommentViewSet(viewsets.ViewSet):
             - single comment object of the specified user.
         """
 
-        queryset = Comment.objects.filter(pk=pk, creator=user_pk)
+        context = {'request': request, 'action': 'retrieve'}
+        queryset = plan_queryset(Comment.objects.filter(pk=pk, creator=user_pk), CommentSerializer, context)
         comment = get_object_or_404(queryset, pk=pk)
-        serializer = CommentSerializer(comment, context={'request': request, 'action': 'retrieve'})
+        serializer = CommentSerializer(comment, context=context)
         return LinkedInstanceResponse(serializer.data, request)
 
-class UserStarViewSet(viewsets.ViewSet):
+class UserStarViewSet(NestedParentMixin, ConditionalGetMixin, viewsets.ViewSet):
     """
     Handle read actions for a Star resource under a User.
 
     URLs: /users/:user_id/stars/, /users/:user_id/stars/:star_id
     """
 
-    serializer_class = StarSerializer
-
-    def initial(self, request, *args, **kwargs):
-        """
-        Ensure that the specified user exists before handling any actions.
-
-        Path parameters:
-            - user_pk: id of the user whose stars are of interest.
-        """
+    version_names = ('user', 'star')
 
-        get_object_or_404(User.objects.all(), pk=kwargs['user_pk'])
-        return super().initial(request, args, kwargs)
+    serializer_class = StarSerializer
+    parent_model = User
+    parent_lookup = 'user_pk'
+    parent_field = 'creator'
 
     def list(self, request, user_pk=None):
         """
@@ -227,13 +482,16 @@ class UserStarViewSet(viewsets.ViewSet):
         Path parameters:
             - user_pk: id of the user whose stars are retrieved.
 
+        Query parameters:
+            - cursor: opaque cursor from the '_next' or '_prev' link of a previous page.
+            - limit: maximum number of stars per page.
+
         Returns:
-            - list of all stars of a user.
+            - page of stars of a user ordered by creation time.
         """
 
         queryset = Star.objects.filter(creator=user_pk)
-        serializer = StarSerializer(queryset, many=True, context={'request': request, 'action': 'list'})
-        return LinkedCollectionResponse(serializer.data, request)
+        return get_collection_response(request, queryset, StarSerializer, parent=self.get_parent_queryset())
 
     def retrieve(self, request, pk=None, user_pk=None):
         """
@@ -246,12 +504,49 @@ class UserStarViewSet(viewsets.ViewSet):
         Returns:
             - single star object of the specified user.
         """
-        queryset = Star.objects.filter(pk=pk, creator=user_pk)
+        context = {'request': request, 'action': 'retrieve'}
+        queryset = plan_queryset(Star.objects.filter(pk=pk, creator=user_pk), StarSerializer, context)
         star = get_object_or_404(queryset, pk=pk)
-        serializer = StarSerializer(star, context={'request': request, 'action': 'retrieve'})
+        serializer = StarSerializer(star, context=context)
         return LinkedInstanceResponse(serializer.data, request)
 
-class PointViewSet(mixins.CreateModelMixin,
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def bulk(self, request, user_pk=None):
+        """
+        Star and unstar many points for a user at once.
+
+        Path parameters:
+            - user_pk: id of the user whose stars are changed.
+
+        Body:
+            - list of operations, each with an 'op' ('add' to star a point or
+              'remove' to unstar it) and the id of the 'point'.
+
+        Errors:
+            - the user does not exist (404)
+            - the user is not the user of the stars (403)
+            - the body is not a list or has more than MAX_BULK_OPERATIONS items (400)
+
+        Returns:
+            - the results of the operations, in the order of the operations
+              (200 if every operation succeeded, else 207).
+        """
+
+        try:
+            user_id = int(user_pk)
+        except ValueError:
+            raise Http404
+
+        if request.user.id != user_id:
+            if not request.user.is_superuser:
+                raise PermissionDenied('Only the user can change their stars.')
+            get_object_or_404(User.objects.all(), pk=user_id)
+
+        results = change_stars(get_operations(request), user_id, {'request': request})
+        return get_bulk_response(request, results)
+
+class PointViewSet(ConditionalGetMixin,
+                   mixins.CreateModelMixin,
                    mixins.ListModelMixin,
                    mixins.RetrieveModelMixin,
                    mixins.UpdateModelMixin,
@@ -268,7 +563,7 @@ class PointViewSet(mixins.CreateModelMixin,
 
     permission_classes = (ActionPermission,)
     action_permissions = {
-        permissions.AllowAny: ['list', 'retrieve'],
+        permissions.AllowAny: ['list', 'retrieve', 'nearby', 'clusters', 'export'],
         permissions.IsAuthenticated: ['create'],
         IsCreator: ['update', 'destroy'],
     }
@@ -277,13 +572,22 @@ class PointViewSet(mixins.CreateModelMixin,
         """
         Get all points.
 
+        Query parameters:
+            - cursor: opaque cursor from the '_next' or '_prev' link of a previous page.
+            - limit: maximum number of points per page.
+            - bbox: only include points inside the bounding box 'minLon,minLat,maxLon,maxLat'.
+            - ordering: 'created' (default), '-created', 'star_count' or '-star_count'.
+
+        Errors:
+            - the ordering is not supported (400)
+
         Returns:
-            - list of all points.
+            - page of points in the requested order.
         """
 
-        queryset = Point.objects.filter()
-        serializer = PointSerializer(queryset, many=True, context={'request': request, 'action': 'list'})
-        return LinkedCollectionResponse(serializer.data, request)
+        ordering = get_point_ordering(request)
+        queryset = filter_points(Point.objects.filter(), request)
+        return get_collection_response(request, queryset, PointSerializer, ordering)
 
     def retrieve(self, request, pk=None):
         """
@@ -296,15 +600,15 @@ class PointViewSet(mixins.CreateModelMixin,
             - single point object.
         """
 
-        queryset = Point.objects.filter(pk=pk)
-        point = get_object_or_404(queryset, pk=pk)
-        serializer = PointSerializer(point, context={'request': request, 'action': 'retrieve'})
-        return LinkedInstanceResponse(serializer.data, request)
+        return get_point_response(request, Point.objects.filter(), pk)
 
     def update(self, request, *args, **kwargs):
         """
         Update a single point's details.
 
+        Errors:
+            - a point with the same name by the creator already exists (409)
+
         Returns:
             - updated point object.
         """
@@ -314,21 +618,27 @@ class PointViewSet(mixins.CreateModelMixin,
 
     def create(self, request, *args, **kwargs):
         """
-        Create a new point.
+        Create a new point, or many points from a list.
+
+        A list is created in bulk: every item is validated, and the valid items
+        that don't conflict with existing points (or earlier items) are created.
 
         Errors:
             - a point with the same name by the user already exists (409)
+            - the list has more than MAX_BULK_POINTS items (400)
 
         Returns:
-            - created point object.
+            - created point object, or for a list, the results of the items
+              (201 if every point was created, else 207).
         """
 
-        try:
-            point = Point.objects.get(name=request.data.get('name'), creator=request.user.id)
-            if point:
-                return Response({'detail': 'A point with this name by this user already exists.'}, status=409)
-        except Point.DoesNotExist:
-            pass
+        if isinstance(request.data, list):
+            if len(request.data) > MAX_BULK_POINTS:
+                raise ParseError('At most {} points can be created at a time.'.format(MAX_BULK_POINTS))
+
+            results = create_points(request.data, request.user, self.get_serializer_context())
+            created = all(result['status'] == 201 for result in results)
+            return LinkedCollectionResponse(results, request, status=201 if created else 207)
 
         response = super().create(request, *args, **kwargs)
         return LinkedInstanceResponse(response.data, request, status=201)
@@ -336,11 +646,148 @@ class PointViewSet(mixins.CreateModelMixin,
     def perform_create(self, serializer):
         """
         Set the current user as the creator of the point.
+        A point with the same name by the user gives a 409.
+
+        A new point has no comments, tags or stars, so they are not looked up
+        for its representation.
+        """
+
+        point = self.save_point(serializer, creator=self.request.user)
+        point._prefetched_objects_cache = {name: getattr(point, name).none() for name in ('comments', 'tags', 'stars')}
+
+    def perform_update(self, serializer):
+        """
+        Update the point, answering a name taken by another point of the creator with a 409.
+        """
+
+        self.save_point(serializer)
+
+    def save_point(self, serializer, **kwargs):
+        """
+        Save a point with a single write, answering a name taken by the creator with a 409.
+
+        Returns:
+            - the saved point
         """
 
-        serializer.save(creator=self.request.user)
+        instance = serializer.instance
+        name = serializer.validated_data.get('name', getattr(instance, 'name', None))
+        creator_id = instance.creator_id if instance is not None else self.request.user.id
+        return save_unique(
+            lambda: serializer.save(**kwargs),
+            lambda: Point.objects.filter(name=name, creator=creator_id).exclude(pk=getattr(instance, 'pk', None)).exists(),
+            'A point with this name by this user already exists.'
+        )
+
+    @action(detail=False, methods=['get'])
+    def nearby(self, request):
+        """
+        Get the points nearest to a location, ordered by great-circle distance.
+
+        Query parameters:
+            - lat: latitude of the location.
+            - lon: longitude of the location.
+            - radius: maximum distance from the location in meters (default: unlimited).
+            - k: maximum number of points per page (default: 10).
+            - cursor: opaque cursor from the '_next' or '_prev' link of a previous page.
+            - bbox: only include points inside the bounding box 'minLon,minLat,maxLon,maxLat'.
+
+        Errors:
+            - the location or the radius is missing, malformed or out of range (400)
+
+        Returns:
+            - page of points with their 'distance' in meters from the location.
+        """
+
+        latitude = get_float_param(request, 'lat', -90, 90)
+        longitude = get_float_param(request, 'lon', -180, 180)
+        radius = get_float_param(request, 'radius', 0, MAX_DISTANCE, default=MAX_DISTANCE)
+
+        paginator = DistancePagination()
+        queryset = filter_points(Point.objects.all(), request)
+        page = paginator.paginate_nearby(queryset, request, latitude, longitude, radius)
+        ids = [row['id'] for row in page]
+
+        context = {'request': request, 'action': 'list', 'path': reverse('point-list')}
+        compiled = get_compiled_serializer(PointSerializer, context)
+
+        if compiled is not None:
+            points = {row['id']: row for row in compiled.get_queryset(Point.objects.filter(pk__in=ids))}
+            page = [row for row in page if row['id'] in points]
+            data = compiled.serialize([points[row['id']] for row in page])
+        else:
+            queryset = plan_queryset(Point.objects.filter(pk__in=ids), PointSerializer, context)
+            points = {point.pk: point for point in queryset}
+            page = [row for row in page if row['id'] in points]
+            data = PointSerializer([points[row['id']] for row in page], many=True, context=context).data
+
+        for item, row in zip(data, page):
+            item['distance'] = round(row['distance'], 3)
+
+        return LinkedCollectionResponse(data, request, links=paginator.get_links())
+
+    @action(detail=False, methods=['get'])
+    def clusters(self, request):
+        """
+        Get the points in a bounding box aggregated into clusters on a grid of the map zoom level.
 
-class PointCommentViewSet(mixins.CreateModelMixin,
+        The clusters are cached per zoom level until the points change.
+
+        Query parameters:
+            - zoom: the map zoom level (0-20).
+            - bbox: the bounding box 'minLon,minLat,maxLon,maxLat' (default: the whole world).
+
+        Errors:
+            - the zoom level or the bounding box is missing, malformed or out of range (400)
+            - the bounding box has too many grid cells at the zoom level (400)
+
+        Returns:
+            - clusters with the 'cell', 'count', centroid 'latitude' and 'longitude' and sample 'ids'
+              of their points.
+        """
+
+        zoom = int(get_float_param(request, 'zoom', 0, MAX_ZOOM))
+        bbox = request.query_params.get('bbox')
+        bbox = parse_bbox(bbox) if bbox else (-180, -90, 180, 90)
+
+        # The clusters depend on the locations of the points only, and the point version
+        # is not changed by the comment, tag and star counts (see point_child_changed).
+        version, _ = Version.objects.get_versions(['point'])['point']
+        key = '{}:{}'.format(get_cluster_cache_key(*bbox, zoom), version)
+        clusters = cache.get(key)
+        if clusters is None:
+            clusters = get_clusters(Point.objects.all(), *bbox, zoom)
+            cache.set(key, clusters, CLUSTER_CACHE_TIMEOUT)
+
+        return LinkedCollectionResponse(clusters, request)
+
+    @action(detail=False, methods=['get'], renderer_classes=[GeoJSONRenderer])
+    def export(self, request, format=None):
+        """
+        Export all the points as a streamed GeoJSON FeatureCollection.
+
+        URL: /points/export.geojson
+
+        Query parameters:
+            - bbox: only include points inside the bounding box 'minLon,minLat,maxLon,maxLat'.
+            - ordering: one of 'created' (default), '-created', 'star_count' or '-star_count'.
+
+        Errors:
+            - the bounding box or the ordering is malformed (400)
+
+        Returns:
+            - feature collection of every matching point, with the username of its creator
+              and the names of its tags.
+        """
+
+        queryset = filter_points(Point.objects.all(), request).order_by(*get_point_ordering(request))
+        url = request.build_absolute_uri(reverse('point-detail', kwargs={'pk': '~pk~'})).replace('~pk~', '{}')
+        chunks = iterate_feature_chunks(queryset, url)
+        return StreamingFeatureCollectionResponse(chunks, request.accepted_renderer)
+
+class PointCommentViewSet(NestedParentMixin,
+                          ConditionalGetMixin,
+                          mixins.CreateModelMixin,
                           mixins.ListModelMixin,
                           mixins.RetrieveModelMixin,
                           mixins.UpdateModelMixin,
@@ -352,8 +799,12 @@ class PointCommentViewSet(mixins.CreateModelMixin,
     URLs: /points/:point_id/comments/, /points/:point_id/comments/:comment_id/
     """
 
+    version_names = ('point', 'comment', 'user')
 
     serializer_class = CommentSerializer
+    parent_model = Point
+    parent_lookup = 'point_pk'
+    parent_field = 'point'
     queryset = Comment.objects.filter()
 
     permission_classes = (ActionPermission,)
@@ -363,17 +814,6 @@ class PointCommentViewSet(mixins.CreateModelMixin,
         IsCreator: ['update', 'destroy'],
     }
 
-    def initial(self, request, *args, **kwargs):
-        """
-        Ensure that the specified point exists before handling any actions.
-
-        Path parameters:
-            - point_pk: id of the point whose comments are of interest.
-        """
-
-        get_object_or_404(Point.objects.all(), pk=kwargs['point_pk'])
-        return super().initial(request, args, kwargs)
-
     def list(self, request, point_pk=None):
         """
         Get all comments for a specified point.
@@ -381,13 +821,16 @@ class PointCommentViewSet(mixins.CreateModelMixin,
         Path parameters:
             - user_pk: id of the point whose comments are retrieved.
 
+        Query parameters:
+            - cursor: opaque cursor from the '_next' or '_prev' link of a previous page.
+            - limit: maximum number of comments per page.
+
         Returns:
-            - list of all comments for a point.
+            - page of comments for a point ordered by creation time.
         """
 
         queryset = Comment.objects.filter(point=point_pk)
-        serializer = CommentSerializer(queryset, many=True, context={'request': request, 'action': 'list'})
-        return LinkedCollectionResponse(serializer.data, request)
+        return get_collection_response(request, queryset, CommentSerializer, parent=self.get_parent_queryset())
 
     def retrieve(self, request, pk=None, point_pk=None):
         """
@@ -401,9 +844,10 @@ class PointCommentViewSet(mixins.CreateModelMixin,
             - single comment object.
         """
 
-        queryset = Comment.objects.filter(pk=pk, point=point_pk)
+        context = {'request': request, 'action': 'retrieve'}
+        queryset = plan_queryset(Comment.objects.filter(pk=pk, point=point_pk), CommentSerializer, context)
         comment = get_object_or_404(queryset, pk=pk)
-        serializer = CommentSerializer(comment, context={'request': request, 'action': 'retrieve'})
+        serializer = CommentSerializer(comment, context=context)
         return LinkedInstanceResponse(serializer.data, request)
 
     def update(self, request, *args, **kwargs):
@@ -439,9 +883,11 @@ class PointCommentViewSet(mixins.CreateModelMixin,
             - point_pk: id of the point the comment is for.
         """
 
-        serializer.save(creator=self.request.user, point_id=self.kwargs['point_pk'])
+        serializer.save(creator=self.request.user, point=self.parent)
 
-class PointTagViewSet(mixins.CreateModelMixin,
+class PointTagViewSet(NestedParentMixin,
+                      ConditionalGetMixin,
+                      mixins.CreateModelMixin,
                       mixins.ListModelMixin,
                       mixins.RetrieveModelMixin,
                       mixins.UpdateModelMixin,
@@ -453,26 +899,21 @@ class PointTagViewSet(mixins.CreateModelMixin,
     URLs: /points/:point_id/tags/, /points/:point_id/tags/:tag_id/
     """
 
+    version_names = ('point', 'tag', 'user')
+
     serializer_class = TagSerializer
+    parent_model = Point
+    parent_lookup = 'point_pk'
+    parent_field = 'point'
+    parent_actions = ('create', 'bulk')
     queryset = Tag.objects.filter()
 
     permission_classes = (ActionPermission,)
     action_permissions = {
         permissions.AllowAny: ['list', 'retrieve'],
-        IsCreator: ['create', 'update', 'destroy'],
+        IsCreator: ['create', 'update', 'destroy', 'bulk'],
     }
 
-    def initial(self, request, *args, **kwargs):
-        """
-        Ensure that the specified point exists before handling any actions.
-
-        Path parameters:
-            - point_pk: id of the point whose tags are of interest.
-        """
-
-        get_object_or_404(Point.objects.all(), pk=kwargs['point_pk'])
-        return super().initial(request, args, kwargs)
-
     def list(self, request, point_pk=None):
         """
         Get all tags for a specified point.
@@ -480,13 +921,16 @@ class PointTagViewSet(mixins.CreateModelMixin,
         Path parameters:
             - user_pk: id of the point whose tags are retrieved.
 
+        Query parameters:
+            - cursor: opaque cursor from the '_next' or '_prev' link of a previous page.
+            - limit: maximum number of tags per page.
+
         Returns:
-            - list of all tags for a point.
+            - page of tags for a point ordered by creation time.
         """
 
         queryset = Tag.objects.filter(point=point_pk)
-        serializer = TagSerializer(queryset, many=True, context={'request': request, 'action': 'list'})
-        return LinkedCollectionResponse(serializer.data, request)
+        return get_collection_response(request, queryset, TagSerializer, parent=self.get_parent_queryset())
 
     def retrieve(self, request, pk=None, point_pk=None):
         """
@@ -500,9 +944,10 @@ class PointTagViewSet(mixins.CreateModelMixin,
             - single tag object.
         """
 
-        queryset = Tag.objects.filter(pk=pk, point=point_pk)
+        context = {'request': request, 'action': 'retrieve'}
+        queryset = plan_queryset(Tag.objects.filter(pk=pk, point=point_pk), TagSerializer, context)
         tag = get_object_or_404(queryset, pk=pk)
-        serializer = TagSerializer(tag, context={'request': request, 'action': 'retrieve'})
+        serializer = TagSerializer(tag, context=context)
         return LinkedInstanceResponse(serializer.data, request)
 
     def update(self, request, *args, **kwargs):
@@ -525,13 +970,13 @@ class PointTagViewSet(mixins.CreateModelMixin,
 
         Errors:
             - the creator of the tag is not the creator of the point (403)
+            - a tag with the same name already exists for the point (409)
 
         Returns:
             - created tag object.
         """
 
-        point = get_object_or_404(Point.objects.filter(id=self.kwargs['point_pk']))
-        if point.creator.id != request.user.id:
+        if self.parent.creator_id != request.user.id:
             return Response({'detail': 'Only the creator of the point can create tags for it.'}, status=403)
 
         response = super().create(request, *args, **kwargs)
@@ -545,9 +990,42 @@ class PointTagViewSet(mixins.CreateModelMixin,
             - point_pk: id of the point the tag is for.
         """
 
-        serializer.save(creator=self.request.user, point_id=self.kwargs['point_pk'])
+        name = serializer.validated_data.get('name')
+        save_unique(
+            lambda: serializer.save(creator=self.request.user, point=self.parent),
+            lambda: Tag.objects.filter(name=name, point=self.parent).exists(),
+            'A tag with this name already exists for this point.'
+        )
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request, point_pk=None):
+        """
+        Add and remove many tags of a point at once.
+
+        Path parameters:
+            - point_pk: id of the point the tags are for.
+
+        Body:
+            - list of operations, each with an 'op' ('add' or 'remove') and the 'name' of the tag.
+
+        Errors:
+            - the user is not the creator of the point (403)
+            - the body is not a list or has more than MAX_BULK_OPERATIONS items (400)
+
+        Returns:
+            - the results of the operations, in the order of the operations
+              (200 if every operation succeeded, else 207).
+        """
 
-class PointStarViewSet(mixins.CreateModelMixin,
+        if self.parent.creator_id != request.user.id:
+            return Response({'detail': 'Only the creator of the point can change its tags.'}, status=403)
+
+        results = change_tags(get_operations(request), self.parent, request.user.id, {'request': request})
+        return get_bulk_response(request, results)
+
+class PointStarViewSet(NestedParentMixin,
+                       ConditionalGetMixin,
+                       mixins.CreateModelMixin,
                        mixins.ListModelMixin,
                        mixins.RetrieveModelMixin,
                        mixins.DestroyModelMixin,
@@ -558,7 +1036,13 @@ class PointStarViewSet(mixins.CreateModelMixin,
     URLs: /points/:point_id/stars/, /points/:point_id/stars/:star_id/
     """
 
+    version_names = ('point', 'star', 'user')
+
     serializer_class = StarSerializer
+    parent_model = Point
+    parent_lookup = 'point_pk'
+    parent_field = 'point'
+    parent_actions = ()
     queryset = Star.objects.filter()
 
     permission_classes = (ActionPermission,)
@@ -568,17 +1052,6 @@ class PointStarViewSet(mixins.CreateModelMixin,
         IsCreator: ['destroy'],
     }
 
-    def initial(self, request, *args, **kwargs):
-        """
-        Ensure that the specified point exists before handling any actions.
-
-        Path parameters:
-            - point_pk: id of the point whose stars are of interest.
-        """
-
-        get_object_or_404(Point.objects.all(), pk=kwargs['point_pk'])
-        return super().initial(request, args, kwargs)
-
     def list(self, request, point_pk=None):
         """
         Get all stars for a specified point.
@@ -586,13 +1059,16 @@ class PointStarViewSet(mixins.CreateModelMixin,
         Path parameters:
             - user_pk: id of the point whose stars are retrieved.
 
+        Query parameters:
+            - cursor: opaque cursor from the '_next' or '_prev' link of a previous page.
+            - limit: maximum number of stars per page.
+
         Returns:
-            - list of all stars for a point.
+            - page of stars for a point ordered by creation time.
         """
 
         queryset = Star.objects.filter(point=point_pk)
-        serializer = StarSerializer(queryset, many=True, context={'request': request, 'action': 'list'})
-        return LinkedCollectionResponse(serializer.data, request)
+        return get_collection_response(request, queryset, StarSerializer, parent=self.get_parent_queryset())
 
     def retrieve(self, request, pk=None, point_pk=None):
         """
@@ -606,9 +1082,10 @@ class PointStarViewSet(mixins.CreateModelMixin,
             - single star object.
         """
 
-        queryset = Star.objects.filter(pk=pk, point=point_pk)
+        context = {'request': request, 'action': 'retrieve'}
+        queryset = plan_queryset(Star.objects.filter(pk=pk, point=point_pk), StarSerializer, context)
         star = get_object_or_404(queryset, pk=pk)
-        serializer = StarSerializer(star, context={'request': request, 'action': 'retrieve'})
+        serializer = StarSerializer(star, context=context)
         return LinkedInstanceResponse(serializer.data, request)
 
     def create(self, request, *args, **kwargs):
@@ -625,13 +1102,6 @@ class PointStarViewSet(mixins.CreateModelMixin,
             - created star object.
         """
 
-        try:
-            star = Star.objects.get(point=self.kwargs['point_pk'], creator=request.user.id)
-            if star:
-                return Response({'detail': 'A star for this point by this user already exists.'}, status=409)
-        except Star.DoesNotExist:
-            pass
-
         response = super().create(request, *args, **kwargs)
         return LinkedInstanceResponse(response.data, request, status=201)
 
@@ -639,8 +1109,92 @@ class PointStarViewSet(mixins.CreateModelMixin,
         """
         Set the current user as the creator of the star and the point as the target point.
 
+        Only the id of the point is looked up, a missing point gives a 404.
+
         Path parameters:
             - point_pk: id of the point the star is for.
         """
 
-        serializer.save(creator=self.request.user, point_id=self.kwargs['point_pk'])
+        point_id = get_object_or_404(Point.objects.values_list('id', flat=True), pk=self.kwargs['point_pk'])
+        # The links of the star only need the pk of its point.
+        point = Point(id=point_id)
+        save_unique(
+            lambda: serializer.save(creator=self.request.user, point=point),
+            lambda: Star.objects.filter(point=point_id, creator=self.request.user.id).exists(),
+            'A star for this point by this user already exists.'
+        )
+
+class TileView(APIView):
+    """
+    Handle the read action for the web mercator tiles of the points.
+
+    URLs: /tiles/:z/:x/:y.json
+    """
+
+    permission_classes = (permissions.AllowAny,)
+
+    def get(self, request, z, x, y):
+        """
+        Get the points (or the clusters of points at low zoom levels) inside a tile.
+
+        Tiles are rendered once and kept in the file-backed 'tiles' cache until
+        a point inside them is created, updated or deleted.
+
+        Path parameters:
+            - z: zoom level of the tile (0-20).
+            - x, y: column and row of the tile.
+
+        Errors:
+            - the tile does not exist (404)
+
+        Returns:
+            - points with their '_url', 'id', 'name', 'latitude' and 'longitude',
+              or clusters as returned by /points/clusters/.
+        """
+
+        z, x, y = int(z), int(x), int(y)
+        if z > MAX_ZOOM or x >= 1 << z or y >= 1 << z:
+            raise NotFound('Tile not found.')
+
+        builder = get_link_builder(request)
+        items = [
+            {**item, '_url': builder.get_url(item['_url'])} if '_url' in item else item
+            for item in get_cached_tile(Point.objects.all(), z, x, y)
+        ]
+        return LinkedCollectionResponse(items, request)
+
+class SyncView(APIView):
+    """
+    Handle the delta sync of the points, comments, tags and stars for the clients
+    that keep copies of them.
+
+    URL: /sync/
+    """
+
+    permission_classes = (permissions.AllowAny,)
+
+    def get(self, request):
+        """
+        Get the points, comments, tags and stars created, updated or deleted since a sync token.
+
+        A client syncs without a token first to get every instance, then syncs with
+        the token of the previous response to get the changes since. While 'more'
+        is true, the client syncs again right away with the new token. The changes
+        must be applied idempotently, since the latest ones may be sent twice.
+
+        Query parameters:
+            - since: the token of the previous sync (default: a full sync).
+
+        Errors:
+            - the token is malformed (400)
+            - the token has expired, i.e. it is older than the deletions are kept (410)
+
+        Returns:
+            - the changed points, comments, tags and stars in the representations of
+              their collections, the ids of the deleted ones under 'deleted', the
+              token of the next sync ('token') and whether there are more changes ('more').
+        """
+
+        data = get_sync_data(request, request.query_params.get('since'))
+        builder = get_link_builder(request)
+        return Response({**data, '_url': builder.url, '_parent': builder.parent_url})
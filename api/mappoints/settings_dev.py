@@ -35,6 +35,7 @@ CORS_ORIGIN_WHITELIST = (
 )
 
 JWT_AUTH = {
+    'JWT_PAYLOAD_HANDLER': 'mappoints.core.handlers.jwt_payload_handler',
     'JWT_RESPONSE_PAYLOAD_HANDLER': 'mappoints.core.handlers.jwt_response_payload_handler',
     'JWT_EXPIRATION_DELTA': datetime.timedelta(weeks=1),
 }
@@ -43,6 +44,8 @@ JWT_AUTH = {
 
 TEST_URL = "http://testserver"
 
+TEST_RUNNER = 'mappoints.core.tests.runner.TileCacheTestRunner'
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -59,6 +62,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'mappoints.core.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -71,7 +75,7 @@ MIDDLEWARE = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_jwt.authentication.JSONWebTokenAuthentication',
+        'mappoints.core.authentication.ClaimsJSONWebTokenAuthentication',
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
@@ -80,8 +84,17 @@ REST_FRAMEWORK = {
     ),
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',
+        'mappoints.core.renderers.MessagePackRenderer',
+        'mappoints.core.renderers.CBORRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer'
     ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'mappoints.core.parsers.MessagePackParser',
+        'mappoints.core.parsers.CBORParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser'
+    ],
     'URL_FIELD_NAME': '_url',
     'TEST_REQUEST_DEFAULT_FORMAT': 'json'
 }
@@ -122,6 +135,51 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'representations': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'representations',
+        'TIMEOUT': 3600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    # Compressed bodies of anonymous responses, keyed by their ETag.
+    'compressed': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'compressed',
+        'TIMEOUT': 3600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+    # The development server runs a single process, so its token versions can be cached in
+    # its memory (see settings_prod for the workers of the production server).
+    'tokens': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tokens',
+        'TIMEOUT': 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    'tiles': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'tiles'),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
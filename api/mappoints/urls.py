@@ -26,6 +26,8 @@ urlpatterns = [
     url(r'^', include(router.urls)),
     url(r'^', include(users_router.urls)),
     url(r'^', include(points_router.urls)),
+    url(r'^tiles/(?P<z>[0-9]+)/(?P<x>[0-9]+)/(?P<y>[0-9]+)\.json$', views.TileView.as_view(), name='tile'),
+    url(r'^sync/$', views.SyncView.as_view(), name='sync'),
     url(r'^auth/', include('rest_framework.urls', namespace='rest_framework')),
     url(r'^admin/', admin.site.urls),
     url(r'^api-token-auth/', obtain_jwt_token),